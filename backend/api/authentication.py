@@ -0,0 +1,115 @@
+import copy
+import hashlib
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from foodgram_backend.settings import (
+    TOKEN_CACHE_SHARED, TOKEN_CACHE_TIMEOUT, TOKEN_SHARED_CACHE_TIMEOUT)
+from .metrics import count_cache
+
+MAX_CACHED_TOKENS = 10000
+# Fields of the user kept in the shared cache: what authentication and
+# the user serializers read. The password hash never leaves the
+# database, the other fields are loaded on access.
+SHARED_USER_FIELDS = ('id', 'username', 'email', 'first_name', 'last_name',
+                      'is_active', 'is_staff', 'is_superuser')
+
+User = get_user_model()
+
+
+def dump_user(user):
+    return tuple(getattr(user, field) for field in SHARED_USER_FIELDS)
+
+
+def load_user(values):
+    """
+    Builds a user with the other fields deferred. from_db() expects
+    the values in the order of the model fields.
+    """
+    values = dict(zip(SHARED_USER_FIELDS, values))
+    fields = [field.attname for field in User._meta.concrete_fields
+              if field.attname in values]
+    return User.from_db(DEFAULT_DB_ALIAS, fields,
+                        [values[field] for field in fields])
+
+
+class TokenCache:
+    """
+    Process-local map of token keys to users kept for
+    TOKEN_CACHE_TIMEOUT seconds. With TOKEN_CACHE_SHARED the users
+    are also kept in the Django cache shared by all processes,
+    as the values of SHARED_USER_FIELDS.
+
+    Invalidation drops the local and the shared entries, other
+    processes forget their local copies when they expire.
+    """
+    def __init__(self):
+        self.users = {}
+
+    @staticmethod
+    def get_shared_key(key):
+        return f'token:{hashlib.sha256(key.encode()).hexdigest()}'
+
+    def get(self, key):
+        entry = self.users.get(key)
+        if entry is not None and entry[1] > time.monotonic():
+            return entry[0]
+        if not TOKEN_CACHE_SHARED:
+            return None
+        values = cache.get(self.get_shared_key(key))
+        if values is None:
+            return None
+        user = load_user(values)
+        self.remember(key, user)
+        return user
+
+    def set(self, key, user):
+        if TOKEN_CACHE_SHARED:
+            cache.set(self.get_shared_key(key), dump_user(user),
+                      TOKEN_SHARED_CACHE_TIMEOUT)
+        self.remember(key, user)
+
+    def remember(self, key, user):
+        if len(self.users) >= MAX_CACHED_TOKENS:
+            now = time.monotonic()
+            self.users = {key: entry for key, entry
+                          in list(self.users.items()) if entry[1] > now}
+            if len(self.users) >= MAX_CACHED_TOKENS:
+                self.users = {}
+        self.users[key] = (user, time.monotonic() + TOKEN_CACHE_TIMEOUT)
+
+    def invalidate(self, keys):
+        keys = list(keys)
+        for key in keys:
+            self.users.pop(key, None)
+        if TOKEN_CACHE_SHARED:
+            cache.delete_many([self.get_shared_key(key) for key in keys])
+
+    def clear(self):
+        self.users = {}
+
+
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication that looks the token up in the database
+    only when its user is not cached.
+
+    Every request gets its own copy of the cached user.
+    """
+    def authenticate_credentials(self, key):
+        user = token_cache.get(key)
+        count_cache('token', user is not None)
+        if user is None:
+            user, token = super().authenticate_credentials(key)
+            token_cache.set(key, copy.copy(user))
+            return user, token
+        user = copy.copy(user)
+        return user, Token(key=key, user=user)
@@ -0,0 +1,583 @@
+import json
+import math
+import platform
+import random
+import time
+import tracemalloc
+from collections import namedtuple
+from itertools import islice
+
+import django
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.management.color import no_style
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from jobs.models import Job
+from jobs.registry import enqueue
+from recipes import relations
+from recipes.counters import reconcile_counters
+from recipes.models import (
+    Favourite, Ingredient, Recipe, RecipeIngredient, RecipeTag,
+    ShoppingCart, Tag)
+from recipes.shopping_list import rebuild as rebuild_shopping_lists
+from users.models import Subscription
+from . import bulk
+from .cache import INGREDIENTS_VERSION, TAGS_VERSION, bump_version
+from .search import get_search_backend
+
+User = get_user_model()
+
+Scale = namedtuple('Scale', 'users recipes favorites')
+Case = namedtuple('Case', 'name func setup')
+
+SCALES = {
+    'tiny': Scale(20, 100, 300),
+    'small': Scale(100, 1000, 5000),
+    'medium': Scale(1000, 10000, 100000),
+    'large': Scale(10000, 100000, 1000000),
+}
+TAGS = 10
+INGREDIENTS = 2000
+CARTS_PER_USER = 5
+SUBSCRIPTIONS_PER_USER = 5
+BULK_SIZE = 10
+BATCH_SIZE = 5000
+PASSWORD = 'benchmark'
+IMAGE = ('data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAIAAACQd1'
+         'PeAAAADElEQVR4nGNgYGAAAAAEAAH2FzhVAAAAAElFTkSuQmCC')
+
+
+def bulk_insert(model, objects):
+    objects = iter(objects)
+    while True:
+        batch = list(islice(objects, BATCH_SIZE))
+        if not batch:
+            return
+        model.objects.bulk_create(batch)
+
+
+def sample_pairs(rng, owners, targets, total, exclude_self=False):
+    """
+    Yields distinct (owner, target) id pairs, spread evenly over owners.
+    """
+    per_owner = -(-total // owners)
+    left = total
+    for owner in range(1, owners + 1):
+        count = min(per_owner, left, targets - exclude_self)
+        picks = rng.sample(range(1, targets + 1), count + exclude_self)
+        for target in [pick for pick in picks if pick != owner][:count]:
+            yield owner, target
+        left -= count
+
+
+def seed(scale, seed=0):
+    """
+    Fills an empty database with a deterministic synthetic dataset.
+
+    Rows are written with bulk_create and explicit ids, so no signals
+    are sent; counters are reconciled and the search index is rebuilt
+    afterwards.
+    """
+    rng = random.Random(seed)
+    password = make_password(PASSWORD)
+    bulk_insert(User, (
+        User(id=i, username=f'user{i}', email=f'user{i}@example.com',
+             first_name='Имя', last_name='Фамилия', password=password)
+        for i in range(1, scale.users + 1)))
+    bulk_insert(Tag, (
+        Tag(id=i, name=f'Тег {i}', color=f'#{i:06X}', slug=f'tag{i}')
+        for i in range(1, TAGS + 1)))
+    bulk_insert(Ingredient, (
+        Ingredient(id=i, name=f'ингредиент {i}', measurement_unit='г')
+        for i in range(1, INGREDIENTS + 1)))
+    bulk_insert(Recipe, (
+        Recipe(id=i, author_id=rng.randint(1, scale.users),
+               name=f'Рецепт {i}', image='recipes/images/benchmark.png',
+               text=f'Описание рецепта {i}',
+               cooking_time=rng.randint(1, 120))
+        for i in range(1, scale.recipes + 1)))
+    bulk_insert(RecipeTag, (
+        RecipeTag(recipe_id=recipe, tag_id=tag)
+        for recipe in range(1, scale.recipes + 1)
+        for tag in rng.sample(range(1, TAGS + 1), rng.randint(1, 3))))
+    bulk_insert(RecipeIngredient, (
+        RecipeIngredient(recipe_id=recipe, ingredient_id=ingredient,
+                         amount=rng.randint(1, 500))
+        for recipe in range(1, scale.recipes + 1)
+        for ingredient in rng.sample(range(1, INGREDIENTS + 1),
+                                     rng.randint(5, 12))))
+    bulk_insert(Favourite, (
+        Favourite(user_id=user, recipe_id=recipe) for user, recipe
+        in sample_pairs(rng, scale.users, scale.recipes, scale.favorites)))
+    bulk_insert(ShoppingCart, (
+        ShoppingCart(user_id=user, recipe_id=recipe) for user, recipe
+        in sample_pairs(rng, scale.users, scale.recipes,
+                        scale.users * CARTS_PER_USER)))
+    bulk_insert(Subscription, (
+        Subscription(subscriber_id=user, subscribing_id=author)
+        for user, author in sample_pairs(
+            rng, scale.users, scale.users,
+            scale.users * SUBSCRIPTIONS_PER_USER, exclude_self=True)))
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(
+                no_style(), [User, Tag, Ingredient, Recipe]):
+            cursor.execute(sql)
+    reconcile_counters()
+    rebuild_shopping_lists()
+    backend = get_search_backend()
+    backend.install()
+    for recipe_id in range(1, scale.recipes + 1):
+        backend.index(recipe_id)
+    bump_version(TAGS_VERSION)
+    bump_version(INGREDIENTS_VERSION)
+
+
+class Context:
+    """
+    Clients and ids the benchmark cases work with.
+    """
+    def __init__(self):
+        self.user = User.objects.get(pk=1)
+        token, _ = Token.objects.get_or_create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.anonymous = APIClient()
+        self.recipe_id = Recipe.objects.exclude(
+            author=self.user).values_list('id', flat=True).first()
+        self.author_id = User.objects.exclude(
+            pk=self.user.pk).values_list('id', flat=True).first()
+        self.recipe_ids = list(Recipe.objects.exclude(
+            author=self.user).values_list('id', flat=True)[:BULK_SIZE])
+        self.author_ids = list(User.objects.exclude(
+            pk=self.user.pk).values_list('id', flat=True)[:BULK_SIZE])
+        self.own_recipe_id = None
+        self.job_id = None
+        self.iteration = 0
+
+    def create_recipe(self):
+        self.iteration += 1
+        return Recipe.objects.create(
+            author=self.user, name=f'Бенчмарк {self.iteration}',
+            image='recipes/images/benchmark.png', text='Описание',
+            cooking_time=10).id
+
+
+CASES = []
+
+
+def case(name, setup=None):
+    """
+    Registers a benchmark case: a function sending one request.
+    setup runs before every request and is not measured.
+    """
+    def decorator(func):
+        CASES.append(Case(name, func, setup))
+        return func
+    return decorator
+
+
+@case('tags-list')
+def tags_list(ctx):
+    return ctx.anonymous.get('/api/tags/')
+
+
+@case('tags-detail')
+def tags_detail(ctx):
+    return ctx.anonymous.get('/api/tags/1/')
+
+
+@case('ingredients-list')
+def ingredients_list(ctx):
+    return ctx.anonymous.get('/api/ingredients/')
+
+
+@case('ingredients-search')
+def ingredients_search(ctx):
+    return ctx.anonymous.get('/api/ingredients/', {'name': 'ингредиент 1'})
+
+
+@case('ingredients-detail')
+def ingredients_detail(ctx):
+    return ctx.anonymous.get('/api/ingredients/1/')
+
+
+@case('recipes-list-anonymous')
+def recipes_list_anonymous(ctx):
+    return ctx.anonymous.get('/api/recipes/')
+
+
+@case('recipes-list')
+def recipes_list(ctx):
+    return ctx.client.get('/api/recipes/', {'page': 3, 'limit': 12})
+
+
+@case('recipes-list-filtered')
+def recipes_list_filtered(ctx):
+    return ctx.client.get('/api/recipes/', {
+        'tags': ['tag1', 'tag2'], 'is_favorited': 1})
+
+
+@case('recipes-list-cursor')
+def recipes_list_cursor(ctx):
+    return ctx.client.get('/api/recipes/', {'pagination': 'cursor'})
+
+
+@case('recipes-search')
+def recipes_search(ctx):
+    return ctx.client.get('/api/recipes/', {'search': 'рецепт ингредиент'})
+
+
+@case('recipes-detail')
+def recipes_detail(ctx):
+    return ctx.client.get(f'/api/recipes/{ctx.recipe_id}/')
+
+
+def recipe_data(ctx):
+    return {
+        'name': f'Бенчмарк {ctx.iteration}',
+        'text': 'Описание',
+        'cooking_time': 10,
+        'image': IMAGE,
+        'tags': [1, 2],
+        'ingredients': [{'id': i, 'amount': ctx.iteration + 1}
+                        for i in range(1, 11)],
+    }
+
+
+def next_iteration(ctx):
+    ctx.iteration += 1
+
+
+def own_recipe(ctx):
+    if ctx.own_recipe_id is None:
+        ctx.own_recipe_id = ctx.create_recipe()
+    ctx.iteration += 1
+
+
+def new_recipe(ctx):
+    ctx.own_recipe_id = ctx.create_recipe()
+
+
+@case('recipes-create', setup=next_iteration)
+def recipes_create(ctx):
+    return ctx.client.post('/api/recipes/', recipe_data(ctx),
+                           format='json')
+
+
+@case('recipes-update', setup=own_recipe)
+def recipes_update(ctx):
+    return ctx.client.patch(f'/api/recipes/{ctx.own_recipe_id}/',
+                            recipe_data(ctx), format='json')
+
+
+def remove_favorite(ctx):
+    relations.delete(Favourite.objects.filter(
+        user=ctx.user, recipe=ctx.recipe_id))
+
+
+def add_favorite(ctx):
+    Favourite.objects.get_or_create(user=ctx.user, recipe_id=ctx.recipe_id)
+
+
+@case('recipes-favorite-add', setup=remove_favorite)
+def favorite_add(ctx):
+    return ctx.client.post(f'/api/recipes/{ctx.recipe_id}/favorite/')
+
+
+@case('recipes-favorite-remove', setup=add_favorite)
+def favorite_remove(ctx):
+    return ctx.client.delete(f'/api/recipes/{ctx.recipe_id}/favorite/')
+
+
+def remove_from_cart(ctx):
+    relations.delete(ShoppingCart.objects.filter(
+        user=ctx.user, recipe=ctx.recipe_id))
+
+
+def add_to_cart(ctx):
+    ShoppingCart.objects.get_or_create(
+        user=ctx.user, recipe_id=ctx.recipe_id)
+
+
+@case('recipes-shopping-cart-add', setup=remove_from_cart)
+def shopping_cart_add(ctx):
+    return ctx.client.post(f'/api/recipes/{ctx.recipe_id}/shopping_cart/')
+
+
+@case('recipes-shopping-cart-remove', setup=add_to_cart)
+def shopping_cart_remove(ctx):
+    return ctx.client.delete(
+        f'/api/recipes/{ctx.recipe_id}/shopping_cart/')
+
+
+def clear_cache(ctx):
+    cache.clear()
+
+
+@case('shopping-cart-download-pdf', setup=clear_cache)
+def download_pdf(ctx):
+    return ctx.client.get('/api/recipes/download_shopping_cart/')
+
+
+@case('shopping-cart-download-txt', setup=clear_cache)
+def download_txt(ctx):
+    return ctx.client.get('/api/recipes/download_shopping_cart/',
+                          {'format': 'txt'})
+
+
+@case('shopping-cart-download-cached')
+def download_cached(ctx):
+    return ctx.client.get('/api/recipes/download_shopping_cart/',
+                          {'format': 'csv'})
+
+
+@case('shopping-cart-download-async')
+def download_async(ctx):
+    return ctx.client.get('/api/recipes/download_shopping_cart/',
+                          {'format': 'txt', 'async': 1})
+
+
+def create_job(ctx):
+    if ctx.job_id is None:
+        ctx.job_id = enqueue('export_shopping_list', owner=ctx.user,
+                             user_id=ctx.user.id, format='txt').pk
+
+
+@case('jobs-detail', setup=create_job)
+def jobs_detail(ctx):
+    return ctx.client.get(f'/api/jobs/{ctx.job_id}/')
+
+
+def finish_job(ctx):
+    create_job(ctx)
+    Job.objects.filter(pk=ctx.job_id).update(
+        status=Job.Status.DONE, result=b'', content_type='text/plain',
+        filename='shopping_list.txt')
+
+
+@case('jobs-result', setup=finish_job)
+def jobs_result(ctx):
+    return ctx.client.get(f'/api/jobs/{ctx.job_id}/result/')
+
+
+def remove_favorites(ctx):
+    bulk.remove_recipes(Favourite, ctx.user, ctx.recipe_ids)
+
+
+def add_favorites(ctx):
+    bulk.add_recipes(Favourite, ctx.user, ctx.recipe_ids)
+
+
+@case('recipes-favorite-bulk-add', setup=remove_favorites)
+def favorite_bulk_add(ctx):
+    return ctx.client.post('/api/recipes/favorite/bulk/',
+                           {'ids': ctx.recipe_ids}, format='json')
+
+
+@case('recipes-favorite-bulk-remove', setup=add_favorites)
+def favorite_bulk_remove(ctx):
+    return ctx.client.delete('/api/recipes/favorite/bulk/',
+                             {'ids': ctx.recipe_ids}, format='json')
+
+
+def remove_all_from_cart(ctx):
+    bulk.remove_recipes(ShoppingCart, ctx.user, ctx.recipe_ids)
+
+
+def add_all_to_cart(ctx):
+    bulk.add_recipes(ShoppingCart, ctx.user, ctx.recipe_ids)
+
+
+@case('recipes-shopping-cart-bulk-add', setup=remove_all_from_cart)
+def shopping_cart_bulk_add(ctx):
+    return ctx.client.post('/api/recipes/shopping_cart/bulk/',
+                           {'ids': ctx.recipe_ids}, format='json')
+
+
+@case('recipes-shopping-cart-bulk-remove', setup=add_all_to_cart)
+def shopping_cart_bulk_remove(ctx):
+    return ctx.client.delete('/api/recipes/shopping_cart/bulk/',
+                             {'ids': ctx.recipe_ids}, format='json')
+
+
+@case('subscriptions-list')
+def subscriptions_list(ctx):
+    return ctx.client.get('/api/users/subscriptions/',
+                          {'recipes_limit': 3})
+
+
+def unsubscribe(ctx):
+    Subscription.objects.filter(
+        subscriber=ctx.user, subscribing=ctx.author_id).delete()
+
+
+def subscribe(ctx):
+    Subscription.objects.get_or_create(
+        subscriber=ctx.user, subscribing_id=ctx.author_id)
+
+
+def unsubscribe_all(ctx):
+    bulk.unsubscribe(ctx.user, ctx.author_ids)
+
+
+def subscribe_all(ctx):
+    bulk.subscribe(ctx.user, ctx.author_ids)
+
+
+@case('subscriptions-bulk-add', setup=unsubscribe_all)
+def subscriptions_bulk_add(ctx):
+    return ctx.client.post('/api/users/subscriptions/bulk/',
+                           {'ids': ctx.author_ids}, format='json')
+
+
+@case('subscriptions-bulk-remove', setup=subscribe_all)
+def subscriptions_bulk_remove(ctx):
+    return ctx.client.delete('/api/users/subscriptions/bulk/',
+                             {'ids': ctx.author_ids}, format='json')
+
+
+@case('users-subscribe', setup=unsubscribe)
+def users_subscribe(ctx):
+    return ctx.client.post(f'/api/users/{ctx.author_id}/subscribe/')
+
+
+@case('users-unsubscribe', setup=subscribe)
+def users_unsubscribe(ctx):
+    return ctx.client.delete(f'/api/users/{ctx.author_id}/subscribe/')
+
+
+@case('users-list')
+def users_list(ctx):
+    return ctx.client.get('/api/users/')
+
+
+@case('users-detail')
+def users_detail(ctx):
+    return ctx.client.get(f'/api/users/{ctx.author_id}/')
+
+
+@case('users-me')
+def users_me(ctx):
+    return ctx.client.get('/api/users/me/')
+
+
+@case('token-login')
+def token_login(ctx):
+    return ctx.anonymous.post('/api/auth/token/login/', {
+        'email': ctx.user.email, 'password': PASSWORD}, format='json')
+
+
+@case('recipes-delete', setup=new_recipe)
+def recipes_delete(ctx):
+    response = ctx.client.delete(f'/api/recipes/{ctx.own_recipe_id}/')
+    ctx.own_recipe_id = None
+    return response
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of the values.
+    """
+    values = sorted(values)
+    return values[max(math.ceil(fraction * len(values)) - 1, 0)]
+
+
+def send(ctx, bench_case):
+    start = time.perf_counter()
+    response = bench_case.func(ctx)
+    if response.streaming:
+        b''.join(response.streaming_content)
+    return time.perf_counter() - start, response
+
+
+def run_case(ctx, bench_case, iterations):
+    """
+    Sends the request iterations times and returns its statistics.
+
+    Latency is measured without tracing, peak memory of the request
+    is taken in one more traced run.
+    """
+    timings = []
+    queries = 0
+    for _ in range(iterations):
+        if bench_case.setup is not None:
+            bench_case.setup(ctx)
+        with CaptureQueriesContext(connection) as context:
+            elapsed, response = send(ctx, bench_case)
+        timings.append(elapsed)
+        queries = max(queries, len(context))
+    if bench_case.setup is not None:
+        bench_case.setup(ctx)
+    tracemalloc.start()
+    try:
+        send(ctx, bench_case)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    match = response.resolver_match
+    return {
+        'url_name': match.url_name if match else None,
+        'status': response.status_code,
+        'p50_ms': round(percentile(timings, 0.5) * 1000, 3),
+        'p95_ms': round(percentile(timings, 0.95) * 1000, 3),
+        'queries': queries,
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+def run(scale, iterations, seed_value, names=None):
+    """
+    Runs the benchmark cases against seeded data and returns a report.
+    """
+    ctx = Context()
+    results = {}
+    for bench_case in CASES:
+        if names and bench_case.name not in names:
+            continue
+        results[bench_case.name] = run_case(ctx, bench_case, iterations)
+    return {
+        'meta': {
+            'database': connection.vendor,
+            'scale': scale._asdict(),
+            'seed': seed_value,
+            'iterations': iterations,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+        },
+        'results': results,
+    }
+
+
+def compare(report, baseline, tolerance):
+    """
+    Returns regressions of the report against a baseline report.
+
+    Query counts must not grow at all, latency and memory may grow
+    by the tolerance fraction.
+    """
+    regressions = []
+    for name, base in baseline['results'].items():
+        result = report['results'].get(name)
+        if result is None:
+            continue
+        if result['status'] != base['status']:
+            regressions.append(
+                f'{name}: status {base["status"]} -> {result["status"]}')
+        if result['queries'] > base['queries']:
+            regressions.append(
+                f'{name}: queries {base["queries"]} -> {result["queries"]}')
+        for metric in ('p95_ms', 'peak_memory_kb'):
+            if result[metric] > base[metric] * (1 + tolerance):
+                regressions.append(
+                    f'{name}: {metric} {base[metric]} -> {result[metric]}')
+    return regressions
+
+
+def dump(report, path):
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
@@ -0,0 +1,103 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+
+from recipes import relations
+from recipes.models import Recipe
+from recipes.relations import raw_delete
+from users.models import Subscription
+from .memberships import SUBSCRIPTIONS, invalidate
+
+User = get_user_model()
+
+ADDED = 'added'
+EXISTS = 'exists'
+REMOVED = 'removed'
+ABSENT = 'absent'
+NOT_FOUND = 'not_found'
+SELF = 'self'
+
+
+def get_results(ids, statuses, default):
+    return [{'id': pk, 'status': statuses.get(pk, default)} for pk in ids]
+
+
+def lock_user(user):
+    """
+    Locks the user's row, so additions of one user run one by one and
+    the rows found missing are exactly the rows inserted afterwards.
+    The single-item views take the same lock.
+    """
+    list(User.objects.select_for_update().filter(
+        pk=user.pk).values_list('pk', flat=True))
+
+
+@transaction.atomic
+def add_recipes(model, user, ids):
+    """
+    Adds recipes to the user's favorites or cart and returns
+    the status of every id.
+    """
+    lock_user(user)
+    statuses = {pk: EXISTS if present else ADDED for pk, present
+                in Recipe.objects.filter(pk__in=ids).annotate(
+                    present=Exists(model.objects.filter(
+                        user=user, recipe=OuterRef('pk')))
+                ).values_list('pk', 'present')}
+    new_ids = [pk for pk in ids if statuses.get(pk) == ADDED]
+    if new_ids:
+        model.objects.bulk_create(
+            (model(user=user, recipe_id=pk) for pk in new_ids),
+            ignore_conflicts=True)
+        relations.changed(model, user.id, new_ids, 1)
+    return get_results(ids, statuses, NOT_FOUND)
+
+
+@transaction.atomic
+def remove_recipes(model, user, ids):
+    """
+    Removes recipes from the user's favorites or cart and returns
+    the status of every id.
+    """
+    present_ids = [recipe_id for _, recipe_id in relations.delete(
+        model.objects.filter(user=user, recipe__in=ids))]
+    return get_results(ids, dict.fromkeys(present_ids, REMOVED), ABSENT)
+
+
+@transaction.atomic
+def subscribe(user, ids):
+    """
+    Subscribes the user to authors and returns the status of every id.
+    """
+    lock_user(user)
+    statuses = {pk: EXISTS if present else ADDED for pk, present
+                in User.objects.filter(pk__in=ids).annotate(
+                    present=Exists(Subscription.objects.filter(
+                        subscriber=user, subscribing=OuterRef('pk')))
+                ).values_list('pk', 'present')}
+    if user.id in statuses:
+        statuses[user.id] = SELF
+    new_ids = [pk for pk in ids if statuses.get(pk) == ADDED]
+    if new_ids:
+        Subscription.objects.bulk_create(
+            (Subscription(subscriber=user, subscribing_id=pk)
+             for pk in new_ids),
+            ignore_conflicts=True)
+        invalidate(SUBSCRIPTIONS, [user.id])
+    return get_results(ids, statuses, NOT_FOUND)
+
+
+@transaction.atomic
+def unsubscribe(user, ids):
+    """
+    Unsubscribes the user from authors and returns the status of every id.
+    """
+    queryset = Subscription.objects.filter(subscriber=user,
+                                           subscribing__in=ids)
+    present_ids = list(queryset.select_for_update().values_list(
+        'subscribing', flat=True))
+    if present_ids:
+        raw_delete(Subscription.objects.filter(
+            subscriber=user, subscribing__in=present_ids))
+        invalidate(SUBSCRIPTIONS, [user.id])
+    return get_results(ids, dict.fromkeys(present_ids, REMOVED), ABSENT)
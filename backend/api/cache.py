@@ -0,0 +1,53 @@
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+from foodgram_backend.settings import VERSION_CHECK_INTERVAL
+from .models import VersionStamp
+
+INGREDIENTS_VERSION = 'ingredients'
+TAGS_VERSION = 'tags'
+
+
+def get_cache_key(name):
+    return f'version:{name}'
+
+
+def load_version(name):
+    stamp, _ = VersionStamp.objects.get_or_create(
+        name=name, defaults={'value': time.time_ns()})
+    return stamp.value
+
+
+def get_version(name):
+    """
+    Returns the current version stamp of a data set.
+
+    Stamps are stored in the database, so a bump made by any process
+    (a management command, another worker) is seen by all of them.
+    The stamp is re-read at most every VERSION_CHECK_INTERVAL seconds.
+    """
+    return cache.get_or_set(get_cache_key(name), lambda: load_version(name),
+                            timeout=VERSION_CHECK_INTERVAL)
+
+
+def bump_version(name):
+    bump_versions([name])
+
+
+def bump_versions(names):
+    """
+    Sets new version stamps, with one update of the existing stamps and
+    one insert of the missing ones. The cached copies are dropped right
+    away and once more on commit, in case they were re-read before
+    the commit.
+    """
+    keys = [get_cache_key(name) for name in names]
+    value = time.time_ns()
+    VersionStamp.objects.filter(name__in=names).update(value=value)
+    VersionStamp.objects.bulk_create(
+        (VersionStamp(name=name, value=value) for name in names),
+        ignore_conflicts=True)
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
@@ -0,0 +1,122 @@
+import json
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.db import DatabaseError, connections
+
+from foodgram_backend.settings import N_PLUS_ONE_THRESHOLD, SLOW_QUERY_MS
+
+logger = logging.getLogger(__name__)
+
+STRING = re.compile(r"'(?:[^']|'')*'")
+IN_LIST = re.compile(r'\bIN \([^()]*\)', re.IGNORECASE)
+NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+SPACE = re.compile(r'\s+')
+TRANSACTION = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+
+def normalize(sql):
+    """
+    Returns the shape of a statement: literals, numbers and IN lists
+    are replaced, so statements differing only in values are equal.
+    """
+    sql = STRING.sub('?', sql)
+    sql = IN_LIST.sub('IN (...)', sql)
+    sql = NUMBER.sub('?', sql)
+    return SPACE.sub(' ', sql).strip()
+
+
+class QueryLog:
+    """
+    Database execute wrapper that groups statements by shape
+    and keeps the slow ones with their parameters.
+    """
+    def __init__(self, slow_ms=None):
+        self.slow_ms = SLOW_QUERY_MS if slow_ms is None else slow_ms
+        self.shapes = Counter()
+        self.examples = {}
+        self.slow = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = (time.perf_counter() - start) * 1000
+            if not sql.startswith(TRANSACTION):
+                shape = normalize(sql)
+                self.shapes[shape] += 1
+                self.examples.setdefault(shape, sql)
+            if duration >= self.slow_ms and not many:
+                self.slow.append(
+                    (context['connection'].alias, sql, params, duration))
+
+    def __len__(self):
+        return sum(self.shapes.values())
+
+    def repeated(self, threshold=None):
+        """
+        Returns (shape, count) of statements repeated more than
+        threshold times, the usual sign of an N+1.
+        """
+        if threshold is None:
+            threshold = N_PLUS_ONE_THRESHOLD
+        return [(shape, count) for shape, count
+                in self.shapes.most_common() if count > threshold]
+
+
+def explain(alias, sql, params):
+    if not sql.lstrip().upper().startswith('SELECT'):
+        return None
+    connection = connections[alias]
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'{connection.ops.explain_query_prefix()} {sql}', params)
+            return '\n'.join(' '.join(str(column) for column in row)
+                             for row in cursor.fetchall())
+    except DatabaseError as error:
+        return f'EXPLAIN failed: {error}'
+
+
+def report(query_log, view):
+    """
+    Logs N+1 patterns and slow statements of a request.
+    """
+    for shape, count in query_log.repeated():
+        logger.warning(json.dumps({
+            'problem': 'n+1',
+            'view': view,
+            'count': count,
+            'statement': shape,
+            'example': query_log.examples[shape],
+        }, ensure_ascii=False))
+    for alias, sql, params, duration in query_log.slow:
+        logger.warning(json.dumps({
+            'problem': 'slow query',
+            'view': view,
+            'duration_ms': round(duration, 2),
+            'statement': sql,
+            'plan': explain(alias, sql, params),
+        }, ensure_ascii=False, default=str))
+
+
+@contextmanager
+def query_budget(budget, threshold=None, using='default'):
+    """
+    Test helper failing when the block runs more than budget queries
+    or repeats a statement shape more than threshold times.
+    """
+    query_log = QueryLog()
+    with connections[using].execute_wrapper(query_log):
+        yield query_log
+    problems = []
+    if len(query_log) > budget:
+        problems.append(f'{len(query_log)} queries, budget is {budget}')
+    problems.extend(f'repeated {count} times: {shape}'
+                    for shape, count in query_log.repeated(threshold))
+    if problems:
+        raise AssertionError('\n'.join(problems))
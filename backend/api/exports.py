@@ -0,0 +1,249 @@
+import csv
+import io
+import json
+import time
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from pathlib import Path
+
+from django.core.cache import cache
+from django.http import (
+    HttpResponse, HttpResponseNotModified, StreamingHttpResponse)
+from django.utils.cache import parse_etags
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.units import cm
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+from foodgram_backend.settings import SHOPPING_LIST_CACHE_TIMEOUT
+from recipes.models import ShoppingCartVersion, ShoppingListItem
+from . import metrics
+
+TITLE = 'СПИСОК ПОКУПОК'
+FONT_NAME = 'Calibri'
+FONT_PATH = Path(__file__).resolve().parent / 'calibri.ttf'
+
+SHOPPING_LIST_RENDERERS = []
+
+
+def register_renderer(renderer_class):
+    """
+    Adds a renderer to the formats offered by download_shopping_cart.
+
+    The first registered renderer is the default one.
+    """
+    SHOPPING_LIST_RENDERERS.append(renderer_class)
+    return renderer_class
+
+
+def get_shopping_list(user):
+    """
+    Returns (name, measurement_unit, amount) rows of the user's cart,
+    read from the shopping list kept summed over all recipes in it.
+    """
+    return ShoppingListItem.objects.filter(
+        user=user, amount__gt=0).values_list(
+        'ingredient__name', 'ingredient__measurement_unit', 'amount'
+    ).order_by('ingredient__name')
+
+
+def render_content(user, renderer):
+    start = time.perf_counter()
+    content = b''.join(renderer.iter_chunks(
+        get_shopping_list(user).iterator()))
+    metrics.export_render.observe(time.perf_counter() - start,
+                                  format=renderer.format)
+    return content
+
+
+def cache_chunks(key, chunks, renderer):
+    """
+    Passes chunks through and caches their concatenation
+    once the whole list has been sent.
+    """
+    start = time.perf_counter()
+    content = []
+    for chunk in chunks:
+        content.append(chunk)
+        yield chunk
+    metrics.export_render.observe(time.perf_counter() - start,
+                                  format=renderer.format)
+    cache.set(key, b''.join(content), SHOPPING_LIST_CACHE_TIMEOUT)
+
+
+def get_content_type(renderer):
+    if renderer.charset:
+        return f'{renderer.media_type}; charset={renderer.charset}'
+    return renderer.media_type
+
+
+def get_cache_key(user, version, renderer):
+    return f'shopping_list:{user.id}:{version}:{renderer.format}'
+
+
+def render_shopping_list(user, renderer):
+    """
+    Returns the rendered shopping list, cached per cart version and format.
+    """
+    key = get_cache_key(
+        user, ShoppingCartVersion.objects.get_version(user), renderer)
+    content = cache.get(key)
+    metrics.count_cache('shopping_list', content is not None)
+    if content is None:
+        content = render_content(user, renderer)
+        cache.set(key, content, SHOPPING_LIST_CACHE_TIMEOUT)
+    return content
+
+
+def export_shopping_list(request, renderer):
+    """
+    Builds the download response of the user's shopping list.
+
+    Rendered lists are cached per cart version and format, the version
+    also serves as ETag, so an unchanged cart is answered with 304.
+    """
+    user = request.user
+    version = ShoppingCartVersion.objects.get_version(user)
+    etag = f'"{user.id}-{version}-{renderer.format}"'
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    else:
+        content_type = get_content_type(renderer)
+        key = get_cache_key(user, version, renderer)
+        content = cache.get(key)
+        metrics.count_cache('shopping_list', content is not None)
+        if content is None and renderer.streaming:
+            # The rows are read here, inside the request, not while
+            # the server iterates over the response.
+            chunks = renderer.iter_chunks(list(get_shopping_list(user)))
+            response = StreamingHttpResponse(
+                cache_chunks(key, chunks, renderer),
+                content_type=content_type)
+        else:
+            if content is None:
+                content = render_content(user, renderer)
+                cache.set(key, content, SHOPPING_LIST_CACHE_TIMEOUT)
+            response = HttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = (
+            f'attachment; filename="shopping_list.{renderer.format}"')
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+class ShoppingListRenderer(BaseRenderer, ABC):
+    """
+    Base class for shopping list formats.
+
+    DRF picks the renderer by ?format= or Accept, the view then writes
+    records with iter_chunks(). Streaming renderers are sent
+    with StreamingHttpResponse as records are encoded.
+    """
+    streaming = True
+
+    @abstractmethod
+    def iter_chunks(self, records):
+        """
+        Yields the encoded list of (name, measurement_unit, amount)
+        records.
+        """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """
+        Only error responses of the export action are rendered here,
+        they are sent as JSON.
+        """
+        response = (renderer_context or {}).get('response')
+        if response is not None:
+            response['Content-Type'] = JSONRenderer.media_type
+        return JSONRenderer().render(data)
+
+
+@lru_cache(maxsize=None)
+def register_font():
+    """
+    Parses the TTF file once per process.
+    """
+    pdfmetrics.registerFont(TTFont(FONT_NAME, FONT_PATH))
+
+
+@register_renderer
+class PDFShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+    streaming = False
+    font_size = 12
+
+    def iter_chunks(self, records):
+        register_font()
+        buf = io.BytesIO()
+        canv = canvas.Canvas(buf, pagesize=letter, bottomup=0)
+        lines_per_page = int((letter[1] - 2 * cm) // (self.font_size * 1.2))
+        text = None
+        lines = [TITLE]
+        lines.extend(f'- {name} {amount} {unit}'
+                     for name, unit, amount in records)
+        for number, line in enumerate(lines):
+            if number % lines_per_page == 0:
+                if text is not None:
+                    canv.drawText(text)
+                    canv.showPage()
+                text = canv.beginText()
+                text.setTextOrigin(cm, cm)
+                text.setFont(FONT_NAME, self.font_size)
+            text.textLine(line)
+        canv.drawText(text)
+        canv.showPage()
+        canv.save()
+        yield buf.getvalue()
+
+
+@register_renderer
+class TextShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def iter_chunks(self, records):
+        yield f'{TITLE}\n'.encode(self.charset)
+        for name, unit, amount in records:
+            yield f'- {name} {amount} {unit}\n'.encode(self.charset)
+
+
+class Echo:
+    """
+    File-like object that returns written value instead of storing it.
+    """
+    def write(self, value):
+        return value
+
+
+@register_renderer
+class CSVShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def iter_chunks(self, records):
+        writer = csv.writer(Echo())
+        yield writer.writerow(
+            ('name', 'measurement_unit', 'amount')).encode(self.charset)
+        for record in records:
+            yield writer.writerow(record).encode(self.charset)
+
+
+@register_renderer
+class JSONShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'application/json'
+    format = 'json'
+
+    def iter_chunks(self, records):
+        separator = '['
+        for name, unit, amount in records:
+            item = json.dumps(
+                {'name': name, 'measurement_unit': unit, 'amount': amount},
+                ensure_ascii=False)
+            yield f'{separator}{item}'.encode(self.charset)
+            separator = ','
+        yield ('[]' if separator == '[' else ']').encode(self.charset)
@@ -1,42 +1,100 @@
+from django import forms
+from django.db.models import Case, Exists, IntegerField, OuterRef, When
+from django.db.models.functions import Lower
 from django_filters import rest_framework as filters
+from rest_framework.filters import OrderingFilter
 
-from recipes.models import Recipe, Ingredient, Tag
+from recipes.models import (
+    Recipe, Ingredient, RecipeTag, Favourite, ShoppingCart)
+from .indexes import tag_slugs
+from .search import get_search_backend
+
+
+class ValueListField(forms.Field):
+    """
+    Form field that accepts a repeated query parameter as is.
+    """
+    widget = forms.SelectMultiple
+
+    def to_python(self, value):
+        return [item for item in value or () if item]
+
+
+class ValueListFilter(filters.Filter):
+    field_class = ValueListField
 
 
 class RecipeFilter(filters.FilterSet):
     """
     Class for filtering recipes by field: author, tags, is_favorited,
-    is_in_shopping_cart.
+    is_in_shopping_cart and full-text search over name, text
+    and ingredient names.
+    Tags, favorites and cart are filtered with Exists subqueries,
+    so the feed has no joins and no duplicate rows.
     """
+    search = filters.CharFilter(method='filter_search')
     is_favorited = filters.BooleanFilter(method='filter_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart')
-    tags = filters.ModelMultipleChoiceFilter(
-        field_name='tags__slug',
-        to_field_name='slug',
-        queryset=Tag.objects.all()
-    )
+    tags = ValueListFilter(method='filter_tags')
+
+    def filter_search(self, queryset, name, value):
+        return get_search_backend().search(queryset, value)
+
+    def filter_tags(self, queryset, name, value):
+        return queryset.filter(Exists(RecipeTag.objects.filter(
+            recipe=OuterRef('pk'), tag_id__in=tag_slugs.get_ids(value))))
+
+    def filter_by_user(self, queryset, model):
+        user = self.request.user
+        if not user.is_authenticated:
+            return queryset.none()
+        return queryset.filter(Exists(model.objects.filter(
+            recipe=OuterRef('pk'), user=user)))
 
     def filter_is_favorited(self, queryset, name, value):
         if value:
-            return queryset.filter(favorite__user=self.request.user)
+            return self.filter_by_user(queryset, Favourite)
         return queryset
 
     def filter_is_in_shopping_cart(self, queryset, name, value):
         if value:
-            return queryset.filter(shopping__user=self.request.user)
+            return self.filter_by_user(queryset, ShoppingCart)
         return queryset
 
     class Meta:
         model = Recipe
-        fields = ['author', 'tags']
+        fields = ['author']
+
+
+class RecipeOrderingFilter(OrderingFilter):
+    """
+    Puts the most relevant recipes first when searching.
+    """
+    def get_default_ordering(self, view):
+        ordering = super().get_default_ordering(view)
+        if view.request.query_params.get('search'):
+            return ('-search_rank', *ordering)
+        return ordering
 
 
 class IngredientFilter(filters.FilterSet):
     """
     Class for searching ingredients by name.
+    Results are ranked the same way as in the ingredient index:
+    exact match, then names starting with the value, then names
+    containing it.
     """
-    name = filters.CharFilter(lookup_expr='startswith')
+    name = filters.CharFilter(method='filter_name')
+
+    def filter_name(self, queryset, name, value):
+        return queryset.filter(name__icontains=value).annotate(
+            rank=Case(
+                When(name__iexact=value, then=0),
+                When(name__istartswith=value, then=1),
+                default=2,
+                output_field=IntegerField())
+        ).order_by('rank', Lower('name'))
 
     class Meta:
         model = Ingredient
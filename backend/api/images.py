@@ -0,0 +1,134 @@
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps, UnidentifiedImageError, features
+from rest_framework import serializers
+
+from foodgram_backend.settings import (
+    IMAGE_FORMAT, IMAGE_QUALITY, IMAGE_VARIANTS, IMAGE_WORKERS,
+    MAX_IMAGE_PIXELS, MAX_IMAGE_SIZE)
+
+logger = logging.getLogger(__name__)
+
+# Variants are encoded after the response, the pool caps how many
+# of them are encoded at once.
+executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS,
+                              thread_name_prefix='images')
+
+if IMAGE_FORMAT == 'WEBP' and not features.check('webp'):
+    IMAGE_FORMAT = 'JPEG'
+EXTENSION = {'WEBP': 'webp', 'JPEG': 'jpg'}[IMAGE_FORMAT]
+
+
+def check_size(size):
+    if size > MAX_IMAGE_SIZE:
+        raise serializers.ValidationError(
+            f'Размер изображения больше {MAX_IMAGE_SIZE // 1024 // 1024} МБ.')
+
+
+def open_image(file):
+    """
+    Opens an image reading only its header, the pixels are decoded
+    after the dimensions have been checked.
+    """
+    try:
+        image = Image.open(file)
+    except (UnidentifiedImageError, Image.DecompressionBombError):
+        raise serializers.ValidationError('Файл не является изображением.')
+    width, height = image.size
+    if width * height > MAX_IMAGE_PIXELS:
+        raise serializers.ValidationError(
+            'Слишком большое разрешение изображения.')
+    return image
+
+
+def encode(image, width=None):
+    """
+    Re-encodes an image without its metadata, shrinking it
+    to the given width.
+    """
+    image = ImageOps.exif_transpose(image)
+    if width is not None and image.width > width:
+        image = image.resize(
+            (width, round(image.height * width / image.width)),
+            Image.LANCZOS)
+    has_alpha = image.mode in ('RGBA', 'LA', 'PA') or (
+        image.mode == 'P' and 'transparency' in image.info)
+    mode = 'RGBA' if has_alpha and IMAGE_FORMAT == 'WEBP' else 'RGB'
+    if image.mode != mode:
+        image = image.convert(mode)
+    buf = io.BytesIO()
+    image.save(buf, IMAGE_FORMAT, quality=IMAGE_QUALITY)
+    return buf.getvalue()
+
+
+def process_image(file):
+    """
+    Checks an uploaded image and returns it re-encoded as a new file.
+    """
+    check_size(file.size)
+    file.seek(0)
+    image = open_image(file)
+    try:
+        content = encode(image)
+    except (OSError, SyntaxError, ValueError):
+        raise serializers.ValidationError('Изображение повреждено.')
+    return ContentFile(content, name=f'image.{EXTENSION}')
+
+
+def variant_name(name, variant):
+    return f'{name.rsplit(".", 1)[0]}_{variant}.{EXTENSION}'
+
+
+def variant_urls(name):
+    """
+    Returns the URLs of the fixed-width variants of a stored image.
+
+    Variants are built right after the recipe is saved, those of images
+    stored before them are built by manage.py build_image_variants.
+    """
+    if not name:
+        return {variant: None for variant in IMAGE_VARIANTS}
+    return {variant: default_storage.url(variant_name(name, variant))
+            for variant in IMAGE_VARIANTS}
+
+
+def save_variants(name):
+    """
+    Writes the fixed-width variants of a stored image next to it.
+
+    Images are stored by content hash, so existing variants are kept.
+    Returns the number of variants written.
+    """
+    paths = {variant: variant_name(name, variant)
+             for variant in IMAGE_VARIANTS}
+    missing = [variant for variant, path in paths.items()
+               if not default_storage.exists(path)]
+    if not missing:
+        return 0
+    with default_storage.open(name) as file:
+        image = Image.open(file)
+        image.load()
+    for variant in missing:
+        default_storage.save(paths[variant], ContentFile(
+            encode(image, IMAGE_VARIANTS[variant])))
+    return len(missing)
+
+
+def log_errors(future):
+    if future.exception() is not None:
+        logger.error('Image variants were not saved',
+                     exc_info=future.exception())
+
+
+def schedule_variants(name):
+    """
+    Builds the variants in the pool once the transaction is committed.
+    """
+    transaction.on_commit(
+        lambda: executor.submit(save_variants, name).add_done_callback(
+            log_errors))
@@ -0,0 +1,87 @@
+import threading
+from bisect import bisect_left
+
+from recipes.models import Ingredient, Tag
+from .cache import INGREDIENTS_VERSION, TAGS_VERSION, get_version
+from .replicas import primary
+
+
+class IngredientIndex:
+    """
+    Process-local, case-insensitive index of ingredient names.
+
+    Names are kept in a sorted array, so a prefix query is a binary
+    search plus a walk over the matches. The index is built on first use
+    and rebuilt from the primary when the ingredients version stamp
+    changes; while it is being built by another request, search()
+    returns None and callers fall back to SQL.
+    """
+    def __init__(self):
+        self.version = None
+        self.data = ([], [])
+        self.lock = threading.Lock()
+
+    def build(self, version=None):
+        if version is None:
+            version = get_version(INGREDIENTS_VERSION)
+        with primary():
+            entries = sorted(
+                (name.lower(), pk, name, unit) for pk, name, unit
+                in Ingredient.objects.values_list(
+                    'id', 'name', 'measurement_unit').iterator())
+        self.data = ([entry[0] for entry in entries], entries)
+        self.version = version
+
+    def search(self, query, limit):
+        """
+        Returns up to limit ingredients ranked as exact match, then names
+        starting with query, then names containing it.
+        """
+        version = get_version(INGREDIENTS_VERSION)
+        if self.version != version and self.lock.acquire(blocking=False):
+            try:
+                self.build(version)
+            finally:
+                self.lock.release()
+        if self.version != version:
+            return None
+        keys, entries = self.data
+        query = query.lower()
+        found = []
+        start = bisect_left(keys, query)
+        end = start
+        while (end < len(keys) and len(found) < limit
+               and keys[end].startswith(query)):
+            found.append(entries[end])
+            end += 1
+        if len(found) < limit:
+            for entry in entries:
+                if query in entry[0] and not entry[0].startswith(query):
+                    found.append(entry)
+                    if len(found) == limit:
+                        break
+        return [{'id': pk, 'name': name, 'measurement_unit': unit}
+                for _, pk, name, unit in found]
+
+
+class TagSlugIndex:
+    """
+    Process-local map of tag slugs to ids, reloaded from the primary
+    when the tags version stamp changes.
+    """
+    def __init__(self):
+        self.version = None
+        self.ids = {}
+
+    def get_ids(self, slugs):
+        version = get_version(TAGS_VERSION)
+        if self.version != version:
+            with primary():
+                self.ids = dict(Tag.objects.values_list('slug', 'id'))
+            self.version = version
+        ids = self.ids
+        return [ids[slug] for slug in slugs if slug in ids]
+
+
+ingredient_index = IngredientIndex()
+tag_slugs = TagSlugIndex()
@@ -0,0 +1,119 @@
+import csv
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.cache import bump_version
+
+
+class CSVImportCommand(BaseCommand):
+    """
+    Base command for streaming a csv file into a model in batches.
+
+    Subclasses set model, the csv columns in fields, key_fields that
+    identify a row and update_fields that --upsert overwrites. Bulk
+    writes send no signals, so version_name names the version stamp
+    to bump after the import.
+
+    Rows already present, repeated in the file or conflicting with
+    a unique constraint are skipped; the report tells how many rows
+    were inserted, updated and skipped.
+    """
+    model = None
+    version_name = None
+    fields = ()
+    key_fields = ()
+    update_fields = ()
+    default_path = None
+    batch_size = 1000
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default=self.default_path,
+            help=f'Путь к csv файлу, по умолчанию {self.default_path}')
+        parser.add_argument(
+            '--batch-size', type=int, default=self.batch_size,
+            help='Количество строк в одном запросе')
+        parser.add_argument(
+            '--upsert', action='store_true',
+            help='Обновлять поля уже существующих записей')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только прочитать файл, ничего не записывая')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size должен быть положительным')
+        try:
+            file = open(options['path'], 'r', encoding='utf-8')
+        except OSError as error:
+            raise CommandError(
+                f'Не удалось открыть файл {options["path"]}: '
+                f'{error.strerror}')
+        start = time.monotonic()
+        total = updated = 0
+        count_before = self.model.objects.count()
+        with file:
+            rows = self.read_rows(csv.reader(file))
+            while True:
+                batch = list(islice(rows, options['batch_size']))
+                if not batch:
+                    break
+                if not options['dry_run']:
+                    updated += self.write_batch(batch, options['upsert'])
+                total += len(batch)
+                self.report(total, start)
+        elapsed = f'за {time.monotonic() - start:.1f} с'
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(
+                f'Прочитано строк: {total} {elapsed}'))
+            return
+        if self.version_name:
+            bump_version(self.version_name)
+        inserted = self.model.objects.count() - count_before
+        self.stdout.write(self.style.SUCCESS(
+            f'Прочитано строк: {total}, добавлено: {inserted}, '
+            f'обновлено: {updated}, пропущено: '
+            f'{total - inserted - updated} {elapsed}'))
+
+    def read_rows(self, reader):
+        for line, row in enumerate(reader, start=1):
+            if not row:
+                continue
+            if len(row) != len(self.fields):
+                raise CommandError(
+                    f'Строка {line}: ожидалось {len(self.fields)} '
+                    f'значения, получено {len(row)}')
+            yield dict(zip(self.fields, row))
+
+    def report(self, total, start):
+        elapsed = time.monotonic() - start
+        rate = total / elapsed if elapsed else total
+        self.stdout.write(f'{total} строк, {rate:.0f} строк/с')
+
+    def get_key(self, obj):
+        return tuple(getattr(obj, field) for field in self.key_fields)
+
+    def write_batch(self, batch, upsert):
+        """
+        Writes a batch and returns the number of updated rows.
+        """
+        objs = {}
+        for row in batch:
+            obj = self.model(**row)
+            objs[self.get_key(obj)] = obj
+        changed = []
+        if upsert and self.update_fields:
+            lookup = {f'{self.key_fields[0]}__in':
+                      [key[0] for key in objs]}
+            for existing in self.model.objects.filter(**lookup):
+                obj = objs.pop(self.get_key(existing), None)
+                if obj is None:
+                    continue
+                for field in self.update_fields:
+                    setattr(existing, field, getattr(obj, field))
+                changed.append(existing)
+            self.model.objects.bulk_update(changed, self.update_fields)
+        self.model.objects.bulk_create(objs.values(), ignore_conflicts=True)
+        return len(changed)
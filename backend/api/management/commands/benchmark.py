@@ -0,0 +1,87 @@
+import json
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from api import benchmark
+
+
+class Command(BaseCommand):
+    help = ('Seed a throwaway database with synthetic data, time every API '
+            'endpoint and optionally compare the report with a baseline')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scale', choices=benchmark.SCALES, default='small',
+            help='Размер набора данных')
+        parser.add_argument('--users', type=int)
+        parser.add_argument('--recipes', type=int)
+        parser.add_argument('--favorites', type=int)
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Зерно генератора данных')
+        parser.add_argument(
+            '--iterations', type=int, default=20,
+            help='Количество запросов к каждому адресу')
+        parser.add_argument(
+            '--case', action='append', dest='cases',
+            help='Запустить только этот сценарий, можно повторять')
+        parser.add_argument(
+            '--output', default='benchmark.json',
+            help='Файл отчета')
+        parser.add_argument(
+            '--baseline',
+            help='Отчет, с которым сравнить результаты')
+        parser.add_argument(
+            '--tolerance', type=float, default=0.2,
+            help='Допустимый рост задержки и памяти, доля от базовой')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('--iterations должен быть положительным')
+        scale = benchmark.SCALES[options['scale']]._replace(**{
+            field: options[field] for field in benchmark.Scale._fields
+            if options[field] is not None})
+        unknown = set(options['cases'] or ()) - {
+            bench_case.name for bench_case in benchmark.CASES}
+        if unknown:
+            raise CommandError(f'Неизвестные сценарии: {sorted(unknown)}')
+        media_root = tempfile.mkdtemp()
+        # Data is seeded into a test database that is dropped afterwards.
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(
+                    MEDIA_ROOT=media_root, DEBUG=False,
+                    ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                self.stdout.write(f'Заполнение базы: {scale}')
+                benchmark.seed(scale, options['seed'])
+                report = benchmark.run(scale, options['iterations'],
+                                       options['seed'], options['cases'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            shutil.rmtree(media_root, ignore_errors=True)
+        benchmark.dump(report, options['output'])
+        for name, result in report['results'].items():
+            self.stdout.write(
+                f'{name:35} {result["status"]} p50 {result["p50_ms"]} мс '
+                f'p95 {result["p95_ms"]} мс запросов {result["queries"]} '
+                f'память {result["peak_memory_kb"]} КБ')
+        failed = [name for name, result in report['results'].items()
+                  if result['status'] >= 400]
+        if failed:
+            raise CommandError(f'Запросы завершились ошибкой: {failed}')
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as file:
+                baseline = json.load(file)
+            regressions = benchmark.compare(report, baseline,
+                                            options['tolerance'])
+            if regressions:
+                raise CommandError(
+                    'Регрессии производительности:\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS(
+            f'Отчет сохранен в {options["output"]}'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from api.images import save_variants
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Build the missing fixed-width variants of recipe images'
+
+    def handle(self, *args, **options):
+        names = Recipe.objects.exclude(image='').order_by().values_list(
+            'image', flat=True).distinct()
+        built = failed = 0
+        for name in names.iterator():
+            try:
+                built += save_variants(name)
+            except (OSError, SyntaxError, ValueError) as error:
+                failed += 1
+                self.stderr.write(f'{name}: {error}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано вариантов: {built}, ошибок: {failed}'))
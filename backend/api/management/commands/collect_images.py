@@ -0,0 +1,55 @@
+import posixpath
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.images import variant_name
+from foodgram_backend.settings import IMAGE_VARIANTS
+from recipes.models import Recipe
+
+
+def walk(storage, path):
+    """
+    Yields names of all files under a storage directory.
+    """
+    if not storage.exists(path):
+        return
+    directories, files = storage.listdir(path)
+    for directory in directories:
+        yield from walk(storage, posixpath.join(path, directory))
+    for file in files:
+        yield posixpath.join(path, file)
+
+
+class Command(BaseCommand):
+    help = 'Delete recipe images and image variants no recipe refers to'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-age', type=int, default=3600,
+            help='Keep files younger than this many seconds, they may '
+                 'belong to a recipe that is being saved.')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only report what would be deleted.')
+
+    def handle(self, *args, **options):
+        field = Recipe._meta.get_field('image')
+        storage = field.storage
+        referenced = set()
+        for name in Recipe.objects.values_list('image', flat=True).iterator():
+            referenced.add(name)
+            referenced.update(variant_name(name, variant)
+                              for variant in IMAGE_VARIANTS)
+        cutoff = timezone.now() - timedelta(seconds=options['min_age'])
+        deleted = 0
+        for name in walk(storage, field.upload_to.rstrip('/')):
+            if (name in referenced
+                    or storage.get_modified_time(name) > cutoff):
+                continue
+            if not options['dry_run']:
+                storage.delete(name)
+            deleted += 1
+        action = 'Будет удалено' if options['dry_run'] else 'Удалено'
+        self.stdout.write(self.style.SUCCESS(f'{action} файлов: {deleted}'))
@@ -1,19 +1,13 @@
-import csv
-from django.core.management.base import BaseCommand
+from api.cache import INGREDIENTS_VERSION
+from api.management.base import CSVImportCommand
+from foodgram_backend.settings import BASE_DIR
 from recipes.models import Ingredient
 
 
-class Command(BaseCommand):
+class Command(CSVImportCommand):
     help = 'Import ingredients from csv file'
-
-    def handle(self, *args, **kwargs):
-        with open('/app/data/ingredients.csv', 'r', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            for row in reader:
-                name, measurement_unit = row
-                if Ingredient.objects.filter(
-                        name=name,
-                        measurement_unit=measurement_unit).exists():
-                    continue
-                Ingredient.objects.create(
-                    name=name, measurement_unit=measurement_unit)
+    model = Ingredient
+    fields = ('name', 'measurement_unit')
+    key_fields = ('name', 'measurement_unit')
+    version_name = INGREDIENTS_VERSION
+    default_path = BASE_DIR / 'data' / 'ingredients.csv'
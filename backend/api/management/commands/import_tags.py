@@ -1,21 +1,14 @@
-import csv
-
-from django.core.management.base import BaseCommand
+from api.cache import TAGS_VERSION
+from api.management.base import CSVImportCommand
+from foodgram_backend.settings import BASE_DIR
 from recipes.models import Tag
 
 
-class Command(BaseCommand):
+class Command(CSVImportCommand):
     help = 'Import tags from csv file'
-
-    def handle(self, *args, **kwargs):
-        with open('/app/data/tags.csv', 'r', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            for row in reader:
-                name, color, slug = row
-                if Tag.objects.filter(
-                        name=name,
-                        color=color,
-                        slug=slug).exists():
-                    continue
-                Tag.objects.create(
-                    name=name, color=color, slug=slug)
+    model = Tag
+    fields = ('name', 'color', 'slug')
+    key_fields = ('slug',)
+    update_fields = ('name', 'color')
+    version_name = TAGS_VERSION
+    default_path = BASE_DIR / 'data' / 'tags.csv'
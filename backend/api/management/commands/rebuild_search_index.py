@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from api.search import get_search_backend
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Index all recipes for full-text search'
+
+    def handle(self, *args, **kwargs):
+        backend = get_search_backend()
+        backend.install()
+        total = 0
+        for recipe_id in Recipe.objects.values_list(
+                'id', flat=True).iterator():
+            backend.index(recipe_id)
+            total += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Проиндексировано рецептов: {total}'))
@@ -0,0 +1,97 @@
+from array import array
+
+from django.core.cache import cache
+
+from foodgram_backend.settings import MEMBERSHIP_CACHE_TIMEOUT
+from recipes.models import Favourite, ShoppingCart
+from users.models import Subscription
+from .cache import bump_versions, get_version
+from .metrics import count_cache
+from .replicas import primary
+
+FAVORITES = 'favorites'
+CART = 'cart'
+SUBSCRIPTIONS = 'subscriptions'
+
+LOADERS = {
+    FAVORITES: lambda user_id: Favourite.objects.filter(
+        user=user_id).values_list('recipe_id', flat=True),
+    CART: lambda user_id: ShoppingCart.objects.filter(
+        user=user_id).values_list('recipe_id', flat=True),
+    SUBSCRIPTIONS: lambda user_id: Subscription.objects.filter(
+        subscriber=user_id).values_list('subscribing_id', flat=True),
+}
+
+
+def get_version_name(kind, user_id):
+    return f'membership:{kind}:{user_id}'
+
+
+def get_key(kind, user_id, version):
+    return f'membership:{kind}:{user_id}:{version}'
+
+
+def load_ids(kind, user_id):
+    """
+    Returns the set of ids of the given kind for the user. The ids are
+    cached as a compact integer array under the set's version stamp
+    and loaded from the primary only on a miss.
+    """
+    key = get_key(kind, user_id,
+                  get_version(get_version_name(kind, user_id)))
+    ids = cache.get(key)
+    count_cache(kind, ids is not None)
+    if ids is None:
+        with primary():
+            ids = array('q', sorted(LOADERS[kind](user_id)))
+        cache.set(key, ids, MEMBERSHIP_CACHE_TIMEOUT)
+    return frozenset(ids)
+
+
+def invalidate(kind, user_ids):
+    """
+    Bumps the version stamps of the sets in the writing transaction,
+    so every process, not only this one, stops reading the cached sets
+    within VERSION_CHECK_INTERVAL of the commit. The old sets expire.
+    """
+    bump_versions([get_version_name(kind, user_id)
+                   for user_id in user_ids])
+
+
+class Memberships:
+    """
+    Favorite recipes, cart recipes and followed authors of a user,
+    each set is loaded on first access.
+    """
+    def __init__(self, user):
+        self.user = user
+        self.sets = {}
+
+    def get(self, kind):
+        if not self.user.is_authenticated:
+            return frozenset()
+        if kind not in self.sets:
+            self.sets[kind] = load_ids(kind, self.user.id)
+        return self.sets[kind]
+
+    @property
+    def favorites(self):
+        return self.get(FAVORITES)
+
+    @property
+    def cart(self):
+        return self.get(CART)
+
+    @property
+    def subscriptions(self):
+        return self.get(SUBSCRIPTIONS)
+
+
+def get_memberships(request):
+    """
+    Returns memberships of the request user, shared by all serializers
+    of the request.
+    """
+    if not hasattr(request, '_memberships'):
+        request._memberships = Memberships(request.user)
+    return request._memberships
@@ -0,0 +1,206 @@
+import json
+import math
+import os
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from foodgram_backend.settings import METRICS_DIR, METRICS_FLUSH_INTERVAL
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+METRICS = []
+
+
+class Metric:
+    """
+    Metric whose samples are kept per process and flushed to a file
+    in METRICS_DIR, the scrape sums the files of all processes.
+    """
+    kind = None
+
+    def __init__(self, name, documentation, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        METRICS.append(self)
+
+    def key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, value=1, **labels):
+        key = self.key(labels)
+        with store.lock:
+            samples = store.values[self.name]
+            samples[key] = samples.get(key, 0) + value
+
+    def merge(self, old, new):
+        return (old or 0) + new
+
+    def samples(self, labels, value):
+        yield self.name, labels, value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames, buckets):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        """
+        Counts the value in its bucket, the last two cells
+        hold the sum and the count.
+        """
+        key = self.key(labels)
+        index = next((i for i, bound in enumerate(self.buckets)
+                      if value <= bound), len(self.buckets))
+        with store.lock:
+            cells = store.values[self.name].get(key)
+            if cells is None:
+                cells = [0] * (len(self.buckets) + 3)
+                store.values[self.name][key] = cells
+            cells[index] += 1
+            cells[-2] += value
+            cells[-1] += 1
+
+    def merge(self, old, new):
+        if old is None:
+            return list(new)
+        return [a + b for a, b in zip(old, new)]
+
+    def samples(self, labels, cells):
+        cumulative = 0
+        for bound, count in zip((*self.buckets, math.inf), cells):
+            cumulative += count
+            le = '+Inf' if bound == math.inf else repr(float(bound))
+            yield f'{self.name}_bucket', (*labels, ('le', le)), cumulative
+        yield f'{self.name}_sum', labels, cells[-2]
+        yield f'{self.name}_count', labels, cells[-1]
+
+
+class Store:
+    """
+    Samples of this process and their file, named after the role
+    of the process, web or worker, and its pid.
+    """
+    def __init__(self, role='web'):
+        self.role = role
+        self.values = defaultdict(dict)
+        self.lock = threading.Lock()
+        self.flushed = 0.0
+
+    @property
+    def path(self):
+        return Path(METRICS_DIR) / f'{self.role}-{os.getpid()}.json'
+
+    def flush(self):
+        with self.lock:
+            data = {name: [[list(key), value] for key, value
+                           in samples.items()]
+                    for name, samples in self.values.items()}
+            self.flushed = time.monotonic()
+        path = self.path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_suffix(f'.{threading.get_ident()}.tmp')
+        temp_path.write_text(json.dumps(data))
+        os.replace(temp_path, path)
+
+    def maybe_flush(self):
+        if time.monotonic() - self.flushed >= METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+
+store = Store()
+
+
+def reset(role):
+    """
+    Removes the files left by the previous run of the role and makes
+    this process write as the role. Called once when the role starts:
+    by the gunicorn master before forking and by run_workers.
+    """
+    store.role = role
+    for path in Path(METRICS_DIR).glob(f'{role}-*'):
+        path.unlink(missing_ok=True)
+
+
+def escape(value):
+    return (value.replace('\\', r'\\').replace('\n', r'\n')
+            .replace('"', r'\"'))
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"'
+                          for name, value in labels) + '}'
+
+
+def render():
+    """
+    Returns the metrics of all processes in the Prometheus text format.
+
+    Files of exited processes are kept until the role restarts,
+    so counters do not go back.
+    """
+    store.flush()
+    merged = defaultdict(dict)
+    metrics = {metric.name: metric for metric in METRICS}
+    for path in Path(METRICS_DIR).glob('*.json'):
+        try:
+            data = json.loads(path.read_text())
+        except (OSError, ValueError):
+            continue
+        for name, samples in data.items():
+            metric = metrics.get(name)
+            if metric is None:
+                continue
+            for key, value in samples:
+                key = tuple(key)
+                merged[name][key] = metric.merge(
+                    merged[name].get(key), value)
+    lines = []
+    for metric in METRICS:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        for key, value in sorted(merged[metric.name].items()):
+            labels = tuple(zip(metric.labelnames, key))
+            for name, sample_labels, sample in metric.samples(labels, value):
+                lines.append(f'{name}{format_labels(sample_labels)} '
+                             f'{float(sample)!r}')
+    return '\n'.join(lines) + '\n'
+
+
+request_latency = Histogram(
+    'foodgram_request_duration_seconds',
+    'Request latency by view.',
+    ('view', 'method'), LATENCY_BUCKETS)
+request_errors = Counter(
+    'foodgram_request_errors_total',
+    'Responses with 4xx and 5xx status by view.',
+    ('view', 'method', 'status'))
+request_queries = Histogram(
+    'foodgram_request_queries',
+    'Database queries per request by view.',
+    ('view', 'method'), QUERY_BUCKETS)
+cache_requests = Counter(
+    'foodgram_cache_requests_total',
+    'Cache lookups by cache and result, hit or miss.',
+    ('cache', 'result'))
+export_render = Histogram(
+    'foodgram_export_render_seconds',
+    'Shopping list render time by format.',
+    ('format',), LATENCY_BUCKETS)
+
+
+def count_cache(name, hit):
+    cache_requests.inc(cache=name, result='hit' if hit else 'miss')
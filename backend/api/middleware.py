@@ -0,0 +1,118 @@
+import cProfile
+import json
+import logging
+import random
+import time
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.db import connections
+
+from foodgram_backend.settings import (
+    PROFILE_DIR, PROFILE_SAMPLE_RATE, QUERY_DIAGNOSTICS,
+    SERVER_TIMING_HEADER)
+from . import diagnostics, metrics
+from .timing import Timings, current_timings
+
+logger = logging.getLogger(__name__)
+
+
+def get_view_name(request):
+    """
+    Returns ViewSet.action of the resolved view, e.g. RecipeViewSet.list.
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return None
+    view_class = getattr(match.func, 'cls', None)
+    if view_class is None:
+        return match.view_name
+    actions = getattr(match.func, 'actions', None) or {}
+    action = actions.get(request.method.lower(), request.method.lower())
+    return f'{view_class.__name__}.{action}'
+
+
+class ServerTimingMiddleware:
+    """
+    Measures total, database and serializer time, query count and
+    response size of each request. They are logged as one JSON line
+    tagged with the view and, with SERVER_TIMING_HEADER, sent in
+    the Server-Timing header.
+
+    A PROFILE_SAMPLE_RATE fraction of requests is run under cProfile
+    and the stats are dumped to PROFILE_DIR. Latency, query count
+    and errors are also counted in the metrics. With QUERY_DIAGNOSTICS
+    repeated statements and slow queries are logged as well.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = Timings()
+        token = current_timings.set(timings)
+        query_log = diagnostics.QueryLog() if QUERY_DIAGNOSTICS else None
+        profiler = None
+        if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+            profiler = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timings))
+                    if query_log is not None:
+                        stack.enter_context(
+                            connection.execute_wrapper(query_log))
+                if profiler is not None:
+                    profiler.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    if profiler is not None:
+                        profiler.disable()
+        finally:
+            current_timings.reset(token)
+        total = time.perf_counter() - start
+        view = get_view_name(request)
+        record = {
+            'view': view,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 2),
+            'db_ms': round(timings.durations['db'] * 1000, 2),
+            'queries': timings.queries,
+            'serializer_ms': round(
+                timings.durations['serializer'] * 1000, 2),
+            'size': (None if response.streaming
+                     else len(response.content)),
+        }
+        if profiler is not None:
+            record['profile'] = self.dump_profile(profiler, view)
+        if SERVER_TIMING_HEADER:
+            response['Server-Timing'] = (
+                f'total;dur={record["total_ms"]}, '
+                f'db;dur={record["db_ms"]};desc="{timings.queries} queries", '
+                f'serializer;dur={record["serializer_ms"]}')
+        logger.info(json.dumps(record, ensure_ascii=False))
+        if query_log is not None:
+            diagnostics.report(query_log, view)
+        self.count(record, total)
+        return response
+
+    @staticmethod
+    def count(record, total):
+        labels = {'view': record['view'] or 'unresolved',
+                  'method': record['method']}
+        metrics.request_latency.observe(total, **labels)
+        metrics.request_queries.observe(record['queries'], **labels)
+        if record['status'] >= 400:
+            metrics.request_errors.inc(status=record['status'], **labels)
+        metrics.store.maybe_flush()
+
+    @staticmethod
+    def dump_profile(profiler, view):
+        directory = Path(PROFILE_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f'{time.time_ns()}-{view or "unknown"}.prof'
+        profiler.dump_stats(path)
+        return str(path)
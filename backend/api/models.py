@@ -0,0 +1,17 @@
+from django.db import models
+
+
+class VersionStamp(models.Model):
+    """
+    Version of a data set shared by all processes, changed every time
+    the data set changes: the tags, the ingredients or the favorites,
+    cart and subscriptions of one user.
+    """
+    name = models.CharField(
+        max_length=50,
+        primary_key=True,
+        verbose_name='Набор данных')
+    value = models.BigIntegerField(verbose_name='Версия')
+
+    def __str__(self):
+        return f'{self.name} {self.value}'
@@ -1,11 +1,55 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
+from foodgram_backend.settings import MAX_CART_PAGE_SIZE, MAX_PAGE_SIZE
 
-class ShoppingCartPagination(PageNumberPagination):
+TRUE_VALUES = ('1', 'true', 'True')
+
+
+class RecipeCursorPagination(CursorPagination):
+    """
+    Keyset pagination over (-pub_date, -id) with opaque cursors,
+    every page costs the same regardless of its depth.
+    """
+    page_size = 6
+    page_size_query_param = 'limit'
+    max_page_size = MAX_PAGE_SIZE
+    ordering = ('-pub_date', '-id')
+
+    def get_ordering(self, request, queryset, view):
+        """
+        Ignores ?ordering=: cursors need a unique ordering of plain
+        fields, e.g. author would not encode and name would skip rows.
+        """
+        return self.ordering
+
+
+class RecipePagination(PageNumberPagination):
+    """
+    Page number pagination with the page size taken from ?limit=
+    and bounded by MAX_PAGE_SIZE. The shopping cart is shown
+    on one page, so its bound is MAX_CART_PAGE_SIZE.
+    With ?pagination=cursor the keyset pagination is used instead.
+    """
     page_size = 6
+    page_size_query_param = 'limit'
+    max_page_size = MAX_PAGE_SIZE
+    cart_max_page_size = MAX_CART_PAGE_SIZE
+    cursor_pagination_class = RecipeCursorPagination
 
     def get_page_size(self, request):
-        if 'is_in_shopping_cart' in request.query_params:
-            user = request.user
-            return user.shopping.all().count()
-        return self.page_size
+        if request.query_params.get('is_in_shopping_cart') in TRUE_VALUES:
+            self.max_page_size = self.cart_max_page_size
+        return super().get_page_size(request)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_paginator = None
+        if request.query_params.get('pagination') == 'cursor':
+            self.cursor_paginator = self.cursor_pagination_class()
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,119 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core import signing
+from rest_framework.permissions import SAFE_METHODS
+
+PRIMARY = 'default'
+# Models read from the primary even in replica requests: a token
+# created at login must authenticate the very next request, a version
+# stamp read from a lagging replica would be cached as the current one.
+PRIMARY_MODELS = {'authtoken.token', 'api.versionstamp'}
+
+STICKY_COOKIE = 'primary_sticky'
+STICKY_SALT = 'api.replicas.sticky'
+
+read_from_replica = ContextVar('read_from_replica', default=False)
+
+
+def read_from_primary(view):
+    """
+    Marks a view, a viewset or a viewset action whose reads must
+    always go to the primary, e.g. because they poll rows written
+    by someone else a moment ago.
+    """
+    view.read_from_primary = True
+    return view
+
+
+@contextmanager
+def primary():
+    """
+    Sends the reads of the block to the primary.
+    """
+    token = read_from_replica.set(False)
+    try:
+        yield
+    finally:
+        read_from_replica.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Sends reads of replica requests to a random database
+    of REPLICA_DATABASES, everything else to the primary.
+    """
+    def db_for_read(self, model, **hints):
+        if (settings.REPLICA_DATABASES and read_from_replica.get()
+                and model._meta.label_lower not in PRIMARY_MODELS):
+            return random.choice(settings.REPLICA_DATABASES)
+        return PRIMARY
+
+    def db_for_write(self, model, **hints):
+        # Objects loaded from a replica are saved to the primary too.
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+
+def is_sticky(request):
+    """
+    Tells whether the client has written in the last PRIMARY_STICKY_SECONDS.
+    The mark is a signed cookie, so every process sees it.
+    """
+    try:
+        return request.get_signed_cookie(
+            STICKY_COOKIE, salt=STICKY_SALT,
+            max_age=settings.PRIMARY_STICKY_SECONDS) is not None
+    except (KeyError, signing.BadSignature):
+        return False
+
+
+def is_primary_view(request, view_func):
+    if getattr(view_func, 'read_from_primary', False):
+        return True
+    view_class = getattr(view_func, 'cls', None)
+    if view_class is None:
+        return False
+    if getattr(view_class, 'read_from_primary', False):
+        return True
+    actions = getattr(view_func, 'actions', None) or {}
+    method = getattr(view_class, actions.get(request.method.lower(), ''),
+                     None)
+    return getattr(method, 'read_from_primary', False)
+
+
+class ReplicaMiddleware:
+    """
+    Lets safe requests read from the replicas. A client that has
+    just written reads from the primary for PRIMARY_STICKY_SECONDS,
+    so it sees its own changes despite the replication lag.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = read_from_replica.set(False)
+        try:
+            response = self.get_response(request)
+        finally:
+            read_from_replica.reset(token)
+        if (settings.REPLICA_DATABASES
+                and request.method not in SAFE_METHODS
+                and response.status_code < 400):
+            response.set_signed_cookie(
+                STICKY_COOKIE, '1', salt=STICKY_SALT,
+                max_age=settings.PRIMARY_STICKY_SECONDS, httponly=True,
+                samesite='Lax')
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if (not settings.REPLICA_DATABASES
+                or request.method not in SAFE_METHODS
+                or is_primary_view(request, view_func)):
+            return
+        if not is_sticky(request):
+            read_from_replica.set(True)
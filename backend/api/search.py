@@ -0,0 +1,184 @@
+import re
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+from foodgram_backend.settings import SEARCH_CONFIG
+from recipes.models import Recipe, RecipeIngredient
+
+SEARCH_TABLE = 'api_recipesearch'
+WORD = re.compile(r'\w+')
+
+SEARCH_BACKENDS = {}
+
+
+def register_backend(vendor):
+    """
+    Registers a search backend for a database vendor.
+    """
+    def decorator(backend_class):
+        SEARCH_BACKENDS[vendor] = backend_class
+        return backend_class
+    return decorator
+
+
+def get_search_backend(using=DEFAULT_DB_ALIAS):
+    """
+    Returns the search backend working on the database of the alias.
+    """
+    connection = connections[using]
+    backend_class = SEARCH_BACKENDS.get(connection.vendor,
+                                        DatabaseSearchBackend)
+    return backend_class(connection)
+
+
+def get_document(recipe_id):
+    """
+    Returns the name, ingredient names and text of a recipe.
+    """
+    recipe = Recipe.objects.filter(pk=recipe_id).values(
+        'name', 'text').first()
+    if recipe is None:
+        return None
+    ingredients = RecipeIngredient.objects.filter(
+        recipe=recipe_id).values_list('ingredient__name', flat=True)
+    return recipe['name'], ' '.join(ingredients), recipe['text']
+
+
+class DatabaseSearchBackend:
+    """
+    Fallback backend that searches with LIKE and keeps no index.
+    """
+    def __init__(self, connection):
+        self.connection = connection
+
+    def install(self):
+        pass
+
+    def index(self, recipe_id):
+        pass
+
+    def remove(self, recipe_id):
+        pass
+
+    def search(self, queryset, query):
+        condition = Q()
+        for word in WORD.findall(query):
+            condition &= (Q(name__icontains=word)
+                          | Q(text__icontains=word)
+                          | Q(ingredients__name__icontains=word))
+        return queryset.filter(pk__in=Recipe.objects.filter(
+            condition).values('pk')).annotate(
+            search_rank=Value(0.0, output_field=FloatField()))
+
+
+@register_backend('postgresql')
+class PostgresSearchBackend(DatabaseSearchBackend):
+    """
+    Stores a weighted tsvector per recipe in a table with GIN indexes
+    on the vector and, for typos, on trigrams of the document.
+    Matches are ranked by ts_rank plus trigram word similarity.
+    """
+    def install(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ('
+                f'recipe_id bigint PRIMARY KEY REFERENCES '
+                f'{Recipe._meta.db_table} (id) ON DELETE CASCADE '
+                'DEFERRABLE INITIALLY DEFERRED, '
+                'document text NOT NULL, '
+                'vector tsvector NOT NULL)')
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_vector '
+                f'ON {SEARCH_TABLE} USING gin (vector)')
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_trgm '
+                f'ON {SEARCH_TABLE} USING gin (document gin_trgm_ops)')
+
+    def index(self, recipe_id):
+        document = get_document(recipe_id)
+        if document is None:
+            return
+        name, ingredients, text = document
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {SEARCH_TABLE} (recipe_id, document, vector) '
+                'VALUES (%s, %s, '
+                "setweight(to_tsvector(%s::regconfig, %s), 'A') "
+                "|| setweight(to_tsvector(%s::regconfig, %s), 'B') "
+                "|| setweight(to_tsvector(%s::regconfig, %s), 'C')) "
+                'ON CONFLICT (recipe_id) DO UPDATE '
+                'SET document = EXCLUDED.document, '
+                'vector = EXCLUDED.vector',
+                [recipe_id, ' '.join(document),
+                 SEARCH_CONFIG, name, SEARCH_CONFIG, ingredients,
+                 SEARCH_CONFIG, text])
+
+    def remove(self, recipe_id):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {SEARCH_TABLE} WHERE recipe_id = %s',
+                [recipe_id])
+
+    def search(self, queryset, query):
+        table = Recipe._meta.db_table
+        matches = ('vector @@ plainto_tsquery(%s::regconfig, %s) '
+                   'OR %s <%% document')
+        params = [SEARCH_CONFIG, query, query]
+        return queryset.filter(pk__in=RawSQL(
+            f'SELECT recipe_id FROM {SEARCH_TABLE} WHERE {matches}',
+            params
+        )).annotate(search_rank=RawSQL(
+            'SELECT ts_rank(vector, plainto_tsquery(%s::regconfig, %s)) '
+            f'+ word_similarity(%s, document) FROM {SEARCH_TABLE} '
+            f'WHERE recipe_id = {table}.id',
+            params, output_field=FloatField()))
+
+
+@register_backend('sqlite')
+class SQLiteSearchBackend(DatabaseSearchBackend):
+    """
+    Keeps recipes in an FTS5 table whose rowid is the recipe id
+    and ranks matches with bm25.
+    """
+    weights = (10.0, 5.0, 1.0)
+
+    def install(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} '
+                'USING fts5(name, ingredients, text)')
+
+    def index(self, recipe_id):
+        document = get_document(recipe_id)
+        if document is None:
+            return
+        self.remove(recipe_id)
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {SEARCH_TABLE} '
+                '(rowid, name, ingredients, text) VALUES (%s, %s, %s, %s)',
+                [recipe_id, *document])
+
+    def remove(self, recipe_id):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', [recipe_id])
+
+    def search(self, queryset, query):
+        match = ' '.join(f'"{word}"*' for word in WORD.findall(query))
+        if not match:
+            return queryset.annotate(search_rank=Value(
+                0.0, output_field=FloatField())).none()
+        table = Recipe._meta.db_table
+        weights = ', '.join(str(weight) for weight in self.weights)
+        return queryset.filter(pk__in=RawSQL(
+            f'SELECT rowid FROM {SEARCH_TABLE} '
+            f'WHERE {SEARCH_TABLE} MATCH %s',
+            [match]
+        )).annotate(search_rank=RawSQL(
+            f'SELECT -bm25({SEARCH_TABLE}, {weights}) FROM {SEARCH_TABLE} '
+            f'WHERE {SEARCH_TABLE} MATCH %s AND rowid = {table}.id',
+            [match], output_field=FloatField()))
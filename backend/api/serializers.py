@@ -1,22 +1,45 @@
 import base64
+import binascii
+
 import webcolors
 from djoser.serializers import UserSerializer, UserCreateSerializer
 from django.core.files.base import ContentFile
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from django.urls import reverse
 from rest_framework import serializers
 
+from jobs.models import Job
 from recipes.models import (Recipe,
                             Ingredient,
                             Tag,
                             RecipeIngredient,
+                            RecipeTag,
                             Favourite,
                             ShoppingCart)
-from users.models import Subscription
-from foodgram_backend.settings import RECIPE_LIMIT
+from recipes.shopping_list import change_recipe
+from users.models import Subscription, UserStats
+from foodgram_backend.settings import (
+    RECIPE_LIMIT, MAX_RECIPE_LIMIT, MAX_BULK_SIZE)
+from .images import (
+    check_size, process_image, schedule_variants, variant_urls)
+from .memberships import get_memberships
+from .timing import measure
 
 User = get_user_model()
 
 
+class TimedSerializerMixin:
+    """
+    Adds the time spent in to_representation to the serializer
+    duration of the request.
+    """
+    def to_representation(self, instance):
+        with measure('serializer'):
+            return super().to_representation(instance)
+
+
 class Hex2NameColor(serializers.Field):
     """
     Custom serializer field for converting hex color codes to color names.
@@ -32,7 +55,7 @@ class Hex2NameColor(serializers.Field):
         return data
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Serializer for model Tag.
     """
@@ -43,7 +66,7 @@ class TagSerializer(serializers.ModelSerializer):
         fields = 'id', 'name', 'color', 'slug'
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
         Serializer for model Ingredient.
     """
@@ -55,15 +78,44 @@ class IngredientSerializer(serializers.ModelSerializer):
 class Base64ImageField(serializers.ImageField):
     """
         Custom serializer field for handling base64 encoded images.
+
+        The payload size is checked before decoding, the image is then
+        re-encoded without metadata.
     """
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
             format, imgstr = data.split(';base64,')
             ext = format.split('/')[-1]
+            check_size(len(imgstr) * 3 // 4)
+            try:
+                data = ContentFile(base64.b64decode(imgstr),
+                                   name='temp.' + ext)
+            except binascii.Error:
+                raise serializers.ValidationError(
+                    'Некорректная строка base64.')
+        if hasattr(data, 'size'):
+            data = process_image(data)
+        return super().to_internal_value(data)
 
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
 
-        return super().to_internal_value(data)
+class ImageVariantsField(serializers.Field):
+    """
+    Read-only field with URLs of the fixed-width variants of an image.
+    """
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def get_attribute(self, instance):
+        return instance.image.name
+
+    def to_representation(self, value):
+        request = self.context.get('request')
+        urls = variant_urls(value)
+        if request is None:
+            return urls
+        return {variant: url and request.build_absolute_uri(url)
+                for variant, url in urls.items()}
 
 
 class RecipeIngredientSerializer(serializers.ModelSerializer):
@@ -81,7 +133,7 @@ class RecipeIngredientSerializer(serializers.ModelSerializer):
         fields = 'id', 'name', 'measurement_unit', 'amount'
 
 
-class CustomUserSerializer(UserSerializer):
+class CustomUserSerializer(TimedSerializerMixin, UserSerializer):
     """
     Default UserSerializer with an additional field 'is_subscribed'
     """
@@ -99,14 +151,11 @@ class CustomUserSerializer(UserSerializer):
                   'is_subscribed')
 
     def get_is_subscribed(self, obj):
-        current_user = self.context['request'].user
-        return (current_user.is_authenticated
-                and Subscription.objects.filter(
-                    subscriber=current_user,
-                    subscribing=obj).exists())
+        memberships = get_memberships(self.context['request'])
+        return obj.id in memberships.subscriptions
 
 
-class RecipeReadSerializer(serializers.ModelSerializer):
+class RecipeReadSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Serializer for get-requests to the Recipe model.
     """
@@ -122,25 +171,24 @@ class RecipeReadSerializer(serializers.ModelSerializer):
         'get_is_in_shopping_cart',
         read_only=True)
     image = Base64ImageField
+    images = ImageVariantsField()
 
     class Meta:
         model = Recipe
         fields = ('id', 'name', 'author', 'tags', 'ingredients',
                   'is_favorited', 'is_in_shopping_cart', 'image',
-                  'text', 'cooking_time')
+                  'images', 'text', 'cooking_time')
 
     def get_is_favorited(self, obj):
-        current_user = self.context['request'].user
-        return (current_user.is_authenticated
-                and obj.favorite.filter(user=current_user).exists())
+        memberships = get_memberships(self.context['request'])
+        return obj.id in memberships.favorites
 
     def get_is_in_shopping_cart(self, obj):
-        current_user = self.context['request'].user
-        return (current_user.is_authenticated
-                and obj.shopping.filter(user=current_user).exists())
+        memberships = get_memberships(self.context['request'])
+        return obj.id in memberships.cart
 
 
-class RecipeWriteSerializer(serializers.ModelSerializer):
+class RecipeWriteSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Serializer for creation, modification and deletion of Recipe model object.
     """
@@ -159,27 +207,72 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         fields = ('id', 'author', 'name', 'tags', 'ingredients',
                   'image', 'text', 'cooking_time')
 
-    def _introduce_ingredients_in_recepies(
-            self, data_ingredient_amount, recipe):
-        ingredients_data = []
-        for ingredient_amount in data_ingredient_amount:
-            ingredient = Ingredient.objects.get(
-                pk=ingredient_amount['ingredient']['id'])
-            obj, created = RecipeIngredient.objects.update_or_create(
-                ingredient=ingredient,
-                recipe=recipe,
-                defaults={'amount': ingredient_amount["amount"]})
-            ingredients_data.append(obj.ingredient.id)
-        return ingredients_data
-
+    @staticmethod
+    def _set_tags(recipe, tags):
+        """
+        Brings the recipe tags to the given list with one insert
+        and one delete.
+        """
+        new_ids = {tag.id for tag in tags}
+        old_ids = set(RecipeTag.objects.filter(
+            recipe=recipe).values_list('tag_id', flat=True))
+        RecipeTag.objects.filter(
+            recipe=recipe, tag_id__in=old_ids - new_ids).delete()
+        RecipeTag.objects.bulk_create(
+            RecipeTag(recipe=recipe, tag_id=tag_id)
+            for tag_id in new_ids - old_ids)
+
+    @staticmethod
+    def _set_ingredients(recipe, data_ingredient_amount):
+        """
+        Diffs submitted ingredients against the stored ones and applies
+        the difference with one bulk_create, one bulk_update and one delete.
+        Returns the amount deltas by ingredient id.
+        """
+        amounts = {item['ingredient']['id']: item['amount']
+                   for item in data_ingredient_amount}
+        existing_ids = set(Ingredient.objects.filter(
+            pk__in=amounts).values_list('pk', flat=True))
+        missing_ids = set(amounts) - existing_ids
+        if missing_ids:
+            raise serializers.ValidationError(
+                {'ingredients': [f'Нет ингредиента с id={pk}.'
+                                 for pk in sorted(missing_ids)]})
+        stored = {obj.ingredient_id: obj for obj
+                  in RecipeIngredient.objects.filter(recipe=recipe)}
+        deltas = {ingredient_id: -obj.amount
+                  for ingredient_id, obj in stored.items()}
+        for ingredient_id, amount in amounts.items():
+            deltas[ingredient_id] = deltas.get(ingredient_id, 0) + amount
+        changed = []
+        for ingredient_id, amount in amounts.items():
+            obj = stored.get(ingredient_id)
+            if obj is not None and obj.amount != amount:
+                obj.amount = amount
+                changed.append(obj)
+        RecipeIngredient.objects.filter(
+            recipe=recipe,
+            ingredient_id__in=set(stored) - set(amounts)).delete()
+        RecipeIngredient.objects.bulk_update(changed, ['amount'])
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient_id=ingredient_id,
+                             amount=amount)
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id not in stored)
+        return deltas
+
+    @transaction.atomic
     def create(self, validated_data):
         validated_data['author'] = self.context['request'].user
         data_ingredient_amount = validated_data.pop('recipeingredient_set')
+        tags = validated_data.pop('tags')
         recipe = super().create(validated_data)
-        self._introduce_ingredients_in_recepies(
-            data_ingredient_amount, recipe)
+        self._set_tags(recipe, tags)
+        self._set_ingredients(recipe, data_ingredient_amount)
+        schedule_variants(recipe.image.name)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         required_fields = ['name', 'image', 'text', 'recipeingredient_set',
                            'tags', 'cooking_time']
@@ -188,22 +281,36 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
                 raise serializers.ValidationError(
                     {field: ['Это поле обязательно для изменения.']})
         data_ingredient_amount = validated_data.pop('recipeingredient_set')
+        tags = validated_data.pop('tags')
+        # Lock the recipe so concurrent edits and cart changes of it
+        # apply their diffs one by one, see shopping_list.lock_recipes().
+        Recipe.objects.select_for_update().get(pk=instance.pk)
         instance = super().update(instance, validated_data)
-        ingredients_data = self._introduce_ingredients_in_recepies(
-            data_ingredient_amount, instance)
-        instance.ingredients.set(ingredients_data)
-        instance.save()
+        self._set_tags(instance, tags)
+        change_recipe(instance.pk, self._set_ingredients(
+            instance, data_ingredient_amount))
+        schedule_variants(instance.image.name)
         return instance
 
+    def to_representation(self, instance):
+        prefetch_related_objects(
+            [instance],
+            'tags',
+            Prefetch('recipeingredient_set',
+                     queryset=RecipeIngredient.objects.select_related(
+                         'ingredient')))
+        return super().to_representation(instance)
+
 
-class RecipeShortSerializer(serializers.ModelSerializer):
+class RecipeShortSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Serializer for outputting a shortened version of Recipe model objects.
     """
+    images = ImageVariantsField()
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'images', 'cooking_time')
 
 
 class SubscribeSerializer(CustomUserSerializer):
@@ -219,13 +326,36 @@ class SubscribeSerializer(CustomUserSerializer):
         fields = ('id', 'email', 'username', 'first_name', 'last_name',
                   'is_subscribed', 'recipes', 'recipes_count')
 
+    @staticmethod
+    def get_recipes_limit(request):
+        """
+        Returns the validated recipes_limit query parameter.
+
+        Values above MAX_RECIPE_LIMIT are clamped to it.
+        """
+        limit = request.query_params.get('recipes_limit', RECIPE_LIMIT)
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            raise serializers.ValidationError(
+                {'recipes_limit': ['Значение должно быть целым числом.']})
+        if limit < 0:
+            raise serializers.ValidationError(
+                {'recipes_limit': ['Значение не может быть отрицательным.']})
+        return min(limit, MAX_RECIPE_LIMIT)
+
     def get_recipes_count(self, obj):
-        return obj.recipes.all().count()
+        if hasattr(obj, 'recipes_count'):
+            return obj.recipes_count
+        stats = UserStats.objects.filter(user=obj).first()
+        return stats.recipes_count if stats else obj.recipes.count()
 
     def get_recipes(self, obj):
-        limit = self.context['request'].query_params.get(
-            'recipes_limit', RECIPE_LIMIT)
-        recipes = obj.recipes.all()[:int(limit)]
+        if hasattr(obj, 'latest_recipes'):
+            recipes = obj.latest_recipes
+        else:
+            limit = self.get_recipes_limit(self.context['request'])
+            recipes = obj.recipes.order_by('-pub_date')[:limit]
         return RecipeShortSerializer(instance=recipes, many=True).data
 
 
@@ -326,3 +456,33 @@ class ShoppingSerializer(serializers.ModelSerializer):
                 recipe=recipe).exists():
             raise serializers.ValidationError('Рецепт уже в покупках.')
         return super().validate(data)
+
+
+class BulkIdsSerializer(serializers.Serializer):
+    """
+    Serializer for recipe or author ids of a bulk operation.
+    """
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False, max_length=MAX_BULK_SIZE)
+
+    def validate_ids(self, value):
+        return list(dict.fromkeys(value))
+
+
+class JobSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """
+    Serializer for polling the status of a background job.
+    """
+    result = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Job
+        fields = ('id', 'name', 'status', 'attempts', 'created', 'finished',
+                  'result')
+
+    def get_result(self, obj):
+        if obj.status != Job.Status.DONE or not obj.content_type:
+            return None
+        return self.context['request'].build_absolute_uri(
+            reverse('api:job-result', args=[obj.pk]))
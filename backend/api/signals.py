@@ -0,0 +1,93 @@
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Favourite, Ingredient, Recipe, ShoppingCart, Tag
+from recipes.relations import relations_changed
+from users.models import Subscription
+from .authentication import token_cache
+from .cache import INGREDIENTS_VERSION, TAGS_VERSION, bump_version
+from .memberships import CART, FAVORITES, SUBSCRIPTIONS, invalidate
+from .search import get_search_backend
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def bump_ingredients_version(sender, **kwargs):
+    bump_version(INGREDIENTS_VERSION)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def bump_tags_version(sender, **kwargs):
+    bump_version(TAGS_VERSION)
+
+
+@receiver(post_save, sender=Favourite)
+def invalidate_favorites(sender, instance, **kwargs):
+    invalidate(FAVORITES, [instance.user_id])
+
+
+@receiver(post_save, sender=ShoppingCart)
+def invalidate_cart(sender, instance, **kwargs):
+    invalidate(CART, [instance.user_id])
+
+
+@receiver(relations_changed)
+def invalidate_relations(sender, user_ids, **kwargs):
+    invalidate(FAVORITES if sender is Favourite else CART, user_ids)
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def invalidate_subscriptions(sender, instance, **kwargs):
+    invalidate(SUBSCRIPTIONS, [instance.subscriber_id])
+
+
+@receiver(post_save, sender=Recipe)
+def index_recipe(sender, instance, **kwargs):
+    """
+    Indexes the recipe after commit, when its ingredients are written too.
+    """
+    transaction.on_commit(
+        lambda: get_search_backend().index(instance.pk))
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_recipe_from_index(sender, instance, **kwargs):
+    get_search_backend().remove(instance.pk)
+
+
+def forget_tokens(keys):
+    """
+    Drops cached tokens after commit: dropped earlier, they could be
+    cached again with the user of before the transaction.
+    """
+    transaction.on_commit(lambda: token_cache.invalidate(keys))
+
+
+@receiver(post_delete, sender=Token)
+def forget_token(sender, instance, **kwargs):
+    forget_tokens([instance.key])
+
+
+@receiver(post_save, sender=User)
+def forget_user_tokens(sender, instance, created, update_fields=None,
+                       **kwargs):
+    """
+    Drops the cached tokens of a changed user, e.g. after a password
+    change or deactivation. A login only updates last_login.
+    """
+    if created or update_fields is not None and set(
+            update_fields) <= {'last_login'}:
+        return
+    forget_tokens(list(Token.objects.filter(
+        user=instance).values_list('key', flat=True)))
+
+
+def install_search_backend(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    get_search_backend(using).install()
@@ -0,0 +1,70 @@
+import gzip
+import hashlib
+import json
+
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import parse_etags
+
+from recipes.models import Ingredient, Tag
+from .cache import INGREDIENTS_VERSION, TAGS_VERSION, get_version
+from .metrics import count_cache
+from .replicas import primary
+
+
+class Snapshot:
+    """
+    Process-local, pre-rendered JSON list of a near-static table.
+
+    The list is rendered with a single values_list query, kept together
+    with its gzip-compressed copy and a strong ETag, and rebuilt only
+    when the version stamp of the table changes. It is built from
+    the primary, a lagging replica would be cached for the version.
+    """
+    def __init__(self, model, fields, version_name):
+        self.model = model
+        self.fields = fields
+        self.version_name = version_name
+        self.version = None
+        self.data = None
+
+    def build(self, version):
+        with primary():
+            rows = list(self.model.objects.order_by('id').values_list(
+                *self.fields))
+        content = json.dumps(
+            [dict(zip(self.fields, row)) for row in rows],
+            ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        etag = f'"{hashlib.sha1(content).hexdigest()}"'
+        self.data = (content, gzip.compress(content, mtime=0), etag)
+        self.version = version
+
+    def get(self):
+        version = get_version(self.version_name)
+        data = self.data
+        hit = data is not None and self.version == version
+        count_cache(f'{self.model._meta.model_name}_snapshot', hit)
+        if not hit:
+            self.build(version)
+            data = self.data
+        return data
+
+    def response(self, request):
+        content, compressed, etag = self.get()
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = HttpResponseNotModified()
+        elif 'gzip' in request.headers.get('Accept-Encoding', ''):
+            response = HttpResponse(
+                compressed, content_type='application/json')
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = HttpResponse(content, content_type='application/json')
+        response['ETag'] = etag
+        response['Cache-Control'] = 'no-cache'
+        response['Vary'] = 'Accept-Encoding'
+        return response
+
+
+tag_snapshot = Snapshot(
+    Tag, ('id', 'name', 'color', 'slug'), TAGS_VERSION)
+ingredient_snapshot = Snapshot(
+    Ingredient, ('id', 'name', 'measurement_unit'), INGREDIENTS_VERSION)
@@ -0,0 +1,25 @@
+from django.contrib.auth import get_user_model
+
+from jobs.registry import Result, task
+from recipes.counters import reconcile_counters
+from . import metrics
+from .exports import (
+    SHOPPING_LIST_RENDERERS, get_content_type, render_shopping_list)
+
+User = get_user_model()
+
+
+@task('export_shopping_list')
+def export_shopping_list_task(user_id, format):
+    renderer = next(renderer_class() for renderer_class
+                    in SHOPPING_LIST_RENDERERS
+                    if renderer_class.format == format)
+    content = render_shopping_list(User.objects.get(pk=user_id), renderer)
+    metrics.store.maybe_flush()
+    return Result(content, get_content_type(renderer),
+                  f'shopping_list.{format}')
+
+
+@task('reconcile_counters', max_attempts=1)
+def reconcile_counters_task():
+    reconcile_counters()
@@ -1,6 +1,50 @@
+import base64
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
 from http import HTTPStatus
+from concurrent.futures import ThreadPoolExecutor
+from unittest import skipUnless
+from unittest.mock import patch
 
-from django.test import Client, TestCase
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.db.models.deletion import Collector
+from django.test import (
+    Client, TestCase, TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api import (
+    authentication, benchmark, diagnostics, images, memberships, metrics,
+    replicas, search, signals)
+from api.cache import INGREDIENTS_VERSION, bump_version, get_cache_key
+from api.indexes import ingredient_index
+from api.paginations import RecipePagination
+from api.urls import customrouter, router
+from jobs.registry import enqueue
+from recipes import counters, relations, shopping_list
+from recipes.models import (
+    Favourite, Ingredient, Recipe, RecipeIngredient, ShoppingCart,
+    ShoppingCartVersion, ShoppingListItem, Tag)
+from users.models import Subscription, UserStats
+
+User = get_user_model()
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp()
+IMAGE = ('data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAIAAACQd1'
+         'PeAAAADElEQVR4nGNgYGAAAAAEAAH2FzhVAAAAAElFTkSuQmCC')
 
 
 class RecipeAPITestCase(TestCase):
@@ -10,3 +54,1516 @@ class RecipeAPITestCase(TestCase):
     def test_list_exists(self):
         response = self.guest_client.get('/api/recipes/')
         self.assertEqual(response.status_code, HTTPStatus.OK)
+
+
+class RecipeQueryCountTestCase(TestCase):
+    """
+    The number of queries for the recipe feed must not depend on page size.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass')
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass')
+        Subscription.objects.create(subscriber=cls.user,
+                                    subscribing=cls.author)
+        cls.tags = [
+            Tag.objects.create(name=f'Тег {i}', color=f'#00000{i}',
+                               slug=f'tag{i}')
+            for i in range(2)]
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {i}',
+                                      measurement_unit='г')
+            for i in range(3)]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_recipes(self, count):
+        for _ in range(count):
+            recipe = Recipe.objects.create(
+                author=self.author,
+                name=f'Рецепт {Recipe.objects.count()}',
+                image='recipes/images/test.png',
+                text='Описание',
+                cooking_time=10)
+            recipe.tags.set(self.tags)
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                 amount=1)
+                for ingredient in self.ingredients)
+            Favourite.objects.create(user=self.user, recipe=recipe)
+            ShoppingCart.objects.create(user=self.user, recipe=recipe)
+
+    def count_queries(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return len(context), response
+
+    def test_list_query_count_is_constant(self):
+        self.create_recipes(1)
+        queries_for_one, _ = self.count_queries('/api/recipes/')
+        self.create_recipes(5)
+        queries_for_six, response = self.count_queries('/api/recipes/')
+        self.assertEqual(len(response.data['results']), 6)
+        self.assertEqual(queries_for_one, queries_for_six)
+        recipe = response.data['results'][0]
+        self.assertTrue(recipe['is_favorited'])
+        self.assertTrue(recipe['is_in_shopping_cart'])
+        self.assertTrue(recipe['author']['is_subscribed'])
+        self.assertEqual(len(recipe['tags']), 2)
+        self.assertEqual(len(recipe['ingredients']), 3)
+
+    def test_detail_query_count_is_constant(self):
+        self.create_recipes(1)
+        recipe = Recipe.objects.get()
+        queries_before, _ = self.count_queries(f'/api/recipes/{recipe.pk}/')
+        self.ingredients.append(Ingredient.objects.create(
+            name='Ингредиент 3', measurement_unit='г'))
+        RecipeIngredient.objects.create(
+            recipe=recipe, ingredient=self.ingredients[-1], amount=2)
+        queries_after, response = self.count_queries(
+            f'/api/recipes/{recipe.pk}/')
+        self.assertEqual(len(response.data['ingredients']), 4)
+        self.assertEqual(queries_before, queries_after)
+
+    def test_flags_come_from_cached_memberships(self):
+        self.create_recipes(2)
+        self.client.get('/api/recipes/')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/recipes/')
+        sql = ' '.join(query['sql'] for query in context.captured_queries)
+        for table in ('recipes_favourite', 'recipes_shoppingcart',
+                      'users_subscription'):
+            self.assertNotIn(table, sql)
+        self.assertTrue(response.data['results'][0]['is_favorited'])
+        with self.captureOnCommitCallbacks(execute=True):
+            relations.delete(Favourite.objects.filter(user=self.user))
+        response = self.client.get('/api/recipes/')
+        self.assertFalse(response.data['results'][0]['is_favorited'])
+        self.assertTrue(response.data['results'][0]['is_in_shopping_cart'])
+
+    def test_memberships_follow_writes_of_other_processes(self):
+        self.create_recipes(1)
+        self.client.get('/api/recipes/')
+        # The write is made elsewhere: the local cache is not touched,
+        # the stamp is re-read once VERSION_CHECK_INTERVAL passes.
+        with patch.object(cache, 'delete_many'):
+            relations.delete(Favourite.objects.filter(user=self.user))
+        cache.delete(get_cache_key(memberships.get_version_name(
+            memberships.FAVORITES, self.user.id)))
+        response = self.client.get('/api/recipes/')
+        self.assertFalse(response.data['results'][0]['is_favorited'])
+
+
+class SubscriptionListTestCase(TestCase):
+    """
+    Subscriptions list returns limited recipes in a constant number of
+    queries and validates recipes_limit.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_author(self, recipes):
+        number = User.objects.count()
+        author = User.objects.create_user(
+            username=f'author{number}', email=f'author{number}@example.com',
+            password='pass')
+        Subscription.objects.create(subscriber=self.user, subscribing=author)
+        for i in range(recipes):
+            Recipe.objects.create(
+                author=author, name=f'Рецепт {i}',
+                image='recipes/images/test.png', text='Описание',
+                cooking_time=10)
+        return author
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return len(context), response
+
+    def test_query_count_is_constant(self):
+        url = '/api/users/subscriptions/?recipes_limit=2'
+        self.create_author(recipes=3)
+        queries_for_one, _ = self.count_queries(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(3):
+                self.create_author(recipes=4)
+        queries_for_four, response = self.count_queries(url)
+        self.assertEqual(queries_for_one, queries_for_four)
+        for author in response.data['results']:
+            self.assertTrue(author['is_subscribed'])
+            self.assertEqual(len(author['recipes']), 2)
+        self.assertEqual(
+            sorted(author['recipes_count']
+                   for author in response.data['results']),
+            [3, 4, 4, 4])
+
+    def test_invalid_recipes_limit(self):
+        self.create_author(recipes=1)
+        for value in ('abc', '-1'):
+            response = self.client.get(
+                f'/api/users/subscriptions/?recipes_limit={value}')
+            self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        _, response = self.count_queries(
+            '/api/users/subscriptions/?recipes_limit=100000000000')
+        self.assertEqual(len(response.data['results'][0]['recipes']), 1)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class RecipeWriteTestCase(TestCase):
+    """
+    Recipe ingredients and tags are written with set-based queries.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass')
+        cls.tags = [
+            Tag.objects.create(name=f'Тег {i}', color=f'#00000{i}',
+                               slug=f'tag{i}')
+            for i in range(3)]
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {i}', measurement_unit='г')
+            for i in range(40))
+        cls.ingredients = list(Ingredient.objects.order_by('id'))
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def recipe_data(self, ingredients, tags):
+        return {
+            'name': 'Рецепт',
+            'text': 'Описание',
+            'cooking_time': 10,
+            'image': IMAGE,
+            'tags': [tag.id for tag in tags],
+            'ingredients': [{'id': ingredient.id, 'amount': amount}
+                            for ingredient, amount in ingredients],
+        }
+
+    def update_recipe(self, recipe, ingredients, tags):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.patch(
+                f'/api/recipes/{recipe.pk}/',
+                self.recipe_data(ingredients, tags),
+                format='json')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(
+            dict(recipe.recipeingredient_set.values_list(
+                'ingredient_id', 'amount')),
+            {ingredient.id: amount for ingredient, amount in ingredients})
+        self.assertEqual(set(recipe.tags.all()), set(tags))
+        return len(context)
+
+    def test_update_diffs_ingredients_and_tags(self):
+        response = self.client.post(
+            '/api/recipes/',
+            self.recipe_data([(i, 1) for i in self.ingredients[:30]],
+                             self.tags[:2]),
+            format='json')
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        recipe = Recipe.objects.get()
+        small_diff = self.update_recipe(
+            recipe,
+            ([(i, 1) for i in self.ingredients[:28]]
+             + [(self.ingredients[28], 2), (self.ingredients[30], 1)]),
+            self.tags[1:])
+        large_diff = self.update_recipe(
+            recipe,
+            ([(i, 1) for i in self.ingredients[:20]]
+             + [(i, 5) for i in self.ingredients[20:25]]
+             + [(i, 2) for i in self.ingredients[30:40]]),
+            self.tags[:2])
+        self.assertEqual(small_diff, large_diff)
+
+    def test_unknown_ingredient_is_rejected(self):
+        data = self.recipe_data([(self.ingredients[0], 1)], self.tags[:1])
+        data['ingredients'].append({'id': 100500, 'amount': 1})
+        response = self.client.post('/api/recipes/', data, format='json')
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertFalse(Recipe.objects.exists())
+
+    @staticmethod
+    def make_image(width, height):
+        exif = Image.Exif()
+        exif[0x010f] = 'Camera'
+        buf = io.BytesIO()
+        Image.new('RGB', (width, height), 'red').save(
+            buf, 'JPEG', exif=exif)
+        return ('data:image/jpeg;base64,'
+                + base64.b64encode(buf.getvalue()).decode())
+
+    def test_image_is_reencoded_with_variants(self):
+        data = self.recipe_data([(self.ingredients[0], 1)], self.tags[:1])
+        data['image'] = self.make_image(1200, 600)
+        with patch.object(images, 'executor', ThreadPoolExecutor(1)) as pool:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(
+                    '/api/recipes/', data, format='json')
+            pool.shutdown(wait=True)
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        name = Recipe.objects.get().image.name
+        with default_storage.open(name) as file:
+            image = Image.open(file)
+            self.assertEqual(image.format, images.IMAGE_FORMAT)
+            self.assertEqual(len(image.getexif()), 0)
+        for variant, width in (('card', 480), ('detail', 960),
+                               ('retina', 1200)):
+            with default_storage.open(
+                    images.variant_name(name, variant)) as file:
+                self.assertEqual(Image.open(file).width, width)
+        response = self.client.get(f'/api/recipes/{response.data["id"]}/')
+        self.assertTrue(response.data['images']['card'].endswith(
+            images.variant_name(name, 'card')))
+
+    def test_images_are_deduplicated_and_collected(self):
+        data = self.recipe_data([(self.ingredients[0], 1)], self.tags[:1])
+        data['image'] = self.make_image(100, 100)
+        for name in ('Первый', 'Второй'):
+            data['name'] = name
+            response = self.client.post('/api/recipes/', data, format='json')
+            self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        first, second = Recipe.objects.order_by('id')
+        self.assertEqual(first.image.name, second.image.name)
+        data['image'] = self.make_image(200, 100)
+        response = self.client.patch(
+            f'/api/recipes/{second.id}/', data, format='json')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        second.refresh_from_db()
+        self.assertNotEqual(first.image.name, second.image.name)
+        first.delete()
+        call_command('collect_images', min_age=0, stdout=io.StringIO())
+        self.assertFalse(default_storage.exists(first.image.name))
+        self.assertTrue(default_storage.exists(second.image.name))
+
+    def test_saving_stored_image_refreshes_its_time(self):
+        storage = Recipe._meta.get_field('image').storage
+        content = ContentFile(b'image')
+        name = storage.save('recipes/images/a.png', content)
+        old = time.time() - 7200
+        os.utime(storage.path(name), (old, old))
+        self.assertEqual(storage.save('recipes/images/b.png', content), name)
+        call_command('collect_images', stdout=io.StringIO())
+        self.assertTrue(storage.exists(name))
+
+    def test_missing_variants_are_built_by_command(self):
+        data = self.recipe_data([(self.ingredients[0], 1)], self.tags[:1])
+        data['image'] = self.make_image(300, 100)
+        response = self.client.post('/api/recipes/', data, format='json')
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        name = Recipe.objects.get().image.name
+        card = images.variant_name(name, 'card')
+        self.assertFalse(default_storage.exists(card))
+        out = io.StringIO()
+        call_command('build_image_variants', stdout=out)
+        self.assertIn('Создано вариантов: 3', out.getvalue())
+        self.assertTrue(default_storage.exists(card))
+        call_command('build_image_variants', stdout=out)
+        self.assertIn('Создано вариантов: 0', out.getvalue())
+
+    def test_oversized_images_are_rejected(self):
+        data = self.recipe_data([(self.ingredients[0], 1)], self.tags[:1])
+        data['image'] = self.make_image(100, 100)
+        with patch.object(images, 'MAX_IMAGE_SIZE', 100):
+            response = self.client.post('/api/recipes/', data, format='json')
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        with patch.object(images, 'MAX_IMAGE_PIXELS', 9999):
+            response = self.client.post('/api/recipes/', data, format='json')
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertFalse(Recipe.objects.exists())
+
+
+class ShoppingListExportTestCase(TestCase):
+    """
+    Shopping list is exported in the format chosen by ?format= or Accept.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='buyer', email='buyer@example.com', password='pass')
+        sugar = Ingredient.objects.create(name='сахар', measurement_unit='г')
+        milk = Ingredient.objects.create(name='молоко', measurement_unit='мл')
+        for i, amount in enumerate((100, 50)):
+            recipe = Recipe.objects.create(
+                author=cls.user, name=f'Рецепт {i}',
+                image='recipes/images/test.png', text='Описание',
+                cooking_time=10)
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=sugar, amount=amount)
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=milk, amount=amount)
+            ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = '/api/recipes/download_shopping_cart/'
+
+    def test_pdf_is_default(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(response.content.startswith(b'%PDF'))
+
+    def test_text_formats(self):
+        response = self.client.get(self.url, {'format': 'txt'})
+        self.assertTrue(response.streaming)
+        self.assertEqual(
+            b''.join(response.streaming_content).decode(),
+            'СПИСОК ПОКУПОК\n- молоко 150 мл\n- сахар 150 г\n')
+        response = self.client.get(self.url, {'format': 'csv'})
+        self.assertEqual(
+            b''.join(response.streaming_content).decode().splitlines(),
+            ['name,measurement_unit,amount', 'молоко,мл,150', 'сахар,г,150'])
+        response = self.client.get(self.url, HTTP_ACCEPT='application/json')
+        self.assertEqual(
+            json.loads(b''.join(response.streaming_content)),
+            [{'name': 'молоко', 'measurement_unit': 'мл', 'amount': 150},
+             {'name': 'сахар', 'measurement_unit': 'г', 'amount': 150}])
+
+    def test_anonymous_gets_json_error(self):
+        response = APIClient().get(self.url)
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+    def test_repeat_download_is_cached(self):
+        response = self.client.get(self.url, {'format': 'txt'})
+        content = b''.join(response.streaming_content)
+        etag = response['ETag']
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.url, {'format': 'txt'})
+        self.assertFalse(response.streaming)
+        self.assertEqual(response.content, content)
+        self.assertNotIn('recipes_recipeingredient', ' '.join(
+            query['sql'] for query in context.captured_queries))
+        response = self.client.get(
+            self.url, {'format': 'txt'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+
+    def test_async_export(self):
+        response = self.client.get(self.url, {'format': 'txt', 'async': 1})
+        self.assertEqual(response.status_code, HTTPStatus.ACCEPTED)
+        job_url = response['Location']
+        self.assertEqual(self.client.get(job_url).data['status'], 'pending')
+        call_command('run_workers', once=True, stdout=io.StringIO())
+        response = self.client.get(job_url)
+        self.assertEqual(response.data['status'], 'done')
+        result = self.client.get(response.data['result'])
+        self.assertEqual(result.status_code, HTTPStatus.OK)
+        self.assertEqual(result.content,
+                         self.client.get(self.url, {'format': 'txt'}).content)
+        other = User.objects.create_user(
+            username='other', email='other@example.com', password='pass')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(job_url).status_code,
+                         HTTPStatus.NOT_FOUND)
+
+    def test_cart_change_invalidates_cache(self):
+        response = self.client.get(self.url, {'format': 'txt'})
+        etag = response['ETag']
+        b''.join(response.streaming_content)
+        relations.delete(ShoppingCart.objects.filter(
+            pk=ShoppingCart.objects.filter(user=self.user).first().pk))
+        response = self.client.get(
+            self.url, {'format': 'txt'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(
+            b''.join(response.streaming_content).decode(),
+            'СПИСОК ПОКУПОК\n- молоко 50 мл\n- сахар 50 г\n')
+
+
+class IngredientSearchTestCase(TestCase):
+    """
+    Ingredient search is answered from the in-memory index.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        for name in ('Соль', 'соль морская', 'морская капуста', 'сахар',
+                     'йодированная соль'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def search(self, name, **params):
+        response = self.client.get(
+            '/api/ingredients/', {'name': name, **params})
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return [item['name'] for item in response.data]
+
+    def test_results_are_ranked(self):
+        expected = ['Соль', 'соль морская', 'йодированная соль']
+        self.assertEqual(self.search('соль'), expected)
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.search('СОЛЬ'), expected)
+        self.assertEqual(len(context), 0)
+        self.assertEqual(self.search('соль', limit=2), expected[:2])
+
+    def test_index_is_rebuilt_on_change(self):
+        self.assertEqual(self.search('сах'), ['сахар'])
+        Ingredient.objects.create(name='сахарная пудра', measurement_unit='г')
+        self.assertEqual(self.search('сах'), ['сахар', 'сахарная пудра'])
+
+    def test_database_fallback_while_index_is_cold(self):
+        self.assertTrue(ingredient_index.lock.acquire())
+        try:
+            ingredient_index.version = None
+            self.assertEqual(self.search('морская'),
+                             ['морская капуста', 'соль морская'])
+        finally:
+            ingredient_index.lock.release()
+
+    def test_invalid_limit(self):
+        response = self.client.get(
+            '/api/ingredients/', {'name': 'соль', 'limit': 'abc'})
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+
+class RecipeSearchTestCase(TestCase):
+    """
+    Recipes are searched by name, text and ingredient names.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass')
+        cls.ingredient = Ingredient.objects.create(
+            name='картофель', measurement_unit='г')
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def create_recipe(self, name, text, ingredient=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                recipe = Recipe.objects.create(
+                    author=self.author, name=name,
+                    image='recipes/images/test.png', text=text,
+                    cooking_time=10)
+                if ingredient is not None:
+                    RecipeIngredient.objects.create(
+                        recipe=recipe, ingredient=ingredient, amount=1)
+        return recipe
+
+    def search(self, query):
+        response = self.client.get('/api/recipes/', {'search': query})
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return [recipe['name'] for recipe in response.data['results']]
+
+    def test_search_is_ranked(self):
+        self.create_recipe('Пюре', 'Отварить и размять', self.ingredient)
+        self.create_recipe('Картофель фри', 'Обжарить во фритюре')
+        self.create_recipe('Салат', 'Нарезать овощи')
+        self.assertEqual(self.search('картоф'), ['Картофель фри', 'Пюре'])
+        self.assertEqual(self.search('овощи'), ['Салат'])
+        self.assertEqual(self.search('???'), [])
+
+    def test_index_follows_changes(self):
+        recipe = self.create_recipe('Пюре', 'Размять')
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.name = 'Толченка'
+            recipe.save()
+        self.assertEqual(self.search('пюре'), [])
+        self.assertEqual(self.search('толченка'), ['Толченка'])
+        recipe.delete()
+        self.assertEqual(self.search('толченка'), [])
+
+    def test_install_uses_the_migrated_database(self):
+        with patch('api.signals.get_search_backend') as get_backend:
+            signals.install_search_backend(sender=None, using='other')
+        get_backend.assert_called_once_with('other')
+        get_backend.return_value.install.assert_called_once_with()
+        backend = search.get_search_backend('default')
+        self.assertIs(backend.connection, connections['default'])
+
+
+class RecipePaginationTestCase(TestCase):
+    """
+    Recipes can be paginated by keyset, page sizes are bounded.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass')
+        for i in range(8):
+            recipe = Recipe.objects.create(
+                author=cls.user, name=f'Рецепт {i}',
+                image='recipes/images/test.png', text='Описание',
+                cooking_time=10)
+            ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_cursor_pagination(self):
+        url = '/api/recipes/?pagination=cursor&limit=3'
+        names = []
+        while url:
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+            self.assertNotIn('COUNT(', ' '.join(
+                query['sql'] for query in context.captured_queries))
+            self.assertNotIn('count', response.data)
+            names.extend(recipe['name'] for recipe in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(names, [f'Рецепт {i}' for i in range(7, -1, -1)])
+
+    def test_cursor_pagination_keeps_its_ordering(self):
+        for ordering in ('author', 'name'):
+            url = (f'/api/recipes/?pagination=cursor&limit=3'
+                   f'&ordering={ordering}')
+            names = []
+            while url:
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+                names.extend(
+                    recipe['name'] for recipe in response.data['results'])
+                url = response.data['next']
+            self.assertEqual(
+                names, [f'Рецепт {i}' for i in range(7, -1, -1)])
+
+    @patch.object(RecipePagination, 'max_page_size', 5)
+    def test_page_number_pagination_is_bounded(self):
+        response = self.client.get('/api/recipes/', {'limit': 999})
+        self.assertEqual(response.data['count'], 8)
+        self.assertEqual(len(response.data['results']), 5)
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 3)
+
+    @patch.object(RecipePagination, 'max_page_size', 5)
+    @patch.object(RecipePagination, 'cart_max_page_size', 7)
+    def test_shopping_cart_has_own_bound(self):
+        response = self.client.get(
+            '/api/recipes/', {'is_in_shopping_cart': 1, 'limit': 999})
+        self.assertEqual(response.data['count'], 8)
+        self.assertEqual(len(response.data['results']), 7)
+
+
+class CountersTestCase(TestCase):
+    """
+    Favorite, cart and recipe counters are maintained on write
+    and repaired by reconcile_counters.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass')
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass')
+
+    def create_recipe(self, name):
+        return Recipe.objects.create(
+            author=self.author, name=name, image='recipes/images/test.png',
+            text='Описание', cooking_time=10)
+
+    def test_counters_follow_writes(self):
+        recipe = self.create_recipe('Рецепт')
+        self.create_recipe('Другой рецепт')
+        client = APIClient()
+        client.force_authenticate(self.user)
+        client.post(f'/api/recipes/{recipe.pk}/favorite/')
+        client.post(f'/api/recipes/{recipe.pk}/shopping_cart/')
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 1)
+        self.assertEqual(recipe.in_carts_count, 1)
+        self.assertEqual(self.author.stats.recipes_count, 2)
+        client.delete(f'/api/recipes/{recipe.pk}/favorite/')
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 0)
+        recipe.delete()
+        self.author.stats.refresh_from_db()
+        self.assertEqual(self.author.stats.recipes_count, 1)
+
+    def test_cascades_are_fast_and_counted(self):
+        for model in (Favourite, ShoppingCart):
+            self.assertTrue(Collector('default').can_fast_delete(
+                model.objects.all()))
+        recipe = self.create_recipe('Рецепт')
+        readers = [User.objects.create_user(
+            username=f'reader{i}', email=f'reader{i}@example.com')
+            for i in range(3)]
+        for reader in readers:
+            Favourite.objects.create(user=reader, recipe=recipe)
+            ShoppingCart.objects.create(user=reader, recipe=recipe)
+        readers[0].delete()
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 2)
+        self.assertEqual(recipe.in_carts_count, 2)
+        recipe.delete()
+        self.assertFalse(ShoppingCart.objects.exists())
+
+    def test_ordering_by_recipe_fields(self):
+        for name in ('Б', 'А'):
+            self.create_recipe(name)
+        Recipe.objects.filter(name='А').update(text='Я')
+        for ordering, names in (('id', ['Б', 'А']), ('name', ['А', 'Б']),
+                                ('text', ['Б', 'А']), ('-text', ['А', 'Б'])):
+            response = self.client.get('/api/recipes/',
+                                       {'ordering': ordering})
+            self.assertEqual(
+                [recipe['name'] for recipe in response.data['results']],
+                names)
+
+    def test_reconcile_counters(self):
+        recipe = self.create_recipe('Рецепт')
+        Favourite.objects.create(user=self.user, recipe=recipe)
+        Recipe.objects.update(favorites_count=5, in_carts_count=2)
+        UserStats.objects.all().delete()
+        out = io.StringIO()
+        call_command('reconcile_counters', stdout=out)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 1)
+        self.assertEqual(recipe.in_carts_count, 0)
+        self.assertEqual(
+            UserStats.objects.get(user=self.author).recipes_count, 1)
+
+    def test_counters_are_filled_on_migrate(self):
+        recipe = self.create_recipe('Рецепт')
+        Favourite.objects.create(user=self.user, recipe=recipe)
+        Recipe.objects.update(favorites_count=0)
+        UserStats.objects.all().delete()
+        counters.fill_counters(sender=None, using='default')
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 1)
+        self.assertEqual(self.author.stats.recipes_count, 1)
+
+
+class ImportCommandTestCase(TestCase):
+    """
+    Csv imports report inserted, updated and skipped rows.
+    """
+    def import_csv(self, command, content, **options):
+        with tempfile.NamedTemporaryFile(
+                'w', suffix='.csv', encoding='utf-8') as file:
+            file.write(content)
+            file.flush()
+            out = io.StringIO()
+            call_command(command, file.name, stdout=out, **options)
+        return out.getvalue()
+
+    def test_counts(self):
+        Ingredient.objects.create(name='соль', measurement_unit='г')
+        out = self.import_csv(
+            'import_ingredients', 'соль,г\nсахар,г\nсахар,г\nмука,г\n')
+        self.assertIn('Прочитано строк: 4, добавлено: 2, обновлено: 0, '
+                      'пропущено: 2', out)
+        Tag.objects.create(name='Завтрак', color='#FF7F50', slug='breakfast')
+        out = self.import_csv(
+            'import_tags', 'Утро,#FFFFFF,breakfast\nОбед,#3CB371,lunch\n',
+            upsert=True)
+        self.assertIn('добавлено: 1, обновлено: 1, пропущено: 0', out)
+        self.assertEqual(Tag.objects.get(slug='breakfast').name, 'Утро')
+
+    def test_missing_file(self):
+        with self.assertRaisesRegex(CommandError, 'Не удалось открыть'):
+            call_command('import_tags', '/nonexistent/tags.csv',
+                         stdout=io.StringIO())
+
+
+class SnapshotTestCase(TestCase):
+    """
+    Tag and ingredient lists are served from versioned snapshots.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        Tag.objects.create(name='Завтрак', color='#FF7F50', slug='breakfast')
+        Ingredient.objects.create(name='соль', measurement_unit='г')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_snapshot_and_conditional_get(self):
+        response = self.client.get('/api/tags/')
+        self.assertEqual(
+            json.loads(response.content),
+            [{'id': Tag.objects.get().id, 'name': 'Завтрак',
+              'color': '#FF7F50', 'slug': 'breakfast'}])
+        etag = response['ETag']
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/tags/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        self.assertEqual(len(context), 0)
+        Tag.objects.create(name='Обед', color='#3CB371', slug='lunch')
+        response = self.client.get('/api/tags/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(len(json.loads(response.content)), 2)
+
+    def test_compressed_snapshot(self):
+        response = self.client.get(
+            '/api/ingredients/', HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(
+            json.loads(gzip.decompress(response.content)),
+            [{'id': Ingredient.objects.get().id, 'name': 'соль',
+              'measurement_unit': 'г'}])
+
+
+class RecipeFilterTestCase(TestCase):
+    """
+    Tag, favorite and cart filters use subqueries instead of joins.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass')
+        cls.breakfast = Tag.objects.create(
+            name='Завтрак', color='#FF7F50', slug='breakfast')
+        cls.lunch = Tag.objects.create(
+            name='Обед', color='#3CB371', slug='lunch')
+        cls.dinner = Tag.objects.create(
+            name='Ужин', color='#9370DB', slug='dinner')
+        for name, tags in (('Омлет', [cls.breakfast, cls.lunch]),
+                           ('Суп', [cls.lunch]),
+                           ('Рагу', [cls.dinner])):
+            recipe = Recipe.objects.create(
+                author=cls.user, name=name, image='recipes/images/test.png',
+                text='Описание', cooking_time=10)
+            recipe.tags.set(tags)
+        Favourite.objects.create(
+            user=cls.user, recipe=Recipe.objects.get(name='Суп'))
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_names(self, params):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/recipes/', params)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        for query in context.captured_queries:
+            if query['sql'].startswith('SELECT "recipes_recipe"'):
+                self.assertNotIn('JOIN "recipes_', query['sql'])
+                self.assertNotIn('DISTINCT', query['sql'])
+        return sorted(recipe['name'] for recipe in response.data['results'])
+
+    def test_tags_filter_has_no_duplicates(self):
+        self.assertEqual(
+            self.get_names({'tags': ['breakfast', 'lunch']}),
+            ['Омлет', 'Суп'])
+        self.assertEqual(self.get_names({'tags': ['unknown']}), [])
+
+    def test_user_filters(self):
+        self.assertEqual(
+            self.get_names({'tags': ['lunch'], 'is_favorited': 1}), ['Суп'])
+        self.assertEqual(self.get_names({'is_in_shopping_cart': 1}), [])
+
+
+class AdminQueryCountTestCase(TestCase):
+    """
+    Admin changelists run a fixed number of queries.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='pass')
+        cls.tag = Tag.objects.create(
+            name='Завтрак', color='#FF7F50', slug='breakfast')
+        cls.ingredient = Ingredient.objects.create(
+            name='сахар', measurement_unit='г')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def add_recipes(self, count):
+        for _ in range(count):
+            recipe = Recipe.objects.create(
+                author=User.objects.create_user(
+                    username=f'author{Recipe.objects.count()}',
+                    email=f'author{Recipe.objects.count()}@example.com'),
+                name=f'Рецепт {Recipe.objects.count()}',
+                image='recipes/images/test.png', text='Описание',
+                cooking_time=10)
+            recipe.tags.add(self.tag)
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=self.ingredient, amount=1)
+            Favourite.objects.create(user=self.admin, recipe=recipe)
+
+    def count_queries(self, url, params=None):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return len(context)
+
+    def test_changelists_query_count_is_constant(self):
+        urls = ('/admin/recipes/recipe/', '/admin/recipes/recipeingredient/',
+                '/admin/recipes/recipetag/', '/admin/recipes/favourite/')
+        self.add_recipes(2)
+        few = [self.count_queries(url) for url in urls]
+        self.add_recipes(5)
+        self.assertEqual([self.count_queries(url) for url in urls], few)
+
+    def test_input_filter(self):
+        self.add_recipes(2)
+        response = self.client.get('/admin/recipes/recipe/',
+                                   {'author': 'author1'})
+        self.assertContains(response, 'Рецепт 1')
+        self.assertNotContains(response, 'Рецепт 0')
+
+    def test_relations_are_not_edited(self):
+        first, second = (Recipe.objects.create(
+            author=self.admin, name=name, image='recipes/images/test.png',
+            text='Описание', cooking_time=10) for name in ('А', 'Б'))
+        cart = ShoppingCart.objects.create(user=self.admin, recipe=first)
+        url = f'/admin/recipes/shoppingcart/{cart.pk}/change/'
+        response = self.client.post(
+            url, {'user': self.admin.pk, 'recipe': second.pk})
+        self.assertEqual(response.status_code, HTTPStatus.FOUND)
+        cart.refresh_from_db()
+        self.assertEqual(cart.recipe, first)
+        second.refresh_from_db()
+        self.assertEqual(second.in_carts_count, 0)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class BenchmarkTestCase(TestCase):
+    """
+    The benchmark covers every API route and reports regressions.
+    """
+    def setUp(self):
+        cache.clear()
+
+    def test_all_routes_are_benchmarked(self):
+        scale = benchmark.SCALES['tiny']
+        benchmark.seed(scale)
+        report = benchmark.run(scale, 1, 0)
+        for name, result in report['results'].items():
+            self.assertLess(result['status'], 400, name)
+        routes = {pattern.name for pattern
+                  in router.urls + customrouter.urls} - {'api-root'}
+        self.assertLessEqual(
+            routes, {result['url_name']
+                     for result in report['results'].values()})
+
+    def test_compare(self):
+        result = {'status': 200, 'p95_ms': 10.0, 'queries': 4,
+                  'peak_memory_kb': 100.0}
+        baseline = {'results': {'case': result}}
+        report = {'results': {'case': dict(result, p95_ms=11.0)}}
+        self.assertEqual(benchmark.compare(report, baseline, 0.2), [])
+        report = {'results': {'case': dict(result, queries=5)}}
+        self.assertEqual(benchmark.compare(report, baseline, 0.2),
+                         ['case: queries 4 -> 5'])
+
+
+class ServerTimingTestCase(TestCase):
+    """
+    Requests are timed and logged with the view that served them.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass')
+        Recipe.objects.create(
+            author=author, name='Суп', image='recipes/images/test.png',
+            text='Описание', cooking_time=10)
+
+    @patch('api.middleware.SERVER_TIMING_HEADER', True)
+    def test_server_timing_and_log(self):
+        with self.assertLogs('api.middleware', 'INFO') as logs:
+            response = self.client.get('/api/recipes/')
+        self.assertRegex(
+            response['Server-Timing'],
+            r'total;dur=[\d.]+, db;dur=[\d.]+;desc="\d+ queries", '
+            r'serializer;dur=[\d.]+')
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view'], 'RecipeViewSet.list')
+        self.assertEqual(record['size'], len(response.content))
+        self.assertGreater(record['queries'], 0)
+        self.assertGreater(record['serializer_ms'], 0)
+        with patch('api.middleware.SERVER_TIMING_HEADER', False), \
+                self.assertLogs('api.middleware', 'INFO'):
+            response = self.client.get('/api/recipes/')
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    def test_sampled_profile(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                patch('api.middleware.PROFILE_SAMPLE_RATE', 1.0), \
+                patch('api.middleware.PROFILE_DIR', directory), \
+                self.assertLogs('api.middleware', 'INFO') as logs:
+            self.client.get('/api/tags/')
+            record = json.loads(logs.records[0].getMessage())
+            self.assertTrue(record['profile'].endswith(
+                'TagViewSet.list.prof'))
+            self.assertTrue(os.path.exists(record['profile']))
+
+
+class MetricsTestCase(TestCase):
+    """
+    Metrics of all processes are exported without database queries.
+    """
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        patcher = patch('api.metrics.METRICS_DIR', self.directory)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_scrape(self):
+        self.client.get('/api/tags/')
+        self.client.get('/api/recipes/100500/')
+        with open(os.path.join(self.directory, '1.json'), 'w') as file:
+            json.dump({'foodgram_request_errors_total': [
+                [['RecipeViewSet.retrieve', 'GET', '404'], 1000]]}, file)
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        content = response.content.decode()
+        self.assertIn('foodgram_request_duration_seconds_bucket{view='
+                      '"TagViewSet.list",method="GET",le="+Inf"}', content)
+        self.assertRegex(content, r'foodgram_cache_requests_total\{'
+                                  r'cache="tag_snapshot",result="\w+"\} ')
+        self.assertRegex(content, r'foodgram_request_errors_total\{view='
+                                  r'"RecipeViewSet.retrieve",method="GET",'
+                                  r'status="404"\} 100\d\.0')
+
+    @patch.object(metrics.store, 'role', 'web')
+    def test_reset_removes_files_of_the_role(self):
+        for name in ('web-1.json', 'web-2.json', 'worker-3.json'):
+            with open(os.path.join(self.directory, name), 'w') as file:
+                json.dump({}, file)
+        metrics.reset('web')
+        self.assertEqual(os.listdir(self.directory), ['worker-3.json'])
+
+
+class QueryBudgetTestCase(TestCase):
+    """
+    Every endpoint stays within its query budget and runs no N+1.
+    """
+    # Cold caches: endpoints using snapshots, indexes and memberships
+    # also read the version stamps, once per VERSION_CHECK_INTERVAL
+    # in production.
+    BUDGETS = (
+        ('/api/tags/', 2),
+        ('/api/ingredients/?name=сах', 2),
+        ('/api/recipes/', 10),
+        ('/api/recipes/?is_favorited=1&tags=breakfast', 12),
+        ('/api/recipes/?pagination=cursor', 9),
+        ('/api/recipes/{recipe}/', 9),
+        ('/api/users/', 4),
+        ('/api/users/me/', 2),
+        ('/api/users/subscriptions/', 5),
+        ('/api/recipes/download_shopping_cart/?format=txt', 3),
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass')
+        tags = [Tag.objects.create(name=f'Тег {i}', color=f'#00000{i}',
+                                   slug=slug)
+                for i, slug in enumerate(('breakfast', 'lunch'))]
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'сахар {i}', measurement_unit='г')
+            for i in range(3))
+        # As the import command does, bulk_create sends no signals.
+        bump_version(INGREDIENTS_VERSION)
+        ingredients = list(Ingredient.objects.order_by('id'))
+        for i in range(8):
+            author = User.objects.create_user(
+                username=f'author{i}', email=f'author{i}@example.com')
+            Subscription.objects.create(
+                subscriber=cls.user, subscribing=author)
+            recipe = Recipe.objects.create(
+                author=author, name=f'Рецепт {i}',
+                image='recipes/images/test.png', text='Описание',
+                cooking_time=10)
+            recipe.tags.set(tags)
+            for ingredient in ingredients:
+                RecipeIngredient.objects.create(
+                    recipe=recipe, ingredient=ingredient, amount=i + 1)
+            Favourite.objects.create(user=cls.user, recipe=recipe)
+            ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+        cls.recipe = recipe
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_endpoints_stay_within_budget(self):
+        for url, budget in self.BUDGETS:
+            url = url.format(recipe=self.recipe.id)
+            cache.clear()
+            with self.subTest(url=url), \
+                    diagnostics.query_budget(budget):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_n_plus_one_is_detected(self):
+        with self.assertRaisesRegex(AssertionError, 'repeated 8 times'):
+            with diagnostics.query_budget(100):
+                for recipe in Recipe.objects.all():
+                    recipe.author.username
+
+    def test_normalize(self):
+        self.assertEqual(
+            diagnostics.normalize(
+                "SELECT * FROM t WHERE a = 'x' AND b IN (1, 2)  LIMIT 21"),
+            'SELECT * FROM t WHERE a = ? AND b IN (...) LIMIT ?')
+
+    def test_slow_query_is_explained(self):
+        with patch.object(diagnostics, 'SLOW_QUERY_MS', 0), \
+                self.assertLogs('api.diagnostics', 'WARNING') as logs:
+            self.client.get(f'/api/recipes/{self.recipe.id}/')
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['problem'], 'slow query')
+        self.assertEqual(record['view'], 'RecipeViewSet.retrieve')
+        self.assertTrue(record['plan'])
+
+
+REPLICA = 'replica_1'
+# Replica aliases are test mirrors of the default database.
+REPLICA_ALIASES = {alias for alias in settings.DATABASES if alias == REPLICA}
+
+
+@skipUnless(REPLICA_ALIASES, f'Нужен алиас реплики {REPLICA}')
+@override_settings(REPLICA_DATABASES=[REPLICA])
+class ReplicaRoutingTestCase(TransactionTestCase):
+    """
+    The replica is a test mirror of the primary, so the tests check
+    which connection each request reads from. Data is committed,
+    otherwise the mirror connection would not see it.
+    """
+    databases = {'default', *REPLICA_ALIASES}
+
+    def setUp(self):
+        cache.clear()
+        authentication.token_cache.clear()
+        self.user = User.objects.create_user(
+            username='writer', email='writer@example.com', password='pass')
+        self.reader = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass')
+        self.recipe = Recipe.objects.create(
+            author=self.user, name='Рецепт', image='recipes/images/test.png',
+            text='Описание', cooking_time=10)
+        self.writer = APIClient()
+        self.writer.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects
+                                .create(user=self.user).key)
+        self.reader_client = APIClient()
+        self.reader_client.credentials(
+            HTTP_AUTHORIZATION='Token ' + Token.objects.create(
+                user=self.reader).key)
+        self.detail_url = f'/api/recipes/{self.recipe.id}/'
+
+    def get(self, client, url):
+        """
+        Returns the response and the captured queries by alias.
+        """
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections[REPLICA]) as replica:
+            response = client.get(url)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return response, {
+            'default': [query['sql'] for query in primary.captured_queries],
+            REPLICA: [query['sql'] for query in replica.captured_queries]}
+
+    def test_safe_requests_read_from_replica(self):
+        response, queries = self.get(self.client, '/api/recipes/')
+        self.assertEqual(response.json()['count'], 1)
+        self.assertTrue(queries[REPLICA])
+        self.assertEqual(queries['default'], [])
+
+    def test_token_is_read_from_primary(self):
+        response, queries = self.get(self.reader_client, '/api/users/me/')
+        self.assertEqual(response.json()['username'], 'reader')
+        self.assertTrue(any('authtoken_token' in sql
+                            for sql in queries['default']))
+        self.assertFalse(any('authtoken_token' in sql
+                             for sql in queries[REPLICA]))
+
+    def test_writer_sticks_to_primary(self):
+        response = self.writer.post(f'{self.detail_url}favorite/')
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        _, queries = self.get(self.writer, self.detail_url)
+        self.assertEqual(queries[REPLICA], [])
+        _, queries = self.get(self.reader_client, self.detail_url)
+        self.assertTrue(queries[REPLICA])
+        self.writer.cookies[replicas.STICKY_COOKIE] = 'forged'
+        _, queries = self.get(self.writer, self.detail_url)
+        self.assertTrue(queries[REPLICA])
+
+    def test_failed_write_does_not_stick(self):
+        response = self.writer.post('/api/recipes/0/favorite/')
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        _, queries = self.get(self.writer, self.detail_url)
+        self.assertTrue(queries[REPLICA])
+
+    def test_process_caches_are_built_from_primary(self):
+        _, queries = self.get(self.reader_client, '/api/recipes/')
+        self.assertTrue(any('recipes_favourite' in sql
+                            for sql in queries['default']))
+        _, queries = self.get(self.client, '/api/tags/')
+        self.assertTrue(any('recipes_tag' in sql
+                            for sql in queries['default']))
+        self.assertEqual(queries[REPLICA], [])
+
+    def test_marked_view_reads_from_primary(self):
+        job = enqueue('export_shopping_list', owner=self.reader,
+                      user_id=self.reader.id, format='txt')
+        _, queries = self.get(self.reader_client, f'/api/jobs/{job.pk}/')
+        self.assertEqual(queries[REPLICA], [])
+        _, queries = self.get(
+            self.reader_client,
+            '/api/recipes/download_shopping_cart/?format=txt')
+        self.assertEqual(queries[REPLICA], [])
+
+    def test_router(self):
+        router = replicas.ReplicaRouter()
+        self.assertEqual(router.db_for_read(Recipe), 'default')
+        token = replicas.read_from_replica.set(True)
+        try:
+            self.assertEqual(router.db_for_read(Recipe), REPLICA)
+            self.assertEqual(router.db_for_read(Token), 'default')
+            self.assertEqual(router.db_for_write(Recipe), 'default')
+            with replicas.primary():
+                self.assertEqual(router.db_for_read(Recipe), 'default')
+        finally:
+            replicas.read_from_replica.reset(token)
+
+
+class TokenCacheTestCase(TestCase):
+    """
+    The token is looked up in the database once, later requests take
+    the user from the cache until the token or the user changes.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass')
+
+    def setUp(self):
+        cache.clear()
+        authentication.token_cache.clear()
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def get_me(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/users/me/')
+        return response, [query['sql'] for query in queries.captured_queries
+                          if 'authtoken_token' in query['sql']]
+
+    def test_token_query_is_cached(self):
+        response, token_queries = self.get_me()
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(len(token_queries), 1)
+        response, token_queries = self.get_me()
+        self.assertEqual(response.json()['username'], 'reader')
+        self.assertEqual(token_queries, [])
+
+    def test_shared_cache(self):
+        with patch.object(authentication, 'TOKEN_CACHE_SHARED', True):
+            self.get_me()
+            authentication.token_cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/api/users/me/')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.json()['email'], 'reader@example.com')
+        self.assertEqual(queries.captured_queries, [])
+        values = cache.get(authentication.token_cache.get_shared_key(
+            self.token.key))
+        self.assertNotIn(self.user.password, values)
+        with patch.object(authentication, 'TOKEN_CACHE_SHARED', True), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/users/set_password/', {
+                'current_password': 'pass', 'new_password': 'N3w-pa55word'})
+        self.assertEqual(response.status_code, HTTPStatus.NO_CONTENT)
+
+    def test_logout_invalidates(self):
+        self.get_me()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, HTTPStatus.NO_CONTENT)
+        response, _ = self.get_me()
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+
+    def test_password_change_invalidates(self):
+        self.get_me()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/users/set_password/', {
+                'current_password': 'pass', 'new_password': 'N3w-pa55word'})
+        self.assertEqual(response.status_code, HTTPStatus.NO_CONTENT)
+        self.assertIsNone(authentication.token_cache.get(self.token.key))
+
+    def test_deactivation_invalidates(self):
+        self.get_me()
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        response, _ = self.get_me()
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+
+    def test_cached_user_is_copied(self):
+        self.get_me()
+        first = authentication.CachedTokenAuthentication(
+        ).authenticate_credentials(self.token.key)[0]
+        first.first_name = 'changed'
+        second = authentication.CachedTokenAuthentication(
+        ).authenticate_credentials(self.token.key)[0]
+        self.assertNotEqual(second.first_name, 'changed')
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ShoppingListItemTestCase(TestCase):
+    """
+    The aggregated shopping list follows cart and recipe changes
+    and always equals a rebuild from scratch.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='buyer', email='buyer@example.com', password='pass')
+        cls.tag = Tag.objects.create(name='Тег', color='#000000', slug='tag')
+        cls.sugar, cls.milk, cls.salt = (
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('сахар', 'молоко', 'соль'))
+        cls.recipes = []
+        for i, amount in enumerate((100, 50)):
+            recipe = Recipe.objects.create(
+                author=cls.user, name=f'Рецепт {i}',
+                image='recipes/images/test.png', text='Описание',
+                cooking_time=10)
+            recipe.tags.set([cls.tag])
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=cls.sugar, amount=amount)
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=cls.milk, amount=amount)
+            cls.recipes.append(recipe)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_items(self):
+        return dict(ShoppingListItem.objects.filter(
+            user=self.user, amount__gt=0).values_list(
+            'ingredient__name', 'amount'))
+
+    def assertItems(self, expected):
+        self.assertEqual(self.get_items(), expected)
+        shopping_list.rebuild()
+        self.assertEqual(self.get_items(), expected)
+
+    def add_to_cart(self, recipe):
+        response = self.client.post(f'/api/recipes/{recipe.id}/shopping_cart/')
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+
+    def test_cart_add_waits_for_recipe_edit(self):
+        recipe = self.recipes[0]
+
+        def edit_commits_meanwhile(recipe_ids):
+            # The edit held the recipe lock and commits new amounts
+            # before the cart add gets it.
+            RecipeIngredient.objects.filter(
+                recipe=recipe, ingredient=self.sugar).update(amount=7)
+
+        with patch('recipes.shopping_list.lock_recipes',
+                   side_effect=edit_commits_meanwhile) as lock:
+            self.add_to_cart(recipe)
+        lock.assert_called_once_with([recipe.id])
+        self.assertItems({'сахар': 7, 'молоко': 100})
+
+    def test_cart_changes(self):
+        for recipe in self.recipes:
+            self.add_to_cart(recipe)
+        self.assertItems({'сахар': 150, 'молоко': 150})
+        response = self.client.delete(
+            f'/api/recipes/{self.recipes[0].id}/shopping_cart/')
+        self.assertEqual(response.status_code, HTTPStatus.NO_CONTENT)
+        self.assertItems({'сахар': 50, 'молоко': 50})
+        self.recipes[1].delete()
+        self.assertItems({})
+
+    def test_recipe_edit(self):
+        for recipe in self.recipes:
+            self.add_to_cart(recipe)
+        recipe = self.recipes[0]
+        response = self.client.patch(f'/api/recipes/{recipe.id}/', {
+            'name': recipe.name, 'text': 'Описание', 'cooking_time': 10,
+            'image': IMAGE, 'tags': [self.tag.id],
+            'ingredients': [{'id': self.sugar.id, 'amount': 10},
+                            {'id': self.salt.id, 'amount': 5}],
+        }, format='json')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertItems({'сахар': 60, 'молоко': 50, 'соль': 5})
+
+    def test_download_reads_aggregated_list(self):
+        for recipe in self.recipes:
+            self.add_to_cart(recipe)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                '/api/recipes/download_shopping_cart/', {'format': 'txt'})
+            content = b''.join(response.streaming_content).decode()
+        self.assertEqual(
+            content, 'СПИСОК ПОКУПОК\n- молоко 150 г\n- сахар 150 г\n')
+        self.assertFalse(any('recipes_recipeingredient' in query['sql']
+                             for query in queries.captured_queries))
+
+    def test_rebuild_command(self):
+        ShoppingCart.objects.bulk_create(
+            ShoppingCart(user=self.user, recipe=recipe)
+            for recipe in self.recipes)
+        self.assertEqual(self.get_items(), {})
+        out = io.StringIO()
+        call_command('rebuild_shopping_lists', user=[self.user.id],
+                     stdout=out)
+        self.assertIn('строк: 2', out.getvalue())
+        self.assertEqual(self.get_items(), {'сахар': 150, 'молоко': 150})
+
+    def test_filled_after_migrate(self):
+        ShoppingCart.objects.bulk_create(
+            ShoppingCart(user=self.user, recipe=recipe)
+            for recipe in self.recipes)
+        shopping_list.fill_shopping_lists(sender=None)
+        self.assertEqual(self.get_items(), {'сахар': 150, 'молоко': 150})
+        ShoppingListItem.objects.update(amount=1)
+        shopping_list.fill_shopping_lists(sender=None)
+        self.assertEqual(self.get_items(), {'сахар': 1, 'молоко': 1})
+
+
+MISSING_ID = 10 ** 6
+
+
+class BulkOperationsTestCase(TestCase):
+    """
+    Bulk endpoints change many relations in a few queries and apply
+    the side effects that their signal-free queries skip.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='planner', email='planner@example.com', password='pass')
+        cls.authors = [
+            User.objects.create_user(
+                username=f'author{i}', email=f'author{i}@example.com')
+            for i in range(2)]
+        sugar = Ingredient.objects.create(name='сахар', measurement_unit='г')
+        cls.recipes = []
+        for i, author in enumerate(cls.authors):
+            recipe = Recipe.objects.create(
+                author=author, name=f'Рецепт {i}',
+                image='recipes/images/test.png', text='Описание',
+                cooking_time=10)
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=sugar, amount=100)
+            cls.recipes.append(recipe)
+        cls.ids = [recipe.id for recipe in cls.recipes]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_statuses(self, response):
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return [item['status'] for item in response.json()['results']]
+
+    def test_favorites(self):
+        url = '/api/recipes/favorite/bulk/'
+        with diagnostics.query_budget(6):
+            response = self.client.post(url, {
+                'ids': [*self.ids, self.ids[0], MISSING_ID]}, format='json')
+        self.assertEqual(self.get_statuses(response),
+                         ['added', 'added', 'not_found'])
+        response = self.client.post(url, {'ids': self.ids}, format='json')
+        self.assertEqual(self.get_statuses(response), ['exists', 'exists'])
+        self.assertEqual(
+            list(Recipe.objects.order_by('id').values_list(
+                'favorites_count', flat=True)), [1, 1])
+        detail = self.client.get(f'/api/recipes/{self.ids[0]}/').json()
+        self.assertTrue(detail['is_favorited'])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(
+                url, {'ids': [self.ids[0], MISSING_ID]}, format='json')
+        self.assertEqual(self.get_statuses(response), ['removed', 'absent'])
+        self.assertEqual(
+            list(Recipe.objects.order_by('id').values_list(
+                'favorites_count', flat=True)), [0, 1])
+        detail = self.client.get(f'/api/recipes/{self.ids[0]}/').json()
+        self.assertFalse(detail['is_favorited'])
+
+    def test_shopping_cart(self):
+        url = '/api/recipes/shopping_cart/bulk/'
+        version = ShoppingCartVersion.objects.get_version(self.user)
+        response = self.client.post(url, {'ids': self.ids}, format='json')
+        self.assertEqual(self.get_statuses(response), ['added', 'added'])
+        self.assertEqual(ShoppingCart.objects.filter(user=self.user).count(),
+                         2)
+        self.assertEqual(
+            list(ShoppingListItem.objects.values_list('amount', flat=True)),
+            [200])
+        self.assertGreater(ShoppingCartVersion.objects.get_version(self.user),
+                           version)
+        self.assertTrue(
+            self.client.get(f'/api/recipes/{self.ids[1]}/').json()[
+                'is_in_shopping_cart'])
+        response = self.client.delete(url, {'ids': self.ids}, format='json')
+        self.assertEqual(self.get_statuses(response), ['removed', 'removed'])
+        self.assertFalse(ShoppingCart.objects.exists())
+        self.assertFalse(ShoppingListItem.objects.filter(
+            amount__gt=0).exists())
+        self.assertEqual(
+            list(Recipe.objects.values_list('in_carts_count', flat=True)),
+            [0, 0])
+
+    def test_subscriptions(self):
+        url = '/api/users/subscriptions/bulk/'
+        author_ids = [author.id for author in self.authors]
+        response = self.client.post(url, {
+            'ids': [*author_ids, self.user.id, MISSING_ID]}, format='json')
+        self.assertEqual(self.get_statuses(response),
+                         ['added', 'added', 'self', 'not_found'])
+        response = self.client.get('/api/users/subscriptions/')
+        self.assertEqual(response.json()['count'], 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(
+                url, {'ids': author_ids[:1]}, format='json')
+        self.assertEqual(self.get_statuses(response), ['removed'])
+        self.assertEqual(
+            list(Subscription.objects.values_list('subscribing', flat=True)),
+            author_ids[1:])
+        author = self.client.get(f'/api/users/{author_ids[0]}/').json()
+        self.assertFalse(author['is_subscribed'])
+
+    def test_validation(self):
+        for data in ({}, {'ids': []}, {'ids': ['x']},
+                     {'ids': list(range(1, 102))}):
+            with self.subTest(data=data):
+                response = self.client.post(
+                    '/api/recipes/favorite/bulk/', data, format='json')
+                self.assertEqual(response.status_code,
+                                 HTTPStatus.BAD_REQUEST)
+        self.client.force_authenticate(None)
+        response = self.client.post('/api/recipes/favorite/bulk/',
+                                    {'ids': self.ids}, format='json')
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
@@ -0,0 +1,47 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+current_timings = ContextVar('current_timings', default=None)
+
+
+class Timings:
+    """
+    Durations in seconds and the query count of the current request.
+    """
+    def __init__(self):
+        self.durations = defaultdict(float)
+        self.queries = 0
+        self.active = set()
+
+    def __call__(self, execute, sql, params, many, context):
+        """
+        Database execute wrapper that adds the query time to 'db'.
+        """
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.durations['db'] += time.perf_counter() - start
+            self.queries += 1
+
+
+@contextmanager
+def measure(name):
+    """
+    Adds the time spent in the block to the named duration of
+    the current request. Nested blocks with the same name are
+    counted once.
+    """
+    timings = current_timings.get()
+    if timings is None or name in timings.active:
+        yield
+        return
+    timings.active.add(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.durations[name] += time.perf_counter() - start
+        timings.active.discard(name)
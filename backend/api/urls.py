@@ -6,7 +6,9 @@ from .views import (
     IngredientViewSet,
     RecipeViewSet,
     SubscriptionViewSet,
-    SubscribeViewSet)
+    SubscribeViewSet,
+    JobViewSet,
+    metrics)
 
 app_name = 'api'
 
@@ -35,8 +37,10 @@ router.register(r'recipes', RecipeViewSet, basename='recipe')
 router.register(r'users/subscriptions',
                 SubscriptionViewSet,
                 basename='subscribtions')
+router.register(r'jobs', JobViewSet, basename='job')
 
 urlpatterns = [
+    path('metrics/', metrics, name='metrics'),
     path('', include(customrouter.urls)),
     path('', include(router.urls)),
     path('', include('djoser.urls')),
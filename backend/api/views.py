@@ -1,20 +1,21 @@
-import io
-
-from django.db.models import Sum
-from django.http import FileResponse
+from django.db.models import OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import (
-    viewsets, filters, status, mixins, exceptions, permissions)
+    viewsets, status, mixins, exceptions, permissions)
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from reportlab.pdfgen import canvas
-from reportlab.lib.units import cm
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
 
+from foodgram_backend.settings import (
+    INGREDIENT_SEARCH_LIMIT, MAX_INGREDIENT_SEARCH_LIMIT)
+from jobs.models import Job
+from jobs.registry import enqueue
+from recipes import relations
 from recipes.models import (
     Ingredient, Tag, Recipe, Favourite, ShoppingCart, RecipeIngredient)
 from users.models import Subscription
@@ -27,10 +28,18 @@ from .serializers import (
     RecipeShortSerializer,
     SubscriptionSerializer,
     FavoriteSerializer,
-    ShoppingSerializer)
+    ShoppingSerializer,
+    BulkIdsSerializer,
+    JobSerializer)
+from . import bulk
+from .exports import SHOPPING_LIST_RENDERERS, export_shopping_list
+from .metrics import render as render_metrics
+from .indexes import ingredient_index
+from .snapshots import ingredient_snapshot, tag_snapshot
 from .permissions import AuthorOrReadOnly
-from .filters import RecipeFilter, IngredientFilter
-from .paginations import ShoppingCartPagination
+from .replicas import read_from_primary
+from .filters import RecipeFilter, RecipeOrderingFilter, IngredientFilter
+from .paginations import RecipePagination
 
 
 User = get_user_model()
@@ -39,16 +48,23 @@ User = get_user_model()
 class TagViewSet(viewsets.ReadOnlyModelViewSet):
     """
     ViewSet for getting tag list or tag details.
+    The list is served from a pre-rendered snapshot.
     """
     pagination_class = None
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
 
+    def list(self, request, *args, **kwargs):
+        return tag_snapshot.response(request)
+
 
 class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     """
     ViewSet for getting ingredient list or ingredient details.
     It supports searching by name.
+    The full list is served from a pre-rendered snapshot, searches
+    are answered from the in-memory ingredient index, the database
+    is queried only while the index is cold.
     """
     filter_backends = (DjangoFilterBackend,)
     filterset_class = IngredientFilter
@@ -56,6 +72,30 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
 
+    def get_search_limit(self):
+        limit = self.request.query_params.get(
+            'limit', INGREDIENT_SEARCH_LIMIT)
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            raise exceptions.ValidationError(
+                {'limit': ['Значение должно быть целым числом.']})
+        if limit < 1:
+            raise exceptions.ValidationError(
+                {'limit': ['Значение должно быть положительным.']})
+        return min(limit, MAX_INGREDIENT_SEARCH_LIMIT)
+
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if not name:
+            return ingredient_snapshot.response(request)
+        limit = self.get_search_limit()
+        results = ingredient_index.search(name, limit)
+        if results is None:
+            queryset = self.filter_queryset(self.get_queryset())[:limit]
+            results = self.get_serializer(queryset, many=True).data
+        return Response(results)
+
 
 class RecipeViewSet(viewsets.ModelViewSet):
     """
@@ -65,12 +105,28 @@ class RecipeViewSet(viewsets.ModelViewSet):
     adding to favourites, shopping.
     It supports filtering, ordering, and permissions.
     """
-    queryset = Recipe.objects.all()
-    filter_backends = (DjangoFilterBackend, filters.OrderingFilter)
+    filter_backends = (DjangoFilterBackend, RecipeOrderingFilter)
     filterset_class = RecipeFilter
     permission_classes = (AuthorOrReadOnly,)
-    ordering = ('-pub_date',)
-    pagination_class = ShoppingCartPagination
+    ordering = ('-pub_date', '-id')
+    ordering_fields = ('id', 'name', 'author', 'image', 'text',
+                       'cooking_time', 'pub_date', 'favorites_count',
+                       'in_carts_count')
+    pagination_class = RecipePagination
+
+    def get_queryset(self):
+        """
+        Loads a page of recipes in a fixed number of queries.
+
+        Author is joined, tags and ingredients are prefetched. The per-user
+        flags is_favorited, is_in_shopping_cart and is_subscribed are
+        answered by serializers from the cached membership sets.
+        """
+        return Recipe.objects.select_related('author').prefetch_related(
+            'tags',
+            Prefetch('recipeingredient_set',
+                     queryset=RecipeIngredient.objects.select_related(
+                         'ingredient')))
 
     def get_serializer_class(self):
         if self.action in ('create', 'partial_update'):
@@ -78,8 +134,10 @@ class RecipeViewSet(viewsets.ModelViewSet):
         return RecipeReadSerializer
 
     @staticmethod
+    @transaction.atomic
     def add_recipe_for_user(ser_class, pk, request):
         recipe = get_object_or_404(Recipe, pk=pk)
+        bulk.lock_user(request.user)
         data = {'user': request.user.id, 'recipe': pk}
         serializer = ser_class(data=data, context={'request': request})
         serializer.is_valid(raise_exception=True)
@@ -89,14 +147,38 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
     @staticmethod
     def delete_recipe_for_user(model, pk, request, message):
-        delete_object = model.objects.filter(
-            user=request.user,
-            recipe=pk)
-        if not delete_object.exists():
+        if not relations.delete(model.objects.filter(
+                user=request.user, recipe=pk)):
             raise exceptions.ValidationError(f'Этого рецепта нет в {message}')
-        delete_object.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @staticmethod
+    def change_recipes_in_bulk(model, request):
+        """
+        Adds (POST) or removes (DELETE) the listed recipes in one
+        transaction and returns the status of every id.
+        """
+        serializer = BulkIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        if request.method == 'POST':
+            results = bulk.add_recipes(model, request.user, ids)
+        else:
+            results = bulk.remove_recipes(model, request.user, ids)
+        return Response({'results': results})
+
+    @action(detail=False, url_path='favorite/bulk',
+            url_name='favorite-bulk', methods=['post', 'delete'],
+            permission_classes=[permissions.IsAuthenticated])
+    def bulk_favorite(self, request):
+        return self.change_recipes_in_bulk(Favourite, request)
+
+    @action(detail=False, url_path='shopping_cart/bulk',
+            url_name='shopping_cart-bulk', methods=['post', 'delete'],
+            permission_classes=[permissions.IsAuthenticated])
+    def bulk_shopping_cart(self, request):
+        return self.change_recipes_in_bulk(ShoppingCart, request)
+
     @action(detail=True, url_path='favorite', url_name='favorite',
             serializer_class=FavoriteSerializer, methods=['post', 'delete'])
     def create_and_destroy_favorite(self, request, pk):
@@ -117,41 +199,29 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return RecipeViewSet.delete_recipe_for_user(
                 ShoppingCart, pk, request, 'покупках')
 
+    @read_from_primary
     @action(detail=False, url_path='download_shopping_cart',
             url_name='download_shopping_cart',
-            permission_classes=[permissions.IsAuthenticated])
+            permission_classes=[permissions.IsAuthenticated],
+            renderer_classes=SHOPPING_LIST_RENDERERS)
     def download_shopping_list(self, request):
-        recipes = ShoppingCart.objects.filter(user=request.user).\
-            values('recipe')
-        ingredients = RecipeIngredient.objects.filter(recipe__in=recipes).\
-            values('ingredient__name', 'ingredient__measurement_unit').\
-            annotate(quantity=Sum('amount'))
-        records = ["СПИСОК ПОКУПОК"]
-        for ingredient in ingredients:
-            records.append([ingredient['ingredient__name'],
-                            str(ingredient['quantity']),
-                            ingredient['ingredient__measurement_unit']])
-
-        buf = io.BytesIO()
-        canv = canvas.Canvas(buf, pagesize=letter, bottomup=0)
-        text = canv.beginText()
-        text.setTextOrigin(cm, cm)
-        pdfmetrics.registerFont(TTFont('Calibri', '/app/api/calibri.ttf'))
-        text.setFont('Calibri', 12)
-
-        for record in records:
-            line = '- '
-            for part in record:
-                line += part + ' '
-            text.textLine(line.encode("utf-8"))
-
-        canv.drawText(text)
-        canv.showPage()
-        canv.save()
-        buf.seek(0)
-        return FileResponse(buf,
-                            as_attachment=True,
-                            filename='shopping_list.pdf')
+        """
+        Sends the shopping list, or with ?async=1 queues its rendering
+        and answers with the job to poll.
+
+        Reads go to the primary: the rows cached under the cart version
+        must be as new as the version itself.
+        """
+        if request.query_params.get('async') in ('1', 'true'):
+            job = enqueue('export_shopping_list', owner=request.user,
+                          user_id=request.user.id,
+                          format=request.accepted_renderer.format)
+            serializer = JobSerializer(job, context={'request': request})
+            return Response(
+                serializer.data, status=status.HTTP_202_ACCEPTED,
+                headers={'Location': request.build_absolute_uri(
+                    reverse('api:job-detail', args=[job.pk]))})
+        return export_shopping_list(request, request.accepted_renderer)
 
 
 class SubscriptionViewSet(mixins.ListModelMixin,
@@ -163,9 +233,44 @@ class SubscriptionViewSet(mixins.ListModelMixin,
     permission_classes = (permissions.IsAuthenticated,)
 
     def get_queryset(self):
+        """
+        Loads a page of authors with their recipe counts and latest
+        recipes in a fixed number of queries.
+
+        Only the recipes_limit newest recipes of each author are prefetched.
+        """
         current_user = self.request.user
+        limit = SubscribeSerializer.get_recipes_limit(self.request)
+        latest_recipes = Recipe.objects.none()
+        if limit:
+            latest_recipes = Recipe.objects.filter(pk__in=Subquery(
+                Recipe.objects.filter(author=OuterRef('author'))
+                .order_by('-pub_date').values('pk')[:limit]
+            )).order_by('-pub_date')
         return User.objects.filter(
-            subscribing__in=current_user.subscriber.all())
+            subscribing__in=current_user.subscriber.all()
+        ).annotate(
+            recipes_count=Coalesce('stats__recipes_count', 0)
+        ).prefetch_related(
+            Prefetch('recipes', queryset=latest_recipes,
+                     to_attr='latest_recipes')
+        ).order_by('id')
+
+    @action(detail=False, url_path='bulk', url_name='bulk',
+            methods=['post', 'delete'])
+    def bulk_subscribe(self, request):
+        """
+        Subscribes to (POST) or unsubscribes from (DELETE) the listed
+        authors in one transaction and returns the status of every id.
+        """
+        serializer = BulkIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        if request.method == 'POST':
+            results = bulk.subscribe(request.user, ids)
+        else:
+            results = bulk.unsubscribe(request.user, ids)
+        return Response({'results': results})
 
 
 class SubscribeViewSet(viewsets.ModelViewSet):
@@ -174,9 +279,11 @@ class SubscribeViewSet(viewsets.ModelViewSet):
     """
     serializer_class = SubscriptionSerializer
 
+    @transaction.atomic
     def create(self, request, *args, **kwargs):
         subscribing_id = int(self.kwargs.get('user_id'))
         subscribing = get_object_or_404(User, id=subscribing_id)
+        bulk.lock_user(request.user)
         data = {'subscriber': request.user.id, 'subscribing': subscribing_id}
         create_serializer = self.get_serializer(
             data=data, context={'request': request})
@@ -197,3 +304,40 @@ class SubscribeViewSet(viewsets.ModelViewSet):
                 'Нет подписки на этого пользователя')
         subscription.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+@read_from_primary
+class JobViewSet(mixins.RetrieveModelMixin,
+                 viewsets.GenericViewSet):
+    """
+    ViewSet for polling background jobs of the user
+    and downloading their results.
+    """
+    serializer_class = JobSerializer
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get_queryset(self):
+        return Job.objects.filter(owner=self.request.user).defer('result')
+
+    @action(detail=True)
+    def result(self, request, pk=None):
+        job = get_object_or_404(
+            Job.objects.filter(owner=request.user, status=Job.Status.DONE),
+            pk=pk)
+        if job.result is None:
+            raise exceptions.NotFound('У задачи нет результата.')
+        response = HttpResponse(bytes(job.result),
+                                content_type=job.content_type)
+        response['Content-Disposition'] = (
+            f'attachment; filename="{job.filename}"')
+        return response
+
+
+def metrics(request):
+    """
+    Prometheus metrics of all worker processes.
+    Reads only the metric files, never the database.
+    """
+    return HttpResponse(render_metrics(),
+                        content_type='text/plain; version=0.0.4; '
+                                     'charset=utf-8')
@@ -0,0 +1,6 @@
+def on_starting(server):
+    """
+    Removes the metric files of the previous run, before workers fork.
+    """
+    from api import metrics
+    metrics.reset('web')
@@ -0,0 +1,17 @@
+from django.contrib import admin
+
+from .models import Job
+
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'status', 'owner', 'attempts', 'created',
+                    'finished')
+    list_filter = ('status', 'name')
+    list_select_related = ('owner',)
+    show_full_result_count = False
+    readonly_fields = ('name', 'owner', 'payload', 'attempts', 'locked_by',
+                       'locked_until', 'content_type', 'filename', 'error',
+                       'created', 'finished')
+
+
+admin.site.register(Job, JobAdmin)
@@ -0,0 +1,44 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+from api import metrics
+from foodgram_backend.settings import JOB_POLL_INTERVAL
+from jobs.worker import Worker
+
+
+class Command(BaseCommand):
+    help = 'Run background job workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=2,
+            help='Number of worker threads.')
+        parser.add_argument(
+            '--poll-interval', type=float, default=JOB_POLL_INTERVAL,
+            help='Seconds to wait when the queue is empty.')
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Run due jobs in this thread and exit.')
+
+    def handle(self, *args, **options):
+        metrics.store.role = 'worker'
+        if options['once']:
+            count = Worker().run_pending()
+            self.stdout.write(self.style.SUCCESS(
+                f'Выполнено задач: {count}'))
+            return
+        metrics.reset('worker')
+        stop = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *args: stop.set())
+        threads = [
+            threading.Thread(target=Worker(number).run,
+                             args=(stop, options['poll_interval']))
+            for number in range(options['workers'])]
+        for thread in threads:
+            thread.start()
+        self.stdout.write(f'Запущено обработчиков: {len(threads)}')
+        for thread in threads:
+            thread.join()
@@ -0,0 +1,130 @@
+import uuid
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.db import models
+from django.db.models import F, Q
+from django.utils import timezone
+
+User = get_user_model()
+
+
+class JobManager(models.Manager):
+    def due(self, now):
+        """
+        Jobs waiting to run and running jobs whose worker lease expired
+        with attempts left.
+        """
+        return self.filter(
+            Q(status=Job.Status.PENDING, run_after__lte=now)
+            | Q(status=Job.Status.RUNNING, locked_until__lt=now,
+                attempts__lt=F('max_attempts')))
+
+    def reap(self, now):
+        """
+        Fails running jobs whose lease expired on the last attempt,
+        e.g. because the job kills its worker every time.
+        """
+        return self.filter(
+            status=Job.Status.RUNNING, locked_until__lt=now,
+            attempts__gte=F('max_attempts')).update(
+            status=Job.Status.FAILED, finished=now, locked_by='',
+            locked_until=None,
+            error='The worker lease expired on the last attempt')
+
+    def claim(self, worker, lease):
+        """
+        Marks the oldest due job as running by the worker.
+
+        The job is taken with a conditional UPDATE on its attempt count,
+        so two workers never run the same attempt.
+        """
+        now = timezone.now()
+        candidates = self.due(now).order_by('run_after').values_list(
+            'pk', 'attempts')[:10]
+        for pk, attempts in candidates:
+            claimed = self.due(now).filter(pk=pk, attempts=attempts).update(
+                status=Job.Status.RUNNING, attempts=F('attempts') + 1,
+                locked_by=worker, locked_until=now + timedelta(seconds=lease))
+            if claimed:
+                return self.get(pk=pk)
+        return None
+
+    def held_by(self, pk, worker):
+        """
+        The job if it is still running under the worker's lease.
+        """
+        return self.filter(pk=pk, status=Job.Status.RUNNING,
+                           locked_by=worker)
+
+    def renew(self, pk, worker, lease):
+        """
+        Extends the worker's lease on a running job, returns False
+        if the lease was lost and the job was taken by another worker.
+        """
+        return bool(self.held_by(pk, worker).update(
+            locked_until=timezone.now() + timedelta(seconds=lease)))
+
+    def purge(self, age):
+        """
+        Deletes jobs finished more than age seconds ago, with their results.
+        """
+        return self.filter(
+            status__in=(Job.Status.DONE, Job.Status.FAILED),
+            finished__lt=timezone.now() - timedelta(seconds=age)).delete()
+
+
+class Job(models.Model):
+    """
+    Unit of background work run by manage.py run_workers.
+    """
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'В очереди'
+        RUNNING = 'running', 'Выполняется'
+        DONE = 'done', 'Выполнена'
+        FAILED = 'failed', 'Ошибка'
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4,
+                          editable=False)
+    name = models.CharField(max_length=100, verbose_name='Задача')
+    owner = models.ForeignKey(
+        User,
+        related_name='jobs',
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        verbose_name='Владелец')
+    payload = models.JSONField(default=dict, verbose_name='Аргументы')
+    status = models.CharField(
+        max_length=10,
+        choices=Status.choices,
+        default=Status.PENDING,
+        verbose_name='Статус')
+    attempts = models.PositiveSmallIntegerField(default=0,
+                                                verbose_name='Попытки')
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    result = models.BinaryField(null=True, editable=False)
+    content_type = models.CharField(max_length=100, blank=True)
+    filename = models.CharField(max_length=100, blank=True)
+    error = models.TextField(blank=True, verbose_name='Ошибка')
+    created = models.DateTimeField(auto_now_add=True,
+                                   verbose_name='Создана')
+    finished = models.DateTimeField(null=True, blank=True,
+                                    verbose_name='Завершена')
+
+    objects = JobManager()
+
+    class Meta:
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+        ordering = ('-created',)
+        indexes = [
+            models.Index(fields=['status', 'run_after'],
+                         name='job_status_run_after_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.name} ({self.status})'
@@ -0,0 +1,38 @@
+from collections import namedtuple
+
+from django.utils import timezone
+
+from .models import Job
+
+Task = namedtuple('Task', 'func max_attempts retry_delay')
+Result = namedtuple('Result', 'content content_type filename')
+
+TASKS = {}
+
+
+def task(name, max_attempts=3, retry_delay=10):
+    """
+    Registers a function as a background task.
+
+    The function is called with the job payload as keyword arguments
+    and may return a Result to be stored in the job. A failed attempt
+    is retried after retry_delay seconds, doubled on each retry.
+    """
+    def decorator(func):
+        TASKS[name] = Task(func, max_attempts, retry_delay)
+        return func
+    return decorator
+
+
+def enqueue(name, owner=None, run_after=None, **payload):
+    """
+    Creates a job for a registered task.
+    """
+    if name not in TASKS:
+        raise KeyError(f'Unknown task {name}')
+    return Job.objects.create(
+        name=name,
+        owner=owner,
+        payload=payload,
+        max_attempts=TASKS[name].max_attempts,
+        run_after=run_after or timezone.now())
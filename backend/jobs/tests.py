@@ -0,0 +1,108 @@
+import io
+from datetime import timedelta
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from jobs.models import Job
+from jobs.registry import TASKS, enqueue, task
+from jobs.worker import Worker
+
+CALLS = []
+
+
+@task('test_flaky', max_attempts=2, retry_delay=0)
+def flaky(fail):
+    CALLS.append(fail)
+    if fail:
+        raise ValueError('fail')
+
+
+class WorkerTestCase(TestCase):
+    """
+    Workers run due jobs and retry failed ones.
+    """
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        TASKS.pop('test_flaky')
+
+    def setUp(self):
+        CALLS.clear()
+
+    def run_workers(self):
+        call_command('run_workers', once=True, stdout=io.StringIO())
+
+    def test_job_is_done(self):
+        job = enqueue('test_flaky', fail=False)
+        self.run_workers()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.DONE)
+        self.assertEqual(CALLS, [False])
+
+    def test_failed_job_is_retried(self):
+        job = enqueue('test_flaky', fail=True)
+        with self.assertLogs('jobs.worker', 'ERROR'):
+            self.run_workers()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.FAILED)
+        self.assertEqual(job.attempts, 2)
+        self.assertIn('ValueError', job.error)
+        self.assertEqual(CALLS, [True, True])
+
+    def test_claimed_job_is_not_taken_twice(self):
+        enqueue('test_flaky', fail=False)
+        self.assertIsNotNone(Job.objects.claim('first', 60))
+        self.assertIsNone(Job.objects.claim('second', 60))
+
+    def test_lease_is_renewed_by_its_holder_only(self):
+        job = enqueue('test_flaky', fail=False)
+        job = Job.objects.claim('first', 1)
+        self.assertTrue(Job.objects.renew(job.pk, 'first', 60))
+        job.refresh_from_db()
+        self.assertGreater(job.locked_until,
+                           timezone.now() + timedelta(seconds=30))
+        self.assertFalse(Job.objects.renew(job.pk, 'second', 60))
+
+    def test_exhausted_job_with_expired_lease_is_failed(self):
+        job = enqueue('test_flaky', fail=False)
+        Job.objects.filter(pk=job.pk).update(
+            status=Job.Status.RUNNING, attempts=job.max_attempts,
+            locked_by='dead', locked_until=timezone.now() - timedelta(
+                seconds=1))
+        self.assertIsNone(Job.objects.claim('second', 60))
+        with self.assertLogs('jobs.worker', 'WARNING'):
+            self.run_workers()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.FAILED)
+        self.assertEqual(job.attempts, job.max_attempts)
+        self.assertIsNotNone(job.finished)
+        self.assertEqual(CALLS, [])
+
+    def test_outcome_of_a_lost_lease_is_dropped(self):
+        enqueue('test_flaky', fail=False)
+        worker = Worker()
+        job = Job.objects.claim(worker.name, 60)
+        Job.objects.filter(pk=job.pk).update(locked_by='other')
+        with self.assertLogs('jobs.worker', 'WARNING'):
+            worker.run_job(job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.RUNNING)
+        self.assertEqual(job.locked_by, 'other')
+
+    def test_old_finished_jobs_are_purged(self):
+        old = timezone.now() - timedelta(days=30)
+        done = enqueue('test_flaky', fail=False)
+        failed = enqueue('test_flaky', fail=True)
+        recent = enqueue('test_flaky', fail=False)
+        pending = enqueue('test_flaky', fail=False)
+        Job.objects.filter(pk=done.pk).update(
+            status=Job.Status.DONE, finished=old)
+        Job.objects.filter(pk=failed.pk).update(
+            status=Job.Status.FAILED, finished=old)
+        Job.objects.filter(pk=recent.pk).update(
+            status=Job.Status.DONE, finished=timezone.now())
+        Job.objects.purge(60 * 60 * 24 * 7)
+        self.assertEqual(set(Job.objects.values_list('pk', flat=True)),
+                         {recent.pk, pending.pk})
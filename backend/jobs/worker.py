@@ -0,0 +1,132 @@
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.db import close_old_connections, connection
+from django.utils import timezone
+
+from foodgram_backend.settings import (
+    JOB_LEASE, JOB_POLL_INTERVAL, JOB_PURGE_INTERVAL, JOB_RETENTION)
+from .models import Job
+from .registry import TASKS
+
+logger = logging.getLogger(__name__)
+
+
+class Worker:
+    """
+    Takes due jobs from the database and runs them one by one.
+
+    The lease on a running job is renewed every third of its length,
+    so a long job is not taken by another worker, and the outcome is
+    written only while the lease is still held. The first worker
+    also purges jobs finished more than JOB_RETENTION seconds ago.
+    """
+    def __init__(self, number=0, lease=JOB_LEASE):
+        self.name = f'{socket.gethostname()}:{os.getpid()}:{number}'
+        self.number = number
+        self.lease = lease
+        self.purged = None
+
+    def renew_lease(self, job, done):
+        try:
+            while not done.wait(self.lease / 3):
+                if not Job.objects.renew(job.pk, self.name, self.lease):
+                    return
+        except Exception:
+            logger.exception('Worker %s failed to renew the lease of %s',
+                             self.name, job.pk)
+        finally:
+            connection.close()
+
+    @contextmanager
+    def keep_lease(self, job):
+        done = threading.Event()
+        thread = threading.Thread(target=self.renew_lease, args=(job, done),
+                                  daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            done.set()
+            thread.join()
+
+    def run_job(self, job):
+        task = TASKS.get(job.name)
+        try:
+            if task is None:
+                raise KeyError(f'Unknown task {job.name}')
+            with self.keep_lease(job):
+                result = task.func(**job.payload)
+        except Exception:
+            logger.exception('Job %s (%s) failed', job.pk, job.name)
+            fields = {'error': traceback.format_exc()}
+            if task is None or job.attempts >= job.max_attempts:
+                fields.update(status=Job.Status.FAILED,
+                              finished=timezone.now())
+            else:
+                fields.update(
+                    status=Job.Status.PENDING,
+                    run_after=timezone.now() + timedelta(
+                        seconds=task.retry_delay * 2 ** (job.attempts - 1)))
+        else:
+            fields = {'status': Job.Status.DONE, 'finished': timezone.now(),
+                      'error': ''}
+            if result is not None:
+                fields.update(result=result.content,
+                              content_type=result.content_type,
+                              filename=result.filename)
+        if not Job.objects.held_by(job.pk, self.name).update(
+                locked_by='', locked_until=None, **fields):
+            logger.warning('Worker %s lost the lease of job %s (%s), '
+                           'its outcome is dropped', self.name, job.pk,
+                           job.name)
+
+    def purge(self):
+        """
+        Deletes old finished jobs, at most once per JOB_PURGE_INTERVAL.
+        """
+        now = time.monotonic()
+        if self.purged is not None and now - self.purged < JOB_PURGE_INTERVAL:
+            return
+        self.purged = now
+        count, _ = Job.objects.purge(JOB_RETENTION)
+        if count:
+            logger.info('Worker %s purged %s finished jobs', self.name, count)
+
+    def run_pending(self):
+        """
+        Runs due jobs until there are none left and returns their count.
+        Jobs that lost their worker on the last attempt are failed first.
+        """
+        reaped = Job.objects.reap(timezone.now())
+        if reaped:
+            logger.warning('Worker %s failed %s jobs whose lease expired '
+                           'on the last attempt', self.name, reaped)
+        count = 0
+        while True:
+            close_old_connections()
+            job = Job.objects.claim(self.name, self.lease)
+            if job is None:
+                return count
+            self.run_job(job)
+            count += 1
+
+    def run(self, stop, poll_interval=JOB_POLL_INTERVAL):
+        """
+        Runs jobs until the stop event is set.
+        """
+        while not stop.is_set():
+            try:
+                if self.number == 0:
+                    self.purge()
+                self.run_pending()
+            except Exception:
+                logger.exception('Worker %s failed to take a job', self.name)
+            stop.wait(poll_interval)
+        close_old_connections()
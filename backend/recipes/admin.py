@@ -1,5 +1,8 @@
 from django.contrib import admin
 
+from . import relations
+from .admin_filters import input_filter
+from .shopping_list import refresh_recipes
 from .models import (Recipe,
                      Ingredient,
                      Tag,
@@ -8,6 +11,13 @@ from .models import (Recipe,
                      Favourite,
                      ShoppingCart)
 
+# Filters with a text box, the sidebar would list every row otherwise.
+AuthorFilter = input_filter('автор', 'author__username__istartswith')
+UserFilter = input_filter('пользователь', 'user__username__istartswith')
+RecipeNameFilter = input_filter('рецепт', 'recipe__name__istartswith')
+IngredientFilter = input_filter('ингредиент',
+                                'ingredient__name__istartswith')
+
 
 class RecipeAdmin(admin.ModelAdmin):
     list_display = ('pk',
@@ -20,8 +30,15 @@ class RecipeAdmin(admin.ModelAdmin):
                     'favorite_count'
                     )
     search_fields = ('author__username', 'name',)
-    list_filter = ('author__username', 'name', 'tags', 'pub_date')
+    list_filter = (AuthorFilter, 'tags', 'pub_date')
     list_editable = ('name',)
+    list_select_related = ('author',)
+    autocomplete_fields = ('author',)
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related(
+            'tags', 'ingredients')
 
     def author_name(self, obj):
         return obj.author.username
@@ -34,11 +51,13 @@ class RecipeAdmin(admin.ModelAdmin):
                           in obj.ingredients.all()])
 
     def favorite_count(self, obj):
-        return obj.favorite.count()
+        return obj.favorites_count
 
     author_name.short_description = 'Автор'
+    author_name.admin_order_field = 'author__username'
     display_tags.short_description = 'Теги'
     display_ingredients.short_description = 'Ингредиенты'
+    favorite_count.admin_order_field = 'favorites_count'
 
 
 class TagAdmin(admin.ModelAdmin):
@@ -50,13 +69,17 @@ class TagAdmin(admin.ModelAdmin):
 class IngredientAdmin(admin.ModelAdmin):
     list_display = ('name', 'measurement_unit')
     search_fields = ('name',)
-    list_filter = ('name',)
+    list_filter = (input_filter('название', 'name__istartswith'),)
+    show_full_result_count = False
 
 
 class RecipeIngredientAdmin(admin.ModelAdmin):
     list_display = ('recipe_name', 'ingredient_name', 'amount')
     search_fields = ('recipe__name', 'ingredient__name',)
-    list_filter = ('recipe__name', 'ingredient__name',)
+    list_filter = (RecipeNameFilter, IngredientFilter)
+    list_select_related = ('recipe', 'ingredient')
+    autocomplete_fields = ('recipe', 'ingredient')
+    show_full_result_count = False
 
     def recipe_name(self, obj):
         return obj.recipe.name
@@ -67,11 +90,29 @@ class RecipeIngredientAdmin(admin.ModelAdmin):
     recipe_name.short_description = 'Рецепт'
     ingredient_name.short_description = 'Ингредиенты'
 
+    def save_model(self, request, obj, form, change):
+        recipe_ids = {obj.recipe_id, *RecipeIngredient.objects.filter(
+            pk=obj.pk).values_list('recipe', flat=True)}
+        super().save_model(request, obj, form, change)
+        refresh_recipes(recipe_ids)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        refresh_recipes([obj.recipe_id])
+
+    def delete_queryset(self, request, queryset):
+        recipe_ids = set(queryset.values_list('recipe', flat=True))
+        super().delete_queryset(request, queryset)
+        refresh_recipes(recipe_ids)
+
 
 class RecipeTagAdmin(admin.ModelAdmin):
     list_display = ('recipe_name', 'tag_name',)
     search_fields = ('recipe__name', 'tag__name',)
-    list_filter = ('recipe__name', 'tag__name',)
+    list_filter = (RecipeNameFilter, 'tag')
+    list_select_related = ('recipe', 'tag')
+    autocomplete_fields = ('recipe',)
+    show_full_result_count = False
 
     def recipe_name(self, obj):
         return obj.recipe.name
@@ -79,20 +120,46 @@ class RecipeTagAdmin(admin.ModelAdmin):
     def tag_name(self, obj):
         return obj.tag.name
 
-    recipe_name.short_description = 'Автор'
+    recipe_name.short_description = 'Рецепт'
     tag_name.short_description = 'Теги'
 
 
-class FavouriteAdmin(admin.ModelAdmin):
+class RelationAdmin(admin.ModelAdmin):
+    """
+    Favorites and cart rows are deleted through relations.delete(),
+    the models have no delete signals. A saved row is not edited,
+    its effects are applied on create and delete only.
+    """
+    relation_fields = ('user', 'recipe')
+
+    def get_readonly_fields(self, request, obj=None):
+        if obj is not None:
+            return self.relation_fields
+        return super().get_readonly_fields(request, obj)
+
+    def delete_model(self, request, obj):
+        relations.delete(type(obj).objects.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        relations.delete(queryset)
+
+
+class FavouriteAdmin(RelationAdmin):
     list_display = ('user', 'recipe')
-    search_fields = ('user', 'recipe')
-    list_filter = ('user', 'recipe')
+    search_fields = ('user__username', 'recipe__name')
+    list_filter = (UserFilter, RecipeNameFilter)
+    list_select_related = ('user', 'recipe__author')
+    autocomplete_fields = ('user', 'recipe')
+    show_full_result_count = False
 
 
-class ShoppingCartAdmin(admin.ModelAdmin):
+class ShoppingCartAdmin(RelationAdmin):
     list_display = ('user', 'recipe')
-    search_fields = ('user', 'recipe')
-    list_filter = ('user', 'recipe')
+    search_fields = ('user__username', 'recipe__name')
+    list_filter = (UserFilter, RecipeNameFilter)
+    list_select_related = ('user', 'recipe__author')
+    autocomplete_fields = ('user', 'recipe')
+    show_full_result_count = False
 
 
 admin.site.register(Recipe, RecipeAdmin)
@@ -0,0 +1,41 @@
+from django.contrib import admin
+
+
+class InputFilter(admin.SimpleListFilter):
+    """
+    Sidebar filter with a text box instead of a list of all values,
+    the typed value is matched with the lookup.
+    """
+    template = 'admin/input_filter.html'
+    lookup = None
+
+    def lookups(self, request, model_admin):
+        return ()
+
+    def has_output(self):
+        return True
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(**{self.lookup: self.value()})
+        return queryset
+
+    def choices(self, changelist):
+        yield {
+            'query_parts': [
+                (key, value) for key, value
+                in changelist.get_filters_params().items()
+                if key != self.parameter_name],
+        }
+
+
+def input_filter(title, lookup, parameter_name=None):
+    """
+    Returns an InputFilter matching the lookup, e.g.
+    input_filter('автор', 'author__username__istartswith').
+    """
+    return type('InputFilter', (InputFilter,), {
+        'title': title,
+        'lookup': lookup,
+        'parameter_name': parameter_name or lookup.split('__')[0],
+    })
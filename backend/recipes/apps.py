@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class RecipesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'recipes'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .counters import fill_counters
+        from .shopping_list import fill_shopping_lists
+        post_migrate.connect(fill_shopping_lists, sender=self)
+        post_migrate.connect(fill_counters, sender=self)
@@ -0,0 +1,76 @@
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from users.models import UserStats
+from .models import Favourite, Recipe, ShoppingCart
+
+RECIPE_COUNTERS = {
+    'favorites_count': Favourite,
+    'in_carts_count': ShoppingCart,
+}
+
+
+def change_recipe_counter(field, recipe_ids, delta):
+    """
+    Atomically adds delta to a counter column of the given recipes.
+    """
+    return Recipe.objects.filter(pk__in=recipe_ids).update(
+        **{field: Greatest(F(field) + delta, Value(0))})
+
+
+def change_recipes_count(user_id, delta):
+    """
+    Adds delta to the user's recipes count, a missing counter
+    is created from the actual count.
+    """
+    updated = UserStats.objects.filter(user=user_id).update(
+        recipes_count=Greatest(F('recipes_count') + delta, Value(0)))
+    if not updated and delta > 0:
+        UserStats.objects.get_or_create(
+            user_id=user_id,
+            defaults={'recipes_count': Recipe.objects.filter(
+                author=user_id).count()})
+
+
+def count_subquery(model, field, outer='pk'):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef(outer)}).order_by().values(
+            field).annotate(total=Count('pk')).values('total')), 0)
+
+
+def reconcile_counters(using=DEFAULT_DB_ALIAS):
+    """
+    Recomputes drifted counters in bulk and returns the number
+    of repaired rows per counter.
+    """
+    recipes = Recipe.objects.using(using)
+    stats = UserStats.objects.using(using)
+    repaired = {}
+    for field, model in RECIPE_COUNTERS.items():
+        actual = count_subquery(model, 'recipe')
+        drifted = recipes.annotate(actual=actual).exclude(
+            **{field: F('actual')}).values('pk')
+        repaired[field] = recipes.filter(pk__in=drifted).update(
+            **{field: actual})
+    stats.bulk_create(
+        (UserStats(user_id=author_id) for author_id
+         in recipes.filter(author__stats__isnull=True).values_list(
+             'author', flat=True).distinct()),
+        ignore_conflicts=True)
+    actual = count_subquery(Recipe, 'author', outer='user')
+    drifted = stats.annotate(actual=actual).exclude(
+        recipes_count=F('actual')).values('pk')
+    repaired['recipes_count'] = stats.filter(
+        pk__in=drifted).update(recipes_count=actual)
+    return repaired
+
+
+def fill_counters(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    post_migrate handler filling the counters, so rows that existed
+    before the counter columns get their real values on deploy.
+    Only drifted rows are written, a migrate without changes
+    costs the counting queries.
+    """
+    reconcile_counters(using)
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from recipes.models import ShoppingCartVersion
+from recipes.shopping_list import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recompute aggregated shopping lists from the carts'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', type=int, action='append', dest='users',
+            help='Пересчитать только список этого пользователя, '
+                 'можно повторять')
+
+    def handle(self, *args, **options):
+        created = rebuild(options['users'])
+        if options['users']:
+            ShoppingCartVersion.objects.bump(user__in=options['users'])
+        else:
+            ShoppingCartVersion.objects.bump()
+        self.stdout.write(self.style.SUCCESS(
+            f'Списки покупок пересчитаны, строк: {created}'))
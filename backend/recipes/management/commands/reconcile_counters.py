@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from recipes.counters import reconcile_counters
+
+
+class Command(BaseCommand):
+    help = 'Repair drifted favorite, shopping cart and recipe counters'
+
+    def handle(self, *args, **kwargs):
+        for field, repaired in reconcile_counters().items():
+            self.stdout.write(f'{field}: исправлено {repaired}')
+        self.stdout.write(self.style.SUCCESS('Счетчики пересчитаны'))
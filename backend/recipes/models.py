@@ -1,8 +1,10 @@
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models
+from django.db.models import F
 
 from foodgram_backend.settings import STANDARTLENGTH
+from .storage import ContentAddressedStorage
 
 User = get_user_model()
 
@@ -39,6 +41,11 @@ class Ingredient(models.Model):
         verbose_name='Единицы измерения',
         blank=False)
 
+    class Meta:
+        constraints = [models.UniqueConstraint(
+            fields=['name', 'measurement_unit'],
+            name='unique_name_measurement_unit')]
+
     def __str__(self):
         return self.name
 
@@ -56,6 +63,7 @@ class Recipe(models.Model):
         blank=False,)
     image = models.ImageField(
         upload_to='recipes/images/',
+        storage=ContentAddressedStorage(),
         blank=False)
     text = models.TextField(
         blank=False,
@@ -79,11 +87,25 @@ class Recipe(models.Model):
         auto_now_add=True,
         editable=False,
         verbose_name='Дата создания')
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В избранном')
+    in_carts_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В списках покупок')
 
     class Meta:
         constraints = [models.UniqueConstraint(
             fields=['name', 'author'],
             name='unique_name_author')]
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='recipe_pub_date_id_idx'),
+            models.Index(fields=['-favorites_count', '-id'],
+                         name='recipe_favorites_count_idx'),
+        ]
 
     def __str__(self):
         return f'{self.name} {self.author}'
@@ -170,3 +192,62 @@ class Favourite(models.Model):
 
     def __str__(self):
         return f'{self.recipe} {self.user}'
+
+
+class ShoppingCartVersionManager(models.Manager):
+    def get_version(self, user):
+        obj, _ = self.get_or_create(user=user)
+        return obj.version
+
+    def bump(self, **filters):
+        """
+        Increments cart versions of users matched by filters.
+        """
+        return self.filter(**filters).update(version=F('version') + 1)
+
+
+class ShoppingCartVersion(models.Model):
+    """
+    Counter that changes every time the user's shopping list may change.
+    """
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        verbose_name='Пользователь',
+        related_name='cart_version')
+    version = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Версия корзины')
+
+    objects = ShoppingCartVersionManager()
+
+    def __str__(self):
+        return f'{self.user} {self.version}'
+
+
+class ShoppingListItem(models.Model):
+    """
+    Total amount of an ingredient over all recipes in the user's cart,
+    maintained on every cart and recipe change.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь',
+        related_name='shopping_list')
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент')
+    amount = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Количество')
+
+    class Meta:
+        constraints = [models.UniqueConstraint(
+            fields=['user', 'ingredient'],
+            name='unique_user_shopping_list_ingredient')]
+
+    def __str__(self):
+        return f'{self.user} {self.ingredient} {self.amount}'
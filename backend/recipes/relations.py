@@ -0,0 +1,89 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.dispatch import Signal
+
+from . import shopping_list
+from .counters import change_recipe_counter
+from .models import Favourite, ShoppingCart, ShoppingCartVersion
+
+COUNTERS = {
+    Favourite: 'favorites_count',
+    ShoppingCart: 'in_carts_count',
+}
+
+# Favorites and cart rows are deleted without model signals, so that
+# cascades stay fast deletes. This signal is sent instead, with the
+# model as sender and the ids of the users whose rows changed.
+relations_changed = Signal()
+
+
+def raw_delete(queryset):
+    """
+    Deletes the rows with a single DELETE ... IN, without collecting
+    them for signals and cascades.
+    """
+    return queryset._raw_delete(queryset.db)
+
+
+def changed(model, user_id, recipe_ids, delta):
+    """
+    Applies the side effects of adding (delta 1) or removing (delta -1)
+    recipes to the user's favorites or cart: the recipe counter,
+    the shopping list and the cart version.
+    """
+    change_recipe_counter(COUNTERS[model], recipe_ids, delta)
+    if model is ShoppingCart:
+        if delta > 0:
+            shopping_list.add_recipes(user_id, recipe_ids)
+        else:
+            shopping_list.remove_recipes(user_id, recipe_ids)
+        ShoppingCartVersion.objects.bump(user=user_id)
+    relations_changed.send(sender=model, user_ids=[user_id])
+
+
+@transaction.atomic
+def delete(queryset):
+    """
+    Deletes favorites or cart rows with one query, applies their side
+    effects per user and returns the deleted (user id, recipe id) pairs.
+    """
+    rows = list(queryset.select_for_update().values_list('user', 'recipe'))
+    recipes = defaultdict(list)
+    for user_id, recipe_id in rows:
+        recipes[user_id].append(recipe_id)
+    for user_id, recipe_ids in recipes.items():
+        changed(queryset.model, user_id, recipe_ids, -1)
+        raw_delete(queryset.model.objects.filter(
+            user=user_id, recipe__in=recipe_ids))
+    return rows
+
+
+def recipe_deleted(recipe):
+    """
+    Applies the side effects of the favorites and cart rows deleted in
+    the cascade of a recipe, with one query per kind for all users.
+    The recipe counters go with the recipe.
+    """
+    cart_users = list(ShoppingCart.objects.filter(
+        recipe=recipe).values_list('user', flat=True))
+    if cart_users:
+        shopping_list.change_amounts(cart_users, {
+            ingredient_id: -amount for ingredient_id, amount
+            in shopping_list.get_amounts([recipe.pk]).items()})
+        ShoppingCartVersion.objects.bump(user__in=cart_users)
+        relations_changed.send(sender=ShoppingCart, user_ids=cart_users)
+    favorite_users = list(Favourite.objects.filter(
+        recipe=recipe).values_list('user', flat=True))
+    if favorite_users:
+        relations_changed.send(sender=Favourite, user_ids=favorite_users)
+
+
+def user_deleted(user):
+    """
+    Uncounts the favorites and cart rows deleted in the cascade
+    of a user, with one update per counter.
+    """
+    for model, field in COUNTERS.items():
+        change_recipe_counter(field, model.objects.filter(
+            user=user).values('recipe'), -1)
@@ -0,0 +1,133 @@
+from itertools import islice
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+from django.db.models.functions import Greatest
+
+from .models import (
+    Recipe, RecipeIngredient, ShoppingCart, ShoppingCartVersion,
+    ShoppingListItem)
+
+BATCH_SIZE = 1000
+
+
+def get_amounts(recipe_ids):
+    """
+    Returns {ingredient id: amount} summed over the given recipes.
+    """
+    return dict(RecipeIngredient.objects.filter(
+        recipe__in=recipe_ids).order_by().values('ingredient').annotate(
+        total=Sum('amount')).values_list('ingredient', 'total'))
+
+
+def change_amounts(user_ids, amounts):
+    """
+    Adds amounts, {ingredient id: delta}, to the shopping lists of
+    the given users with one insert of the missing rows and one update.
+
+    Rows that drop to zero are kept, they are hidden on read.
+    """
+    amounts = {ingredient_id: delta for ingredient_id, delta
+               in amounts.items() if delta}
+    user_ids = list(user_ids)
+    if not amounts or not user_ids:
+        return
+    ShoppingListItem.objects.bulk_create(
+        (ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id)
+         for user_id in user_ids
+         for ingredient_id, delta in amounts.items() if delta > 0),
+        batch_size=BATCH_SIZE, ignore_conflicts=True)
+    delta = Case(*(When(ingredient=ingredient_id, then=Value(delta))
+                   for ingredient_id, delta in amounts.items()),
+                 default=Value(0), output_field=IntegerField())
+    ShoppingListItem.objects.filter(
+        user__in=user_ids, ingredient__in=amounts).update(
+        amount=Greatest(F('amount') + delta, Value(0)))
+
+
+def lock_recipes(recipe_ids):
+    """
+    Locks the recipe rows, as a recipe edit does. A cart change then
+    either waits for a running edit and reads its amounts, or holds
+    the edit until the cart row is committed and found by
+    change_recipe().
+    """
+    list(Recipe.objects.select_for_update().filter(
+        pk__in=recipe_ids).order_by('pk').values_list('pk', flat=True))
+
+
+@transaction.atomic
+def add_recipes(user_id, recipe_ids):
+    lock_recipes(recipe_ids)
+    change_amounts([user_id], get_amounts(recipe_ids))
+
+
+@transaction.atomic
+def remove_recipes(user_id, recipe_ids):
+    lock_recipes(recipe_ids)
+    change_amounts([user_id], {
+        ingredient_id: -amount for ingredient_id, amount
+        in get_amounts(recipe_ids).items()})
+
+
+def change_recipe(recipe_id, amounts):
+    """
+    Applies the ingredient deltas of an edited recipe
+    to the shopping lists of every user who has it in the cart.
+    """
+    if amounts:
+        change_amounts(ShoppingCart.objects.filter(
+            recipe=recipe_id).values_list('user', flat=True), amounts)
+
+
+def rebuild(user_ids=None, using=DEFAULT_DB_ALIAS):
+    """
+    Recomputes shopping lists from the carts, of all users
+    or of the given ones, and returns the number of rows.
+    """
+    items = ShoppingListItem.objects.using(using)
+    # One filter() call, so both conditions apply to the same cart row.
+    carts = {'recipe__shopping__isnull': False}
+    if user_ids is not None:
+        items = items.filter(user__in=user_ids)
+        carts['recipe__shopping__user__in'] = user_ids
+    totals = RecipeIngredient.objects.using(using).filter(
+        **carts).order_by().values(
+        'recipe__shopping__user', 'ingredient').annotate(
+        total=Sum('amount')).values_list(
+        'recipe__shopping__user', 'ingredient', 'total')
+    rows = totals.iterator(chunk_size=BATCH_SIZE)
+    created = 0
+    with transaction.atomic(using=using):
+        items.delete()
+        while True:
+            batch = list(islice(rows, BATCH_SIZE))
+            if not batch:
+                return created
+            ShoppingListItem.objects.using(using).bulk_create(
+                ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id,
+                                 amount=total)
+                for user_id, ingredient_id, total in batch)
+            created += len(batch)
+
+
+def refresh_recipes(recipe_ids):
+    """
+    Rebuilds the shopping lists of the users who have the recipes
+    in the cart, used where ingredients change without a diff.
+    """
+    user_ids = set(ShoppingCart.objects.filter(
+        recipe__in=recipe_ids).values_list('user', flat=True))
+    if user_ids:
+        rebuild(user_ids)
+        ShoppingCartVersion.objects.bump(user__in=user_ids)
+
+
+def fill_shopping_lists(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    post_migrate handler building the shopping lists once, on the
+    first migrate after the table appears next to existing carts.
+    """
+    if (not ShoppingListItem.objects.using(using).exists()
+            and ShoppingCart.objects.using(using).exists()):
+        rebuild(using=using)
@@ -0,0 +1,71 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import relations, shopping_list
+from .counters import change_recipe_counter, change_recipes_count
+from .models import Favourite, Recipe, ShoppingCart, ShoppingCartVersion
+
+User = get_user_model()
+
+# Favourite and ShoppingCart have no delete receivers, so their rows
+# are fast-deleted in cascades. Direct deletes go through
+# relations.delete(), cascades are handled on Recipe and User below.
+
+
+@receiver(post_save, sender=ShoppingCart)
+def bump_cart_version(sender, instance, **kwargs):
+    ShoppingCartVersion.objects.bump(user=instance.user_id)
+
+
+@receiver(post_save, sender=ShoppingCart)
+def add_to_shopping_list(sender, instance, created, **kwargs):
+    if created:
+        shopping_list.add_recipes(instance.user_id, [instance.recipe_id])
+
+
+@receiver(pre_delete, sender=Recipe)
+def forget_deleted_recipe(sender, instance, **kwargs):
+    """
+    Runs before the delete: the ingredients of the recipe
+    go in the same cascade.
+    """
+    relations.recipe_deleted(instance)
+
+
+@receiver(pre_delete, sender=User)
+def uncount_deleted_user(sender, instance, **kwargs):
+    relations.user_deleted(instance)
+
+
+@receiver(post_save, sender=Recipe)
+def bump_carts_with_recipe(sender, instance, created, **kwargs):
+    """
+    Recipe ingredients are only edited together with the recipe itself,
+    so saving a recipe invalidates every cart that contains it.
+    """
+    if not created:
+        ShoppingCartVersion.objects.bump(user__shopping__recipe=instance)
+
+
+@receiver(post_save, sender=Favourite)
+def count_favorite(sender, instance, created, **kwargs):
+    if created:
+        change_recipe_counter('favorites_count', [instance.recipe_id], 1)
+
+
+@receiver(post_save, sender=ShoppingCart)
+def count_cart(sender, instance, created, **kwargs):
+    if created:
+        change_recipe_counter('in_carts_count', [instance.recipe_id], 1)
+
+
+@receiver(post_save, sender=Recipe)
+def count_recipe(sender, instance, created, **kwargs):
+    if created:
+        change_recipes_count(instance.author_id, 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def uncount_recipe(sender, instance, **kwargs):
+    change_recipes_count(instance.author_id, -1)
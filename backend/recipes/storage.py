@@ -0,0 +1,52 @@
+import hashlib
+import os
+import posixpath
+import uuid
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Names files by the SHA-256 of their content, so the same bytes are
+    stored once and a saved file never changes.
+
+    Saving content that is already stored returns the existing name
+    and only touches its modification time, so collect_images --min-age
+    keeps a blob that a recipe has just started to use again. New files
+    are written under a temporary name and renamed, so a stored name
+    never points to a partial file.
+    """
+    def hashed_name(self, name, content):
+        sha = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            sha.update(chunk)
+        content.seek(0)
+        digest = sha.hexdigest()
+        directory, filename = posixpath.split(name)
+        extension = posixpath.splitext(filename)[1].lower()
+        return posixpath.join(directory, digest[:2], digest + extension)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        return super().save(self.hashed_name(name, content), content,
+                            max_length)
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        try:
+            os.utime(self.path(name))
+        except FileNotFoundError:
+            pass
+        else:
+            return name
+        temp_name = super()._save(f'{name}.{uuid.uuid4().hex}.tmp', content)
+        os.replace(self.path(temp_name), self.path(name))
+        return name
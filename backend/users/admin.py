@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth import get_user_model
 
+from recipes.admin_filters import input_filter
 from .models import Subscription
 
 
@@ -9,8 +10,14 @@ User = get_user_model()
 
 class SubscriptionAdmin(admin.ModelAdmin):
     list_display = ('subscriber', 'subscribing',)
-    search_fields = ('subscriber', 'subscribing',)
-    list_filter = ('subscriber', 'subscribing',)
+    search_fields = ('subscriber__username', 'subscribing__username',)
+    list_filter = (
+        input_filter('подписчик', 'subscriber__username__istartswith'),
+        input_filter('автор', 'subscribing__username__istartswith'),
+    )
+    list_select_related = ('subscriber', 'subscribing')
+    autocomplete_fields = ('subscriber', 'subscribing')
+    show_full_result_count = False
 
 
 class UserAdmin(admin.ModelAdmin):
@@ -18,7 +25,10 @@ class UserAdmin(admin.ModelAdmin):
                                    'last_name', 'is_active', 'is_superuser',
                                    'is_staff', 'date_joined')
     search_fields = ('username', 'email')
-    list_filter = ('username', 'email')
+    list_filter = (input_filter('имя', 'username__istartswith'),
+                   input_filter('email', 'email__istartswith'),
+                   'is_active', 'is_staff')
+    show_full_result_count = False
 
 
 admin.site.register(Subscription, SubscriptionAdmin)
@@ -18,3 +18,19 @@ class Subscription(models.Model):
         constraints = [models.UniqueConstraint(
             fields=['subscriber', 'subscribing'],
             name='unique_subscriber_subscribing')]
+
+
+class UserStats(models.Model):
+    """
+    Counters of the user's objects, maintained on write.
+    """
+    user = models.OneToOneField(User,
+                                on_delete=models.CASCADE,
+                                primary_key=True,
+                                related_name='stats',
+                                verbose_name='Пользователь')
+    recipes_count = models.PositiveIntegerField(default=0,
+                                                verbose_name='Рецептов')
+
+    def __str__(self):
+        return f'{self.user} {self.recipes_count}'